@@ -1,12 +1,24 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
+import itertools
 import os
+import queue
 import subprocess
 import traceback
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from file_parser import ParserManager, LuaFileParser, FileParser, CParser,CPlusPlusParser, PythonFileParser
-import pandas as pd
-import msvcrt
+from parse_cache import ParseCache
+from symbol_index import SymbolIndex
+from rename_engine import RenameEngine
+from piece_table import PieceTable
+from mapped_lines import MappedLines, get_mapped_lines, forget_mapped_lines
+from directory_scanner import get_directory_index, update_directory_index
+from fs_watcher import watch_root
+from qt_delegates import VirtualTable
+from parse_worker import ParseWorker, TreeIndexer
 import atexit
+from file_commit import CommitBatch
 
 class ApplyChangesDialog(simpledialog.Dialog):
     def body(self, master):
@@ -46,66 +58,187 @@ class Change:
 class FileChange:
     def __init__(self, file_path):
         self.file_path = file_path
-        self.changes = {}  # Dictionary to store changes by line number
+        self.changes = []  # Changes in the order they were made
+        self.original = None  # MappedLines of the file on disk
+        self.document = None  # PieceTable of the original lines with the changes applied
+        self.text_cache = None  # (fingerprint, number of changes, text) of the last materialized document
+        self.written = 0  # Number of leading changes the last commit wrote, for finish_commit to drop
+        self.load()
+
+    def load(self):
+        # Read the file again and replay the changes over its current content. The previous lines are
+        # left to a table that may still show the previous document, and freed once nothing does.
+        self.original = get_mapped_lines(self.file_path)
+        self.document = PieceTable(self.original)
+        for change in self.changes:
+            self.apply_to_document(change)
+
+    def snapshot(self):
+        # (MappedLines, PieceTable, number of changes): a private copy of the file with the changes so far
+        # replayed over it, for a commit thread to write while the shared lines stay in use
+        changes = list(self.changes)
+        original = MappedLines(self.file_path)
+        document = PieceTable(original)
+        for change in changes:
+            apply_change(document, change)
+        return original, document, len(changes)
+
+    def refresh(self):
+        # Reload if the file changed on disk since it was read, or its lines were closed; returns whether it did
+        if self.original.is_current(self.file_path):
+            return False
+        self.load()
+        return True
+
+    def text(self):
+        # The document as one string, kept until the file or the change set changes
+        key = (self.original.fingerprint, len(self.changes))
+        if self.text_cache is None or self.text_cache[:2] != key:
+            self.text_cache = key + (self.document.text(),)
+        return self.text_cache[2]
+
+    def close(self):
+        if self.original is not None:
+            self.original.close()
+
+    def apply(self, change):
+        self.apply_to_document(change)
+        self.changes.append(change)
+
+    def apply_to_document(self, change):
+        apply_change(self.document, change)
+
+
+def apply_change(document, change):
+    # Line numbers are 0-based lines of the document as it was when the change was made
+    if change.change_type == 'delete':
+        document.delete(change.line_number)
+    else:
+        # New content typed into the table has no line ending; keep one line per record
+        new_content = change.new_content if change.new_content.endswith('\n') else change.new_content + '\n'
+        if change.change_type == 'insert':
+            document.insert(change.line_number, [new_content])
+        else:  # 'edit'
+            document.replace(change.line_number, new_content)
+
 
 def write_to_file(file_path, data):
-    with open(file_path, 'w') as file:
-        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
-        file.write(data)
-        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    # Replace the file atomically with data
+    batch = CommitBatch()
+    batch.stage(file_path, [data])
+    return not batch.commit()[1]
         
 class ChangeManager:
-    def __init__(self):
+    def __init__(self, parser_manager=None):
         self.file_changes = {}  # Dictionary to store FileChange objects by file path
+        self.parser_manager = parser_manager
+        self.parse_results = {}  # Parse of the phantom content of each changed file, by file path
+        self.commit_batch = None  # CommitBatch of a resolve_changes in progress
 
-    def add_change(self, file_path, line_number, old_content, new_content, change_type):
+    def get_file_change(self, file_path):
         if file_path not in self.file_changes:
             self.file_changes[file_path] = FileChange(file_path)
-        change = Change(line_number, old_content, new_content, change_type)
-        self.file_changes[file_path].changes[line_number] = change
-        
+        return self.file_changes[file_path]
 
-    def rename_variable(self, old_name, new_name, file_paths):
-        for file_path in file_paths:
-            if file_path not in self.file_changes:
-                self.file_changes[file_path] = FileChange(file_path)
-            with open(file_path, 'r') as file:
-                lines = file.readlines()
-            for i, line in enumerate(lines):
-                if old_name in line:
-                    new_line = line.replace(old_name, new_name)
-                    change = Change(i, line, new_line, 'edit')
-                    self.file_changes[file_path].changes[i] = change
+    def add_change(self, file_path, line_number, old_content, new_content, change_type):
+        self.add_changes(file_path, [Change(line_number, old_content, new_content, change_type)])
+
+    def add_changes(self, file_path, changes):
+        # Apply a batch of changes to one file in order and reparse it once, over the lines they touch
+        if not changes:
+            return
+        if self.commit_batch is not None:
+            # The commit decides which changes it wrote by their count, so none may come in meanwhile
+            raise RuntimeError(f"Cannot change {file_path} while changes are being written")
+        file_change = self.get_file_change(file_path)
+        first_line = last_line = None
+        line_delta = 0
+        for change in changes:
+            file_change.apply(change)
+            line_number = change.line_number
+            shift = {'insert': 1, 'delete': -1}.get(change.change_type, 0)
+            if last_line is not None and last_line >= line_number:
+                last_line += shift  # Lines already touched move with the lines after the change
+            first_line = line_number if first_line is None else min(first_line, line_number)
+            last_line = line_number if last_line is None else max(last_line, line_number)
+            line_delta += shift
+        self.reparse(file_path, first_line, last_line, line_delta)
+
+    def reparse(self, file_path, first_line, last_line=None, line_delta=0):
+        # Re-classify the phantom content of the file from the parser checkpoint before the change
+        if self.parser_manager is None:
+            return
+        if last_line is None:
+            last_line = first_line
+        previous = self.parse_results.get(file_path)
+        if previous is None:
+            previous = self.parser_manager.parse(file_path)
+
+        buffer = self.file_changes[file_path].text()
+        parser = self.parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+        # Change line numbers are 0-based, parser line numbers 1-based
+        self.parse_results[file_path] = parser.reparse(file_path, previous, buffer, first_line + 1, last_line + 1, line_delta)
+
+    def get_parse_result(self, file_path):
+        self.phantom_resolve(file_path)  # Brings the parse up to date if the file changed on disk
+        return self.parse_results.get(file_path)
+
+    def find_occurrences(self, name, file_paths=None, cancel_event=None):
+        # (file_path, line_number, column, kind) of name in the indexed files, line numbers 1-based.
+        # With file_paths, only those files are searched, and the ones not indexed since their last
+        # save are parsed first, so the answer does not depend on how far background indexing got.
+        symbol_index = self.parser_manager.symbol_index if self.parser_manager is not None else None
+        if symbol_index is None:
+            return []
+        if file_paths is None:
+            return symbol_index.find(name)
+        file_paths = set(file_paths)
+        stale = [file_path for file_path in file_paths
+                 if os.path.isfile(file_path) and not symbol_index.is_current(file_path)]
+        for _ in self.parser_manager.parse_many(stale, cancel_event=cancel_event):
+            pass
+        return [row for row in symbol_index.find(name) if row[0] in file_paths]
+
+    def rename_variable(self, old_name, new_name, file_paths, workers=None, cancel_event=None, progress=None):
+        # Rename whole identifiers only, files being matched in a process pool. The edits of each file are
+        # added as one batch as soon as it is done, so a cancelled rename keeps the files already renamed.
+        # progress(done, total) is called after each file. Returns the number of lines changed.
+        engine = RenameEngine(self.parser_manager or ParserManager(), workers)
+        # Files with pending changes are renamed in their phantom content, not the one on disk
+        buffers = {file_path: file_change.text() for file_path, file_change in self.file_changes.items()}
+        changed = 0
+        for file_path, renames in engine.iter_renames(old_name, new_name, file_paths, cancel_event, progress, buffers):
+            if renames:
+                self.add_changes(file_path, [Change(i, old_line, new_line, 'edit') for i, old_line, new_line in renames])
+                changed += len(renames)
+        return changed
 
     def phantom_resolve(self, file_path):
-        # Check if there are any changes for the given file
+        # The file's lines with its pending changes applied, as a PieceTable, or None if it has none.
+        # Like a dict of lines by 0-based index, it supports get(); lines are only decoded when
+        # asked for, so an unchanged file costs a stat and no reads.
         file_change = self.file_changes.get(file_path)
         if file_change is None:
             return None
+        if file_change.refresh() and self.parser_manager is not None:
+            # Changed on disk, so the changes now sit over other content and the parse starts over
+            parser = self.parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+            self.parse_results[file_path] = parser.parse_buffer(file_path, file_change.text())
+        return file_change.document
+
+    def phantom_text(self, file_path):
+        # phantom_resolve as one string, or None
+        if self.phantom_resolve(file_path) is None:
+            return None
+        return self.file_changes[file_path].text()
 
-        # Read the file lines into a dictionary
-        with open(file_path, 'r') as file:
-            lines = {i: line for i, line in enumerate(file.readlines())}
-
-        # Apply the changes to the dictionary
-        for line_number, change in sorted(file_change.changes.items()):
-            if change.change_type == 'delete':
-                lines[line_number] = '\n'  # Replace the content with a newline
-            elif change.change_type == 'insert':
-                lines[line_number] = change.new_content
-            else:  # 'edit'
-                lines[line_number] = change.new_content
-
-        # Return the final record
-        return lines
     def insert_line(self, line_number, new_line, file_path):
-        if file_path not in self.file_changes:
-            self.file_changes[file_path] = FileChange(file_path)
-        change = Change(line_number, None, new_line, 'insert')
-        self.file_changes[file_path].changes[line_number] = change
+        self.add_change(file_path, line_number, None, new_line, 'insert')
         
-    def resolve_changes(self, master):
+    def resolve_changes(self, master, group_fsync=False):
+        # Write the files the user confirms one dialog at a time, in one CommitBatch
         skip_dialogs = False
+        confirmed = []
         for file_change in self.file_changes.values():
             if not skip_dialogs:
                 dialog = ApplyChangesDialog(master, file_change.file_path)
@@ -115,19 +248,101 @@ class ChangeManager:
                 save, skip_dialogs = dialog.result
                 if not save:
                     continue
-            with open(file_change.file_path, 'r') as file:
-                lines = file.readlines()
-            for line_number, change in sorted(file_change.changes.items()):
-                if change.change_type == 'delete':
-                    lines[line_number] = '\n'  # Replace the content with a newline
-                elif change.change_type == 'insert':
-                    lines.insert(line_number, change.new_content)
-                else:  # 'edit'
-                    lines[line_number] = change.new_content
-            with open(file_change.file_path, 'w') as file:
-                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
-                file.writelines(lines)
-                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            confirmed.append(file_change.file_path)
+
+        summary = self.commit_files(confirmed, workers=1, group_fsync=group_fsync)
+        self.finish_commit(summary)
+        return [file_path for file_path, error in summary.items() if error is None]
+
+    def commit_files(self, file_paths, workers=None, transactional=False, group_fsync=False, progress=None, cancel_event=None):
+        # Write the pending changes of file_paths without asking, and return {file_path: None, or the error
+        # as a string}. Files are streamed from their documents into temp files by a pool of threads and
+        # then replaced atomically in one CommitBatch; group_fsync flushes them all at once, for large
+        # change sets. A file that fails leaves the others written, unless transactional is set, in which
+        # case nothing is written. progress(done, total) is called from the pool threads as each file is
+        # staged, and setting cancel_event before the last one writes nothing.
+        # Safe to run off the Tk thread, as each file is written from a private copy and a copy of its
+        # changes; pass the summary to finish_commit on the Tk thread afterwards.
+        file_changes = [self.file_changes[file_path] for file_path in file_paths if file_path in self.file_changes]
+        summary = {file_change.file_path: None for file_change in file_changes}
+        if not file_changes:
+            return summary
+        total = len(file_changes)
+        done = [0]
+        done_lock = threading.Lock()
+
+        def stage(file_change):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            try:
+                # Read afresh, so content changed on disk since the shared lines were read is written over
+                original, document, count = file_change.snapshot()
+                file_change.written = count
+                # Written back in the file's own encoding, BOM and line endings
+                lines = itertools.chain([original.bom], document) if original.bom else document
+                batch.stage(file_change.file_path, lines, original.encoding, original.newline)
+            except OSError as e:
+                print(f"Error writing {file_change.file_path}: {e}")
+                summary[file_change.file_path] = str(e)
+            finally:
+                with done_lock:
+                    done[0] += 1
+                    count = done[0]
+                if progress is not None:
+                    progress(count, total)
+
+        self.commit_batch = batch = CommitBatch(group_fsync)
+        try:
+            workers = max(1, min(workers or min(32, (os.cpu_count() or 1) + 4), total))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(stage, file_changes):
+                    pass
+
+            failed = [file_path for file_path, error in summary.items() if error is not None]
+            if cancel_event is not None and cancel_event.is_set():
+                return {file_path: error or 'Cancelled' for file_path, error in summary.items()}
+            if transactional and failed:
+                return {file_path: error or f"Not written, {failed[0]} failed" for file_path, error in summary.items()}
+
+            _, commit_failed = batch.commit(transactional)
+            for file_path, error in commit_failed:
+                summary[file_path] = str(error)
+            return summary
+        finally:
+            batch.abort()
+            self.commit_batch = None
+
+    def finish_commit(self, summary):
+        # Drop the changes commit_files wrote, which are now the content on disk
+        for file_path, error in summary.items():
+            file_change = self.file_changes.get(file_path)
+            if file_change is None:
+                continue
+            written, file_change.written = file_change.written, 0
+            if error is None and written == len(file_change.changes):
+                del self.file_changes[file_path]
+                self.parse_results.pop(file_path, None)
+                continue
+            try:
+                if error is None:
+                    # Changes made after the snapshot apply to the content just written
+                    file_change.changes = file_change.changes[written:]
+                    file_change.load()
+                    if self.parser_manager is not None:
+                        parser = self.parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+                        self.parse_results[file_path] = parser.parse_buffer(file_path, file_change.text())
+                else:
+                    # Failed files keep their changes, over the file as it now is
+                    file_change.refresh()
+            except OSError as e:
+                print(f"Error reading {file_path}: {e}")
+
+    def close(self):
+        # Release the locks of an interrupted commit and the lines of the changed files
+        if self.commit_batch is not None:
+            self.commit_batch.abort()
+        for file_change in self.file_changes.values():
+            file_change.close()
 
 
 class DirectoryAndFileTypesDialog(simpledialog.Dialog):
@@ -183,13 +398,8 @@ class DirectoryAndFileTypesDialog(simpledialog.Dialog):
         self.directory = self.directory_entry.get()
         print(f"Directory: {self.directory}")  # Print the directory
 
-        self.file_types = set()
-        for dirpath, dirnames, filenames in os.walk(self.directory):
-            for filename in filenames:
-                file_extension = os.path.splitext(filename)[1]
-                if file_extension in self.master.file_types:
-                    self.file_types.add(file_extension)
-        self.file_types = list(self.file_types)
+        extensions = get_directory_index(self.directory).extensions()
+        self.file_types = [file_extension for file_extension in extensions if file_extension in self.master.file_types]
         print(f"File types: {self.file_types}")  # Print the file types
 
         self.master.on_directory_and_file_types_selected(self.directory, self.file_types)
@@ -204,6 +414,12 @@ class DirectoryAndFileTypesDialog(simpledialog.Dialog):
 
 
 class CoreEditor(tk.Frame):
+    selection_delay = 150  # Milliseconds a selection must stay current before it is parsed
+    poll_interval = 30  # Milliseconds between checks for finished parses
+    group_fsync_files = 200  # Commits of at least this many files flush them with one group fsync
+    transactional_commit = False  # Whether a commit that fails for one file writes no file at all
+    watch_interval = 250  # Milliseconds between checks for files changed on disk
+
     def __init__(self, master, selected_files, directory, file_types):
         super().__init__(master)
 
@@ -213,10 +429,20 @@ class CoreEditor(tk.Frame):
         self.directory = directory
         self.file_types = file_types
         self.records = []
-        self.parser_manager = ParserManager()  # Create an instance of ParserManager
-        self.change_manager = ChangeManager()
+        self.parser_manager = ParserManager(cache=ParseCache(), symbol_index=SymbolIndex())  # Create an instance of ParserManager backed by the on-disk parse cache and symbol index
+        self.change_manager = ChangeManager(self.parser_manager)
+        self.parse_worker = ParseWorker(self.parser_manager)  # Parses selected files off the Tk thread
+        self.indexer = TreeIndexer(self.parser_manager)  # Indexes the symbols of the tree's files off the Tk thread
+        self.selection_after_id = None
+        self.poll_after_id = None
+        self.commit_thread = None  # Thread running commit_all_changes, if any
+        self.commit_cancel_event = None
+        self.commit_queue = queue.Queue()  # (done, total) progress, then the summary, from the commit thread
     
         self.file_paths = {}  # Dictionary to store file paths by item ID
+        self.tree_items = {}  # Item IDs by file path, the reverse of file_paths
+        self.watcher = None  # Subscription to the FileWatcher of the directory shown in the tree
+        self.watch_after_id = None
         self.tree_view = ttk.Treeview(self, selectmode='extended')
         self.tree_view.grid(row=0, column=0, sticky='nsew')
         self.tree_view.bind('<<TreeviewSelect>>', self.on_tree_view_clicked)
@@ -225,7 +451,7 @@ class CoreEditor(tk.Frame):
         
         # Create a frame for the buttons and set its layout to vertical stacking
         self.button_frame = ttk.Frame(self)
-        self.button_frame.grid(row=1, column=0, columnspan=2, sticky='ew')
+        self.button_frame.grid(row=1, column=0, columnspan=3, sticky='ew')
 
         
         # Add the Change Root button to the frame
@@ -243,6 +469,9 @@ class CoreEditor(tk.Frame):
         self.apply_changes_button = ttk.Button(self.button_frame, text='Apply Changes to Records', command=self.on_apply_changes_clicked)
         self.apply_changes_button.pack(side='left', padx=(0, 10))
 
+        self.status_label = ttk.Label(self.button_frame, text='')
+        self.status_label.pack(side='left', padx=(0, 10))
+
         # Configure the grid to distribute extra space equally among columns and rows
         self.grid_columnconfigure(0, weight=1)
         self.grid_columnconfigure(1, weight=1)
@@ -250,12 +479,10 @@ class CoreEditor(tk.Frame):
 
         self.populate_tree_view(self.directory)
     def release_all_locks(self):
-        for file_change in self.change_manager.file_changes.values():
-            with open(file_change.file_path, 'a') as file:  # Open the file in append mode
-                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.change_manager.close()
 
     def save(self):
-        self.change_manager.resolve_changes(self)
+        self.commit_all_changes()  # Pending changes are only written as one confirmed background batch
 
 
     def show_dialog(self):
@@ -263,9 +490,6 @@ class CoreEditor(tk.Frame):
         # Wait for the dialog to be destroyed before accessing its attributes
         self.wait_window(dialog)
         self.on_directory_and_file_types_selected(dialog.directory, dialog.file_types)
-        self.directory = dialog.directory
-        self.file_types = dialog.file_types
-        self.populate_tree_view(self.directory)
 
     def on_directory_and_file_types_selected(self, directory, file_types):
         self.directory = directory
@@ -275,15 +499,81 @@ class CoreEditor(tk.Frame):
         else:
             self.populate_tree_view(self.directory)
     
-    def populate_tree_view(self, directory):
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                file_extension = os.path.splitext(filename)[1]
-                if file_extension in self.file_types:
-                    relative_path = os.path.relpath(os.path.join(dirpath, filename), directory)
-                    file_path = os.path.join(dirpath, filename)
-                    item_id = self.tree_view.insert('', 'end', text=relative_path)
-                    self.file_paths[item_id] = file_path  # Store the file path in the dictionary
+    def populate_tree_view(self, directory, refresh=False):
+        # Replace the items of the tree with the files of directory, which are then kept up to date by a watcher
+        self.tree_view.delete(*self.tree_view.get_children())
+        self.file_paths.clear()
+        self.tree_items.clear()
+        for entry in get_directory_index(directory, refresh).files_with_extensions(self.file_types):
+            self.insert_tree_item(entry.path, directory)
+        self.indexer.index(self.tree_items)
+        self.watch_directory(directory)
+
+    def insert_tree_item(self, file_path, directory):
+        relative_path = os.path.relpath(file_path, directory)
+        item_id = self.tree_view.insert('', 'end', text=relative_path)
+        self.file_paths[item_id] = file_path  # Store the file path in the dictionary
+        self.tree_items[file_path] = item_id
+
+    def watch_directory(self, directory):
+        # Watch the directories of the files shown, and those above them up to directory, where new
+        # directories may bring more; files appearing anywhere else are found by the next scan
+        if self.watcher is not None:
+            self.watcher.stop()
+        directory = os.path.abspath(directory)  # As the directory index reports its paths
+        self.watcher = watch_root(directory)  # Shared with any other view of the same tree
+        root_prefix = os.path.join(directory, '')
+        watched = {directory}
+        for file_path in self.tree_items:
+            parent = os.path.dirname(file_path)
+            while parent not in watched and parent.startswith(root_prefix):
+                watched.add(parent)
+                parent = os.path.dirname(parent)
+        for parent in watched:
+            self.watcher.watch(parent)
+        if self.watch_after_id is None:
+            self.watch_after_id = self.after(self.watch_interval, self.poll_file_system)
+
+    def poll_file_system(self):
+        self.watch_after_id = None
+        changes = self.watcher.poll()
+        if changes is None:
+            # Events were dropped, so nothing short of a new scan can be trusted
+            print(f"Lost track of changes in {self.directory}, scanning it again")
+            self.populate_tree_view(self.directory, refresh=True)
+            return
+        if changes:
+            self.apply_file_system_changes(changes)
+        self.watch_after_id = self.after(self.watch_interval, self.poll_file_system)
+
+    def apply_file_system_changes(self, changes):
+        # Patch the tree and the caches for the paths that changed, leaving every other item alone.
+        # A new directory is reported alone, so it is watched and its files are taken as added.
+        for path, kind in list(changes.items()):
+            if kind == 'added' and os.path.isdir(path) and not os.path.islink(path):
+                for file_path in self.watcher.watch_tree(path):
+                    changes.setdefault(file_path, 'added')
+        update_directory_index(changes)
+        removed = tuple(os.path.join(path, '') for path, kind in changes.items() if kind == 'removed')
+        gone = [file_path for file_path in self.tree_items
+                if changes.get(file_path) == 'removed' or file_path.startswith(removed)]
+        for file_path in gone:
+            item_id = self.tree_items.pop(file_path)
+            del self.file_paths[item_id]
+            self.tree_view.delete(item_id)
+
+        for file_path, kind in changes.items():
+            if kind != 'removed' and file_path not in self.tree_items and \
+                    os.path.splitext(file_path)[1] in self.file_types and os.path.isfile(file_path):
+                self.insert_tree_item(file_path, self.directory)
+
+        # The index work is queued for the indexer thread, so a checkout of thousands of files does not
+        # hold up the Tk loop: removed files are dropped in one transaction and changed ones indexed again
+        removed = set(gone).union(file_path for file_path, kind in changes.items() if kind == 'removed')
+        self.indexer.update([file_path for file_path in changes if file_path in self.tree_items], removed)
+        for file_path in set(changes) | set(gone):
+            if file_path not in self.change_manager.file_changes:
+                forget_mapped_lines(file_path)  # Files with pending changes read theirs again on their next use
 
     def on_edit_field(self, new_value, column_name):
         # Get all selected items from the tree_view
@@ -298,49 +588,127 @@ class CoreEditor(tk.Frame):
         
         
     def on_apply_changes_clicked(self):
-        self.core_editor.save()
-        
-    def populate_table(self, filename):
-        for i in self.table_widget.get_children():
-            self.table_widget.delete(i)
-
-        file_path = os.path.join(self.directory, filename)
-        file_extension = os.path.splitext(filename)[1]
-        parser = self.parser_manager.get_parser(file_extension, file_path)
-
-        parsed_data = parser.parse_file(file_path)  # Pass the file_path argument
+        self.commit_all_changes()
 
+    def commit_all_changes(self):
+        # Ask once, then write every changed file on a background thread, reporting progress in the status label
+        file_paths = list(self.change_manager.file_changes)
+        if not file_paths or self.commit_thread is not None:
+            return
+        if not messagebox.askyesno('Apply Changes', f'Write the pending changes of {len(file_paths)} files?'):
+            return
 
-        print(f"Parsed data: {parsed_data}")  # Add this line
+        self.apply_changes_button.state(['disabled'])
+        self.commit_cancel_event = threading.Event()
+        progress = lambda done, total: self.commit_queue.put((done, total))
+
+        def run():
+            try:
+                summary = self.change_manager.commit_files(file_paths, transactional=self.transactional_commit,
+                                                           group_fsync=len(file_paths) >= self.group_fsync_files,
+                                                           progress=progress, cancel_event=self.commit_cancel_event)
+            except Exception as e:
+                print(f"Error applying changes: {e}")
+                summary = {file_path: str(e) for file_path in file_paths}
+            self.commit_queue.put(summary)
+
+        self.commit_thread = threading.Thread(target=run, daemon=True)
+        self.commit_thread.start()
+        self.after(self.poll_interval, self.poll_commit)
+
+    def poll_commit(self):
+        summary = None
+        while True:
+            try:
+                item = self.commit_queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, dict):
+                summary = item
+            else:
+                self.status_label.config(text=f'Writing {item[0]}/{item[1]} files')
+        if summary is None:
+            self.after(self.poll_interval, self.poll_commit)
+            return
 
-        if file_extension not in self.parser_manager.parsers:
-            parsed_data = pd.DataFrame([('', '', '', '')], columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-        else:
-            parsed_data = pd.DataFrame(parsed_data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+        self.commit_thread = None
+        self.change_manager.finish_commit(summary)
+        self.refresh_table()
+        self.apply_changes_button.state(['!disabled'])
+        failed = {file_path: error for file_path, error in summary.items() if error is not None}
+        self.status_label.config(text=f'Wrote {len(summary) - len(failed)} of {len(summary)} files')
+        if failed:
+            details = '\n'.join(f'{file_path}: {error}' for file_path, error in list(failed.items())[:20])
+            more = f'\n... and {len(failed) - 20} more' if len(failed) > 20 else ''
+            messagebox.showwarning('Apply Changes', f'{len(failed)} files were not written:\n{details}{more}')
+        
+    def refresh_table(self):
+        # Show the selected files again, now that their content on disk and pending changes are others
+        self.table_widget.clear()
+        file_paths = [self.file_paths[item] for item in self.tree_view.selection() if item in self.file_paths]
+        if file_paths:
+            mode = 'parse' if len(file_paths) == 1 else 'variables'
+            self.parse_worker.submit([(file_path, mode) for file_path in file_paths])
+            if self.poll_after_id is None:
+                self.poll_after_id = self.after(self.poll_interval, self.poll_parse_results)
 
-        for index, row in parsed_data.iterrows():
-            self.table_widget.insert('', 'end', values=row.tolist())
-            
     def on_tree_view_clicked(self, event):
+        # Debounce: the selection is only handled once it has stayed the same for selection_delay
+        if self.selection_after_id is not None:
+            self.after_cancel(self.selection_after_id)
+        self.selection_after_id = self.after(self.selection_delay, self.on_selection_settled)
+
+    def on_selection_settled(self):
+        self.selection_after_id = None
         selected_items = self.tree_view.selection()
         print(f"Selected items: {selected_items}")  # Print the selected items
+        jobs = []
         if len(selected_items) == 1:
             selected_item = selected_items[0]
             file_path = self.file_paths.get(selected_item)  # Retrieve the file path from the dictionary
             print(f"Selected item: {selected_item}, File path: {file_path}")  # Print the selected item and file path
             if file_path:
-                self.change_manager.resolve_changes(file_path)  # Resolve changes for the selected file
-                self.populate_table(file_path)  # Call populate_table when a single item is selected
+                if self.change_manager.get_parse_result(file_path) is not None:
+                    self.parse_worker.cancel()
+                    self.populate_table(file_path)  # Already parsed with its pending changes
+                else:
+                    jobs.append((file_path, 'parse'))  # populate_table runs when a single item is parsed
         elif len(selected_items) > 1:
             for selected_item in selected_items:
                 file_path = self.file_paths.get(selected_item)  # Retrieve the file path from the dictionary
                 print(f"Selected item: {selected_item}, File path: {file_path}")  # Print the selected item and file path
                 if file_path:
-                    self.change_manager.resolve_changes(file_path)  # Resolve changes for the selected file
-                    self.populate_table_with_variables(file_path)  # Call populate_table_with_variables when multiple items are selected
+                    jobs.append((file_path, 'variables'))  # populate_table_with_variables runs when multiple items are selected
         else:
             print("No item selected in the tree view.")
 
+        if jobs:
+            # Any parse still running for an earlier selection is cancelled
+            self.parse_worker.submit(jobs)
+            if self.poll_after_id is None:
+                self.poll_after_id = self.after(self.poll_interval, self.poll_parse_results)
+
+    def poll_parse_results(self):
+        self.poll_after_id = None
+        for file_path, mode, result in self.parse_worker.poll():
+            if mode == 'variables':
+                self.populate_table_with_variables(file_path, result)
+            else:
+                self.populate_table(file_path, result)
+        if self.parse_worker.is_busy():
+            self.poll_after_id = self.after(self.poll_interval, self.poll_parse_results)
+
+    def destroy(self):
+        self.parse_worker.shutdown()
+        self.indexer.shutdown()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.watch_after_id is not None:
+            self.after_cancel(self.watch_after_id)
+        if self.commit_cancel_event is not None:
+            self.commit_cancel_event.set()
+        super().destroy()
+
 
 
     def on_tree_view_right_click(self, event):
@@ -352,24 +720,14 @@ class CoreEditor(tk.Frame):
 
     def get_file_content(self, filename, apply_soft_changes=True):
         file_path = os.path.join(self.directory, filename)
-        file_extension = os.path.splitext(filename)[1]
-        parser = self.parser_manager.get_parser(file_extension, file_path)
-
-        parsed_data = parser.parse_file(file_path)  # Parse the file using the parser
-
         content = ""
         if apply_soft_changes:
-            changes = self.change_manager.file_changes.get(file_path)
-
-            if changes:
-                for line_number, change in sorted(changes.changes.items()):
-                    if change.change_type == 'delete':
-                        parsed_data[line_number] = '\n'  # Replace the content with a newline
-                    elif change.change_type == 'insert':
-                        parsed_data.insert(line_number, change.new_content)
-                    else:  # 'edit'
-                        parsed_data[line_number] = change.new_content
+            phantom_text = self.change_manager.phantom_text(file_path)
+            if phantom_text is not None:
+                return phantom_text
 
+            parsed_data = self.parser_manager.parse(file_path)  # Parse the file, or load it from the parse cache
+            parsed_data = [parsed_data.get_line(i) for i in range(len(parsed_data))]
             for line in parsed_data:
                 content += line + "\n"  # Concatenate each line with a newline character
         else:
@@ -413,44 +771,36 @@ class CoreEditor(tk.Frame):
 
         # Bind the right-click event to the table_widget instead of the tree_view
         self.table_widget.bind("<Button-3>", self.show_context_menu)
-    def populate_table_with_variables(self, file_path):
-        # Clear the table
-        for i in self.table_widget.get_children():
-            self.table_widget.delete(i)
-
+    def populate_table_with_variables(self, file_path, variables=None):
         file_extension = os.path.splitext(file_path)[1]
         parser = self.parser_manager.get_parser(file_extension, file_path)
-        variables = parser.get_variables(file_path)  # Get the variables from the file
-
-        # Get the phantom record for the file
-        phantom_record = self.change_manager.phantom_resolve(file_path)
-        if phantom_record is not None:
-            for line_number, new_content in phantom_record.items():
-                variables[line_number] = new_content
-
-        for _, variable in variables.iterrows():
-            # Add the variable to the table
-            self.table_widget.insert('', 'end', values=(variable['FileName'], variable['Extension'], variable['Type'], variable['LiteralLine']))
+        # Files with pending changes list the variables of their phantom content, so each row holds
+        # its own line and line number rather than a line of the file on disk
+        phantom_text = self.change_manager.phantom_text(file_path)
+        if phantom_text is not None:
+            variables = parser.get_buffer_variables(file_path, phantom_text)
+        elif variables is None:
+            variables = parser.get_variables(file_path)  # Get the variables from the file
+
+        # The table only creates items for the rows in view
+        self.table_widget.set_model(variables)
     
 
-    def populate_table(self, file_path):
-        # Clear the table
-        for i in self.table_widget.get_children():
-            self.table_widget.delete(i)
-
-        file_extension = os.path.splitext(file_path)[1]
-        parser = self.parser_manager.get_parser(file_extension, file_path)
-        parsed_data = parser.parse_file(file_path)  # Get the parser output
+    def populate_table(self, file_path, parsed_data=None):
+        # Files with pending changes keep an incrementally updated parse of their phantom content
+        phantom_data = self.change_manager.get_parse_result(file_path)
+        final_record = None
+        if phantom_data is not None:
+            parsed_data = phantom_data
+        else:
+            if parsed_data is None:
+                parsed_data = self.parser_manager.parse(file_path)  # Get the parser output, from the parse cache when unchanged
 
-        # Get the final record using phantom_resolve
-        final_record = self.change_manager.phantom_resolve(file_path)
-        if final_record is not None:
-            for line_number, new_content in final_record.items():
-                parsed_data[line_number] = new_content
+            # Get the final record using phantom_resolve
+            final_record = self.change_manager.phantom_resolve(file_path)
 
-        for _, data in parsed_data.iterrows():
-            # Add the data to the table
-            self.table_widget.insert('', 'end', values=(data['FileName'], data['Extension'], data['Type'], data['LiteralLine']))
+        # The table only creates items for the rows in view; final_record is keyed by 0-based line index
+        self.table_widget.set_model(parsed_data, final_record)
 
 
     def show_context_menu(self, event):
@@ -492,7 +842,7 @@ class CoreEditor(tk.Frame):
 
 
     def create_table(self):
-        self.table_widget = ttk.Treeview(self, columns=("FileName", "Extension", "Type", "LiteralLine"))
+        self.table_widget = VirtualTable(self, columns=("FileName", "Extension", "Type", "LiteralLine"))
         self.table_widget['show'] = 'headings'
         self.table_widget.column("FileName", width=50)
         self.table_widget.column("Extension", width=50)
@@ -507,6 +857,7 @@ class CoreEditor(tk.Frame):
         self.table_widget.heading("Type", text="Type")
         self.table_widget.heading("LiteralLine", text="Literal Line")
         self.table_widget.grid(row=0, column=1, sticky='nsew')
+        self.table_widget.scrollbar.grid(row=0, column=2, sticky='ns')
         self.table_widget.bind("<Button-3>", self.on_table_widget_right_click)
     def report_callback_exception(self, exc, val, tb):
         # Print the exception to the console
@@ -531,9 +882,4 @@ class CoreEditor(tk.Frame):
         messagebox.showinfo('Records', records_str)
 
     def get_dir_size(self, dir_path):
-        total = 0
-        for dirpath, dirnames, filenames in os.walk(dir_path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                total += os.path.getsize(fp)
-        return total
+        return get_directory_index(dir_path).total_size()
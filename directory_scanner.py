@@ -0,0 +1,176 @@
+import os
+import threading
+from collections import namedtuple
+
+FileEntry = namedtuple('FileEntry', ['path', 'directory', 'name', 'extension', 'size', 'is_symlink'])
+
+
+class DirectoryIndex:
+    """Files under a root directory, indexed by extension and directory.
+
+    Built by a single os.scandir walk that keeps the DirEntry stat results, so callers
+    never need to call splitext or getsize again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.files = []  # FileEntry objects in os.walk order
+        self.directories = [root]
+        self.by_extension = {}
+        self.by_directory = {}
+
+    def add(self, entry):
+        self.files.append(entry)
+        self.by_extension.setdefault(entry.extension, []).append(entry)
+        self.by_directory.setdefault(entry.directory, []).append(entry)
+
+    def extensions(self):
+        return list(self.by_extension)
+
+    def files_with_extensions(self, extensions):
+        return [entry for entry in self.files if entry.extension in extensions]
+
+    def files_in(self, directory):
+        return self.by_directory.get(directory, [])
+
+    def total_size(self, include_symlinks=True):
+        if include_symlinks:
+            return sum(entry.size for entry in self.files)
+        return sum(entry.size for entry in self.files if not entry.is_symlink)
+
+    def subtree(self, directory):
+        # Index of a subdirectory, built from this one without touching the disk
+        index = DirectoryIndex(directory)
+        prefix = os.path.join(directory, '')
+        index.directories = [path for path in self.directories if path == directory or path.startswith(prefix)]
+        for entry in self.files:
+            if entry.directory == directory or entry.directory.startswith(prefix):
+                index.add(entry)
+        return index
+
+    def update(self, changes):
+        # Patch the index with {path: 'added', 'removed' or 'modified'}, as FileWatcher reports them,
+        # statting only the changed paths. A removed directory takes the files under it along.
+        root_prefix = os.path.join(self.root, '')
+        gone = {path for path, kind in changes.items() if kind == 'removed'}
+        # Polling reports the files of a removed directory, but not the directory itself
+        checked = set()
+        for path in list(gone):
+            directory = os.path.dirname(path)
+            while directory.startswith(root_prefix) and directory not in checked:
+                checked.add(directory)
+                if os.path.isdir(directory):
+                    break
+                gone.add(directory)
+                directory = os.path.dirname(directory)
+        removed = tuple(os.path.join(path, '') for path in gone)
+
+        files = self.files
+        self.files = []
+        self.by_extension = {}
+        self.by_directory = {}
+        for entry in files:
+            if entry.path not in changes and not entry.path.startswith(removed):
+                self.add(entry)
+        self.directories = [path for path in self.directories
+                            if path == self.root or path not in gone and not path.startswith(removed)]
+
+        known = set(self.directories)
+        for path, kind in changes.items():
+            if kind == 'removed':
+                continue
+            entry = get_file_entry(path)
+            if entry is None:
+                continue
+            self.add(entry)
+            # New directories up to the root, which is already known
+            directory = entry.directory
+            while directory not in known and directory.startswith(root_prefix):
+                known.add(directory)
+                self.directories.append(directory)
+                directory = os.path.dirname(directory)
+
+
+def get_file_entry(path):
+    # FileEntry of one file, as scan_directory makes them, or None if path is no longer a file
+    if not os.path.lexists(path) or os.path.isdir(path):
+        return None
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        size = 0  # Broken link
+    directory, name = os.path.split(path)
+    return FileEntry(path, directory, name, os.path.splitext(name)[1], size, os.path.islink(path))
+
+
+def scan_directory(root):
+    # Walk the tree once, top-down and in the same order as os.walk, without following directory links
+    index = DirectoryIndex(root)
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError as e:
+            print(f"Error scanning {directory}: {e}")
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirectories.append(entry.path)
+                continue
+
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                size = 0  # Broken link
+            index.add(FileEntry(entry.path, directory, entry.name, os.path.splitext(entry.name)[1],
+                                size, entry.is_symlink()))
+
+        index.directories.extend(subdirectories)
+        pending.extend(reversed(subdirectories))
+    return index
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_directory_index(directory, refresh=False):
+    # Shared index for a directory; a directory under an already scanned root reuses that scan
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        if not refresh:
+            index = _indexes.get(directory)
+            if index is not None:
+                return index
+            for root, root_index in _indexes.items():
+                if directory.startswith(os.path.join(root, '')):
+                    return root_index.subtree(directory)
+
+    index = scan_directory(directory)
+    with _indexes_lock:
+        _indexes[directory] = index
+    return index
+
+
+def update_directory_index(changes):
+    # Apply changes, with absolute paths, to the shared indexes they fall under, instead of scanning again
+    with _indexes_lock:
+        for root, index in _indexes.items():
+            root_prefix = os.path.join(root, '')
+            relevant = {path: kind for path, kind in changes.items() if path.startswith(root_prefix)}
+            if relevant:
+                index.update(relevant)
+
+
+def forget_directory_index(directory):
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(directory), None)
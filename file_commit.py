@@ -0,0 +1,249 @@
+import ctypes
+import ctypes.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+STREAM_LINES = 4096  # Lines written per call, so memory stays bounded however large the file
+
+
+def load_syncfs():
+    # syncfs(2) from libc on Linux, which flushes one file system where os.sync flushes every one; None elsewhere
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        syncfs = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+    syncfs.argtypes = [ctypes.c_int]
+    return syncfs
+
+
+SYNCFS = load_syncfs()
+
+
+class FileLock:
+    # Advisory lock on an existing file: fcntl.flock on POSIX, msvcrt.locking on its first byte on Windows
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fd = None
+
+    def acquire(self):
+        if not os.path.exists(self.file_path):
+            return  # A new file has nothing to lock yet
+        self.fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except OSError:
+            os.close(self.fd)
+            self.fd = None
+            raise
+
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory):
+    # Makes a rename in directory durable; Windows cannot open directories and has nothing to do here
+    if os.name != 'nt':
+        fsync_path(directory)
+
+
+def sync_file_systems(directories):
+    # Flush the file systems holding directories with syncfs, once for each
+    devices = set()
+    for directory in directories:
+        device = os.stat(directory).st_dev
+        if device in devices:
+            continue
+        devices.add(device)
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            if SYNCFS(fd) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), directory)
+        finally:
+            os.close(fd)
+
+
+def write_temp(file_path, lines, fsync=True, encoding=None, newline=None):
+    # Stream lines into a new temp file in the directory of file_path and return its path. encoding and
+    # newline are as for open(); by default the platform's are used.
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline=newline) as file:
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) >= STREAM_LINES:
+                    file.writelines(chunk)
+                    chunk = []
+            file.writelines(chunk)
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)  # mkstemp creates the file private to the user
+    except BaseException:
+        discard_temp(temp_path)
+        raise
+    return temp_path
+
+
+def discard_temp(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+
+def make_backup(file_path):
+    # Keep the current content of file_path under a temp name, as a hard link when the file system allows
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, backup_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix='.bak', dir=directory)
+    os.close(fd)
+    os.remove(backup_path)
+    try:
+        os.link(file_path, backup_path)
+    except OSError:
+        shutil.copy2(file_path, backup_path)
+    return backup_path
+
+
+class CommitBatch:
+    """Writes a set of files so each one is either fully replaced or left as it was.
+
+    stage() locks a file and streams its new lines into a temp file next to it; commit()
+    then moves every staged file over its original with os.replace, which is atomic, and
+    syncs each directory once. Each temp file is fsynced as it is written, or with
+    group_fsync the file systems they are on are flushed once each with syncfs before the
+    first replace, which is cheaper for large change sets. Where syncfs is missing,
+    group_fsync is ignored, so the fsyncs still happen in the staging threads. Locks are
+    held from stage() until the file is replaced, except on Windows, where a file cannot be
+    replaced while it is open. stage() may be called from several threads at once.
+    """
+
+    def __init__(self, group_fsync=False):
+        self.group_fsync = group_fsync and SYNCFS is not None
+        self.staged = []  # (file_path, temp_path, lock, target), target being the file a link at file_path points to
+        self.lock = threading.Lock()
+
+    def stage(self, file_path, lines, encoding=None, newline=None):
+        # A symbolic link is written through, so the file it points to is locked and replaced, from a
+        # temp file in that file's directory, and the link is left as it is
+        target = os.path.realpath(file_path)
+        lock = FileLock(target)
+        lock.acquire()
+        try:
+            temp_path = write_temp(target, lines, not self.group_fsync, encoding, newline)
+        except BaseException:
+            lock.release()
+            raise
+        with self.lock:
+            self.staged.append((file_path, temp_path, lock, target))
+
+    def commit(self, transactional=False):
+        # Replace each staged file and return (committed, failed), failed holding (file_path, error) pairs.
+        # With transactional, the originals are kept until all files are replaced, and if one fails the
+        # files already replaced are restored, so either every file is committed or none is.
+        with self.lock:
+            staged, self.staged = self.staged, []
+        committed = []
+        failed = []
+        backups = {}  # Original content of the committed files, by path, with transactional
+        try:
+            if self.group_fsync and staged:
+                sync_file_systems({os.path.dirname(temp_path) for _, temp_path, _, _ in staged})
+
+            for file_path, temp_path, lock, target in staged:
+                try:
+                    if transactional and os.path.exists(target):
+                        backups[file_path] = make_backup(target)
+                    if os.name == 'nt':
+                        lock.release()
+                    os.replace(temp_path, target)
+                except OSError as e:
+                    print(f"Error writing {file_path}: {e}")
+                    discard_temp(temp_path)
+                    failed.append((file_path, e))
+                    if transactional:
+                        break
+                    continue
+                finally:
+                    lock.release()
+                committed.append(file_path)
+
+            if transactional and failed:
+                committed, failed = [], self.roll_back(staged, committed, backups, failed[0])
+
+            directories = {os.path.dirname(target) for _, _, _, target in staged}
+            for directory in directories:
+                try:
+                    fsync_directory(directory)
+                except OSError as e:
+                    print(f"Error syncing {directory}: {e}")
+        except BaseException:
+            # Whatever was not replaced yet is left as it was
+            for file_path, temp_path, lock, _ in staged:
+                if file_path not in committed:
+                    lock.release()
+                    discard_temp(temp_path)
+            raise
+        finally:
+            for backup_path in backups.values():
+                discard_temp(backup_path)
+        return committed, failed
+
+    def roll_back(self, staged, committed, backups, failure):
+        # Restore the committed files and drop the rest; returns the failed list for the whole batch
+        failed_path, error = failure
+        targets = {file_path: target for file_path, _, _, target in staged}
+        for file_path in committed:
+            try:
+                if file_path in backups:
+                    os.replace(backups.pop(file_path), targets[file_path])
+                else:
+                    os.remove(targets[file_path])  # Did not exist before the commit
+            except OSError as e:
+                print(f"Error restoring {file_path}: {e}")
+        for file_path, temp_path, lock, _ in staged:
+            lock.release()
+            discard_temp(temp_path)
+        return [(file_path, error if file_path == failed_path else OSError(f"Rolled back after {failed_path} failed"))
+                for file_path, _, _, _ in staged]
+
+    def abort(self):
+        with self.lock:
+            staged, self.staged = self.staged, []
+        for _, temp_path, lock, _ in staged:
+            lock.release()
+            discard_temp(temp_path)
@@ -1,34 +1,396 @@
-import lupa
-from lupa import LuaRuntime
 import os
+import re
+import keyword
 import pandas as pd
 import ast
+import io
 import textwrap
+import tokenize
+from array import array
+from collections import namedtuple
+from line_analysis import WORD_TABLE, LineAnalysis, Spans, clamped_cumsum, make_table, to_array
+from source_encoding import open_source, read_source
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def iter_line_spans(buffer, start=0):
+    # Yield (start, end, line) for every line of the buffer, keeping the newline like readlines()
+    length = len(buffer)
+    while start < length:
+        end = buffer.find('\n', start)
+        end = length if end == -1 else end + 1
+        yield start, end, buffer[start:end]
+        start = end
+
+
+def all_but(chars):
+    # Character class of every code point but chars. re checks a class of ranges against a bitmap,
+    # but a negated class such as [^#"'] one item at a time, which is several times slower on long runs.
+    ranges = []
+    start = 0
+    for code in sorted(map(ord, chars)):
+        if code > start:
+            ranges.append(f'{re.escape(chr(start))}-{re.escape(chr(code - 1))}')
+        start = code + 1
+    ranges.append(f'{re.escape(chr(start))}-\U0010ffff')
+    return '[' + ''.join(ranges) + ']'
+
+
+class ParseCancelled(Exception):
+    pass
+
+
+# A classified line from FileParser.iter_records. stack is the parser's live Stack,
+# so copy what you need before advancing the generator.
+Record = namedtuple('Record', ['line_number', 'line_type', 'line', 'stack'])
+
+
+class ParseResult:
+    """Array-backed parse output.
+
+    Rows are stored column-wise as integer arrays: interned file ids, line numbers,
+    interned type codes and (start, end) offsets into the file buffer the row came
+    from. Names and literal lines are only formatted when a row is read.
+    """
+    columns = ['FileName', 'Extension', 'Type', 'LiteralLine']
+
+    def __init__(self):
+        self.files = []  # (file_path, extension, buffer) by file id
+        self.types = []  # Type labels by type code
+        self.type_codes_by_label = {}
+        self.file_ids = array('I')
+        self.line_numbers = array('I')
+        self.type_codes = array('I')
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.checkpoints = {}  # line_number -> (row index, buffer offset, Stack snapshot) before the line
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def add_file(self, file_path, extension, buffer):
+        self.files.append((file_path, extension, buffer))
+        return len(self.files) - 1
+
+    def intern_type(self, line_type):
+        code = self.type_codes_by_label.get(line_type)
+        if code is None:
+            code = len(self.types)
+            self.type_codes_by_label[line_type] = code
+            self.types.append(line_type)
+        return code
+
+    def append(self, file_id, line_number, line_type, start, end):
+        self.file_ids.append(file_id)
+        self.line_numbers.append(line_number)
+        code = self.type_codes_by_label.get(line_type)
+        self.type_codes.append(self.intern_type(line_type) if code is None else code)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def extend_arrays(self, file_id, line_numbers, labels, label_indexes, starts, ends):
+        # Append rows given as NumPy arrays, with each type given as an index into labels
+        codes = np.array([self.intern_type(label) for label in labels], dtype=np.int64)
+        for column, values in ((self.file_ids, np.full(len(line_numbers), file_id)),
+                               (self.line_numbers, line_numbers), (self.type_codes, codes[label_indexes]),
+                               (self.starts, starts), (self.ends, ends)):
+            column.frombytes(values.astype(f'u{column.itemsize}').tobytes())
+
+    def get_name(self, index):
+        file_path = self.files[self.file_ids[index]][0]
+        return f"{os.path.basename(file_path)}:{self.line_numbers[index]}"
+
+    def get_type(self, index):
+        return self.types[self.type_codes[index]]
+
+    def get_line(self, index):
+        buffer = self.files[self.file_ids[index]][2]
+        return buffer[self.starts[index]:self.ends[index]]
+
+    def row(self, index):
+        file_path, extension, buffer = self.files[self.file_ids[index]]
+        return (f"{os.path.basename(file_path)}:{self.line_numbers[index]}",
+                extension,
+                self.types[self.type_codes[index]],
+                buffer[self.starts[index]:self.ends[index]])
+
+    def to_dataframe(self):
+        return pd.DataFrame(list(self), columns=self.columns)
+
+
 class FileParser:
+    version = 8  # Bump when the output changes, so cached results are not reused
+    extension = None
+    strip_literal = False  # Literal lines are shown stripped
+    whole_file = False  # Full parses go to classify_analyzed instead of classify_line
+    checkpoint_interval = 256  # Lines between the Stack snapshots that reparse resumes from
+    literal_pattern = None  # Finds comments and strings, each as the last capturing group that matched
+    symbol_pattern = re.compile(r'\b[^\W\d]\w*')  # Identifiers, and not the letters inside numbers such as 0x1f
+    reserved_words = frozenset()  # Words symbol_pattern finds that are not identifiers
+
     def __init__(self, file_path):
         self.file_path = file_path
 
-    def parse_file(self,file_path):
+    def get_extension(self, file_path):
+        return self.extension
+
+    def cache_id(self, file_path):
+        # Identifies the parser configuration in ParseCache keys
+        return f"{type(self).__name__}:{self.version}:{self.get_extension(file_path)}"
+
+    def new_stack(self):
+        return Stack()
+
+    def classify_line(self, line, stack):
+        # Yield the Type of each record produced by the line, updating the stack as we go
+        yield None
+
+    def read_buffer(self, file_path):
+        # Decoded as read_source detects, so no file fails to read for its encoding
+        return read_source(file_path)[0]
+
+    def iter_records(self, file_path):
+        # Read the file one line at a time and yield each classified record as soon as it is known
+        stack = self.new_stack()
+        with open_source(file_path) as file:
+            for line_number, line in enumerate(file, start=1):
+                for line_type in self.classify_line(line, stack):
+                    yield Record(line_number, line_type, line, stack)
+
+    def parse_file(self,file_path, cancel_event=None):
         try:
-            with open(self.file_path, 'r') as file:
-                lines = file.readlines()
+            buffer = self.read_buffer(file_path)
         except Exception as e:
             print(f"Error reading file: {e}")
-            return pd.DataFrame(columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+            return ParseResult()
+
+        return self.parse_buffer(file_path, buffer, cancel_event)
+
+    def parse_buffer(self, file_path, buffer, cancel_event=None):
+        # Raises ParseCancelled if cancel_event is set while the buffer is being classified
+        result = ParseResult()
+        file_id = result.add_file(file_path, self.get_extension(file_path), buffer)
+        self.classify_buffer(result, file_id, buffer, self.new_stack(), cancel_event=cancel_event)
+        return result
+
+    def reparse(self, file_path, previous, buffer, first_line, last_line=None, line_delta=0):
+        # Re-classify buffer after an edit to lines first_line..last_line (1-based, in the new buffer).
+        # line_delta is the change in line count, so that line n after the edit was line n - line_delta before.
+        # Parsing resumes from the last checkpoint of previous before the edit and stops as soon as
+        # the stack matches the previous run again, reusing the rest of its rows.
+        if last_line is None:
+            last_line = first_line
+        resume_lines = [line_number for line_number in previous.checkpoints if line_number <= first_line]
+        if len(previous.files) != 1 or not resume_lines:
+            return self.parse_buffer(file_path, buffer)
+
+        resume_line = max(resume_lines)
+        row_index, offset, snapshot = previous.checkpoints[resume_line]
+
+        result = ParseResult()
+        file_id = result.add_file(file_path, self.get_extension(file_path), buffer)
+        # Keep the type codes of the previous run so its rows can be copied as they are
+        result.types = list(previous.types)
+        result.type_codes_by_label = dict(previous.type_codes_by_label)
+        result.file_ids = previous.file_ids[:row_index]
+        result.line_numbers = previous.line_numbers[:row_index]
+        result.type_codes = previous.type_codes[:row_index]
+        result.starts = previous.starts[:row_index]
+        result.ends = previous.ends[:row_index]
+        result.checkpoints = {line_number: checkpoint for line_number, checkpoint in previous.checkpoints.items()
+                              if line_number < resume_line}
+
+        stack = self.new_stack()
+        stack.restore(snapshot)
+        self.classify_buffer(result, file_id, buffer, stack, offset, resume_line, previous, last_line, line_delta)
+        return result
+
+    def classify_buffer(self, result, file_id, buffer, stack, offset=0, first_line=1, previous=None, last_line=0, line_delta=0,
+                        cancel_event=None):
+        if previous is None and offset == 0 and self.whole_file:
+            return self.classify_analyzed(result, file_id, buffer, stack, first_line, cancel_event)
+
+        # Bound once, since this loop runs for every line of the buffer
+        classify_line = self.classify_line
+        append = result.append
+        strip_literal = self.strip_literal
+        for line_number, (start, end, line) in enumerate(iter_line_spans(buffer, offset), start=first_line):
+            if previous is not None and line_number > last_line:
+                checkpoint = previous.checkpoints.get(line_number - line_delta)
+                if checkpoint is not None and checkpoint[2] == stack.snapshot():
+                    self.splice_rows(result, file_id, previous, line_number - line_delta, start, line_delta)
+                    return
+            if (line_number - first_line) % self.checkpoint_interval == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ParseCancelled(file_id)
+                result.checkpoints[line_number] = (len(result), start, stack.snapshot())
+
+            if strip_literal:
+                # Offsets of line.strip() inside the buffer
+                stripped = line.lstrip()
+                start += len(line) - len(stripped)
+                end = start + len(stripped.rstrip())
+            for line_type in classify_line(line, stack):
+                append(file_id, line_number, line_type, start, end)
+
+    def splice_rows(self, result, file_id, previous, previous_line, offset, line_delta):
+        # The stack has converged with the previous run at previous_line: copy its remaining rows,
+        # shifted to the new buffer
+        row_index, previous_offset, _ = previous.checkpoints[previous_line]
+        shift = offset - previous_offset
+        row_shift = len(result) - row_index
+        count = len(previous) - row_index
+        result.file_ids.extend(array('I', [file_id]) * count)
+        result.line_numbers.extend(line_number + line_delta for line_number in previous.line_numbers[row_index:])
+        result.type_codes.extend(previous.type_codes[row_index:])
+        result.starts.extend(start + shift for start in previous.starts[row_index:])
+        result.ends.extend(end + shift for end in previous.ends[row_index:])
+        for line_number, (index, checkpoint_offset, snapshot) in previous.checkpoints.items():
+            if line_number >= previous_line:
+                result.checkpoints[line_number + line_delta] = (index + row_shift, checkpoint_offset + shift, snapshot)
 
-        parsed_data = []
-        for i, line in enumerate(lines, start=1):  
-            name = f"{os.path.basename(self.file_path)}:{i}"  
-            parsed_data.append((name, None, None, line))
-        
-        return pd.DataFrame(parsed_data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+    def get_variables(self, file_path):
+        return self.get_buffer_variables(file_path, self.read_buffer(file_path))
+
+    def get_buffer_variables(self, file_path, buffer):
+        # The assignment lines of buffer, the content of file_path, one row each
+        variables = ParseResult()
+        file_id = variables.add_file(file_path, None, buffer)
+        for i, (start, end, line) in enumerate(iter_line_spans(buffer), start=1):
+            if '=' in line:  # Simple condition for variable assignment
+                variables.append(file_id, i, None, start, end)
+
+        return variables
+
+    def literal_spans(self, buffer):
+        # Comments and strings of the buffer, as Spans
+        if self.literal_pattern is None:
+            return Spans([])
+        return Spans([match.span(match.lastindex) for match in self.literal_pattern.finditer(buffer) if match.lastindex])
+
+    def get_identifiers(self, buffer, result=None):
+        # (name, line_number, column, kind) for each identifier outside comments and strings, column
+        # counting characters from 0. kind is the type of the first row result has on the line, or None.
+        matches = [(match.group(), match.start()) for match in self.symbol_pattern.finditer(buffer)]
+        if not matches:
+            return []
+        names, offsets = zip(*matches)
+        offsets = np.array(offsets, dtype=np.int64)
+        keep = ~self.literal_spans(buffer).contains(offsets)
+
+        newlines = np.flatnonzero(to_array(buffer) == 10)
+        lines = np.searchsorted(newlines, offsets)  # Newlines before each identifier, so its line number - 1
+        columns = offsets - np.append(0, newlines + 1)[lines]
+        kinds = {}
+        if result is not None:
+            for line_number, type_code in zip(reversed(result.line_numbers), reversed(result.type_codes)):
+                kinds[line_number] = result.types[type_code]
+
+        reserved = self.reserved_words
+        return [(name, line + 1, column, kinds.get(line + 1))
+                for name, line, column, is_kept in zip(names, lines.tolist(), columns.tolist(), keep.tolist())
+                if is_kept and name not in reserved]
 
 class CodeAnalyzer(ast.NodeVisitor):
+    # Statement kinds, as abbreviated in the Type labels
+    node_kinds = {
+        ast.FunctionDef: 'f', ast.AsyncFunctionDef: 'af', ast.ClassDef: 'c', ast.Return: 'r',
+        ast.Delete: 'd', ast.Assign: 'a', ast.AugAssign: 'aa', ast.AnnAssign: 'an',
+        ast.For: 'for', ast.AsyncFor: 'for', ast.While: 'w', ast.If: 'if', ast.With: 'with',
+        ast.AsyncWith: 'with', ast.Raise: 'ra', ast.Try: 't', ast.Assert: 'as', ast.Import: 'im',
+        ast.ImportFrom: 'imf', ast.Global: 'g', ast.Nonlocal: 'n', ast.Expr: 'e', ast.Pass: 'p',
+        ast.Break: 'b', ast.Continue: 'co',
+    }
+    if hasattr(ast, 'TryStar'):
+        node_kinds[ast.TryStar] = 't'
+    scope_kinds = {'f', 'af', 'c'}  # Kinds that open a new nesting level
+    keyword_kinds = {
+        'def': 'f', 'async': 'af', 'class': 'c', 'return': 'r', 'del': 'd', 'for': 'for',
+        'while': 'w', 'if': 'if', 'elif': 'if', 'else': 'if', 'with': 'with', 'raise': 'ra',
+        'try': 't', 'except': 't', 'finally': 't', 'assert': 'as', 'import': 'im', 'from': 'imf',
+        'global': 'g', 'nonlocal': 'n', 'pass': 'p', 'break': 'b', 'continue': 'co',
+    }
+    augmented_operators = {'+=', '-=', '*=', '/=', '//=', '%=', '**=', '>>=', '<<=', '&=', '^=', '|=', '@='}
+
     def __init__(self):
         self.variable_types = []
         self.stack = Stack()
-        
+
+    def classify_source(self, source):
+        # Classify a whole file with one parse and one walk of the statement tree.
+        # Returns per-line lists (0-based) of statement kind and nesting level; a line gets the
+        # kind of the innermost statement that spans it. Falls back to tokenize on syntax errors.
+        line_count = source.count('\n') + 1
+        kinds = [None] * line_count
+        levels = [0] * line_count
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return self.classify_tokens(source, kinds, levels)
+
+        pending = [(tree, 0)]
+        while pending:
+            node, level = pending.pop()
+            kind = self.node_kinds.get(type(node))
+            if kind is not None:
+                if kind in self.scope_kinds:
+                    level += 1
+                first = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', ())]) - 1
+                last = (node.end_lineno or node.lineno) - 1
+                # Children are handled after their parent, so inner statements overwrite the span
+                kinds[first:last + 1] = [kind] * (last + 1 - first)
+                levels[first:last + 1] = [level] * (last + 1 - first)
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.stmt, ast.excepthandler)) or type(child).__name__ == 'match_case':
+                    pending.append((child, level))
+        return kinds, levels
+
+    def classify_tokens(self, source, kinds, levels):
+        # Fallback for files that do not parse: classify each logical line by its first token
+        scopes = []  # Indentation depths of the enclosing def and class lines
+        depth = 0
+        line_start = None
+        kind = None
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(source).readline):
+                if token.type == tokenize.INDENT:
+                    depth += 1
+                elif token.type == tokenize.DEDENT:
+                    depth -= 1
+                elif token.type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                    if line_start is not None:
+                        while scopes and scopes[-1] >= depth:
+                            scopes.pop()
+                        level = len(scopes)
+                        if kind in self.scope_kinds:
+                            level += 1
+                            scopes.append(depth)
+                        last = token.start[0] - 1
+                        for row in range(line_start, min(last + 1, len(kinds))):
+                            kinds[row] = kind
+                            levels[row] = level
+                    line_start = None
+                elif token.type in (tokenize.COMMENT, tokenize.NL):
+                    continue
+                elif line_start is None:
+                    line_start = token.start[0] - 1
+                    kind = self.keyword_kinds.get(token.string, 'e') if token.type == tokenize.NAME else 'e'
+                elif kind == 'e' and token.type == tokenize.OP:
+                    if token.string == '=':
+                        kind = 'a'
+                    elif token.string in self.augmented_operators:
+                        kind = 'aa'
+        except (tokenize.TokenError, IndentationError, SyntaxError) as e:
+            print(f"Error determining variable type: {e}")
+        return kinds, levels
+
     def get_line_type(self, line):
+        self.variable_types = []
         try:
             # Try to parse the line as is
             tree = ast.parse(line)
@@ -163,9 +525,19 @@ class CodeAnalyzer(ast.NodeVisitor):
 class Stack:
     def __init__(self):
         self.stack = []
+        self.state = {}  # Parser flags that are carried from line to line along with the stack
 
     def clear(self):
         self.stack = []
+
+    def snapshot(self):
+        # Nesting levels, block kinds and parser flags, as a hashable value
+        return tuple(self.stack), tuple(sorted(self.state.items()))
+
+    def restore(self, snapshot):
+        self.stack = list(snapshot[0])
+        self.state = dict(snapshot[1])
+
     def push(self, variable_type):
         level = self.get_level() + 1
         self.stack.append((variable_type, level))
@@ -192,431 +564,1456 @@ class Stack:
         return self.stack
     
 
+class IndexingStack(Stack):
+    # Stack that also records the line each block opens and closes on, for PascalParser.index_blocks
+    def __init__(self):
+        super().__init__()
+        self.line_number = 0
+        self.blocks = []  # [kind, start_line, end_line], in order of their start
+        self.open_blocks = []  # Indexes into blocks, innermost last
+
+    def push(self, variable_type):
+        super().push(variable_type)
+        self.open_blocks.append(len(self.blocks))
+        self.blocks.append([variable_type, self.line_number, None])
+
+    def pop(self):
+        if self.stack:
+            if self.state.get('type_header'):
+                # A type that turned out to have no body, such as a forward declared class
+                del self.blocks[self.open_blocks.pop()]
+            else:
+                self.blocks[self.open_blocks.pop()][2] = self.line_number
+        super().pop()
+
+
 class PythonParser(FileParser):
     def __init__(self, file_path):
         super().__init__(file_path)
         
     def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        variables = []
-        for i, line in enumerate(lines, start=1):
-            if '=' in line:  # Simple condition for variable assignment
-                name = line.split('=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
-
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+        return super().get_variables(file_path)
 import re
 import os
 import pandas as pd
 
 class PythonFileParser(FileParser):
-    def __init__(self, file_path):
+    """Line classifier for Python.
+
+    Brackets and '=' only count outside comments and strings, and a triple-quoted string
+    only pushes 'multiline comment' while it runs past the end of its line. Lines inside a
+    multiline string or an open bracket leave the indentation alone. Full parses take the
+    whole buffer at once in classify_analyzed; reparse resumes classify_line, which gives
+    the same rows.
+    """
+    extension = ".py"
+    whole_file = True
+    literal_pattern = re.compile(r"[^#\"']*(?:(#[^\n]*)|("
+                                 r"'''(?:\\.|(?s:.))*?(?:'''|\Z)|"
+                                 r'"""(?:\\.|(?s:.))*?(?:"""|\Z)|'
+                                 r''''(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?)|\Z)''')
+    symbol_pattern = re.compile(r'''\b[^\W\d]\w*\b(?!['"])''')  # Not the prefix of a string such as f'' or rb''
+    reserved_words = frozenset(keyword.kwlist)
+
+    def __init__(self, file_path, engine='stack'):
         super().__init__(file_path)
+        self.engine = engine  # 'stack' for the line classifier, 'ast' for CodeAnalyzer.classify_source
 
-    def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+    def cache_id(self, file_path):
+        return f"{super().cache_id(file_path)}:{self.engine}"
 
-        variables = []
-        for i, line in enumerate(lines, start=1):
-            if '=' in line:  # Simple condition for variable assignment
-                name = line.split('=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
+    def parse_buffer(self, file_path, buffer, cancel_event=None):
+        if self.engine != 'ast':
+            return super().parse_buffer(file_path, buffer, cancel_event)
 
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-    
-    def parse_file(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+        # Whole-file mode; the result has no checkpoints, so reparse falls back to a full parse
+        kinds, levels = CodeAnalyzer().classify_source(buffer)
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled(file_path)
+        result = ParseResult()
+        file_id = result.add_file(file_path, self.extension, buffer)
+        for line_number, (start, end, line) in enumerate(iter_line_spans(buffer), start=1):
+            result.append(file_id, line_number, f'{kinds[line_number - 1]} (sl {levels[line_number - 1]})', start, end)
+        return result
 
-        data = []
+    def get_variables(self, file_path):
+        return super().get_variables(file_path)
+
+    def new_stack(self):
         stack = Stack()
-        prev_indent_level = 0
-        for line_number, line in enumerate(lines, start=1):
+        stack.state['prev_indent_level'] = 0
+        stack.state['string_quote'] = None  # Closing quote of the multiline string being read
+        stack.state['open_brackets'] = 0
+        return stack
+
+    def classify_line(self, line, stack):
+        state = stack.state
+        # Lines that continue a string or a bracketed expression do not change the indentation
+        if state['string_quote'] is None and state['open_brackets'] == 0:
+            prev_indent_level = state['prev_indent_level']
             curr_indent_level = len(line) - len(line.lstrip())
             if curr_indent_level < prev_indent_level:
-                for _ in range(prev_indent_level - curr_indent_level):
+                # One pop per column of dedent, done as a single slice deletion
+                del stack.stack[max(0, len(stack.stack) - (prev_indent_level - curr_indent_level)):]
+            state['prev_indent_level'] = curr_indent_level
+
+        variable_type, stack = self.determine_variable_type(line.strip(), stack)
+        yield variable_type
+
+    # Comments and string literals; everything else on a line is plain code
+    code_pattern = re.compile(r'''#|"""|\'\'\'|"(?:\\.|[^"\\])*"?|'(?:\\.|[^'\\])*'?''')
+    block_bracket_pattern = re.compile(r'[\[\]{}]')
+    keyword_pattern = re.compile(r'(def|if|elif|else|for|while|class|from)\b')
+    keyword_types = {'def': 'function', 'if': 'if', 'elif': 'elif', 'else': 'else', 'for': 'for',
+                     'while': 'while', 'class': 'class', 'from': 'from-import'}
+    keyword_initials = frozenset(keyword[0] for keyword in keyword_types)
+
+    def scan_code(self, line, position, stack):
+        # Follow brackets and strings from position and return the code outside strings and comments.
+        # A triple quote that is not closed on the line starts a multiline comment.
+        text = line[position:] if position else line
+        if '#' not in text and '"' not in text and "'" not in text:
+            # Most lines have no strings or comments, and many have no brackets either
+            if '(' in text or ')' in text or '[' in text or ']' in text or '{' in text or '}' in text:
+                self.count_brackets(text, stack)
+            return text
+
+        code = []
+        match = self.code_pattern.search(line, position)
+        while match is not None:
+            code.append(line[position:match.start()])
+            token = match.group()
+            position = match.end()
+            if token == '#':
+                break
+            elif token == '"""' or token == "'''":
+                end = line.find(token, position)
+                if end == -1:
+                    code = ''.join(code)
+                    self.count_brackets(code, stack)
+                    stack.push('multiline comment')  # Start of multiline comment
+                    stack.state['string_quote'] = token
+                    return code
+                position = end + 3
+            match = self.code_pattern.search(line, position)
+        else:
+            code.append(line[position:])
+
+        code = ''.join(code)
+        self.count_brackets(code, stack)
+        return code
+
+    def count_brackets(self, code, stack):
+        state = stack.state
+        if '[' in code or '{' in code or ']' in code or '}' in code:
+            for symbol in self.block_bracket_pattern.findall(code):
+                if symbol == '{' or symbol == '[':
+                    stack.push(symbol)
+                    state['open_brackets'] += 1
+                else:
                     stack.pop()
-            prev_indent_level = curr_indent_level
-
-            variable_type, stack = self.determine_variable_type(line.strip(), stack)
-            data.append([f"{os.path.basename(self.file_path)}:{line_number}", ".py", variable_type, line])
+                    state['open_brackets'] = max(0, state['open_brackets'] - 1)
+        if '(' in code or ')' in code:
+            state['open_brackets'] = max(0, state['open_brackets'] + code.count('(') - code.count(')'))
 
-        return pd.DataFrame(data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+    def get_label(self, stack):
+        if stack.stack:
+            top, level = stack.stack[-1]
+            return f'{top} (sl {level})'
+        return 'None (sl 0)'
 
     def determine_variable_type(self, line, stack):
-        # Check for multiline comments
-        if '"""' in line or "'''" in line:
-            if stack.get_top() == 'multiline comment':
+        state = stack.state
+        quote = state.get('string_quote')
+
+        # Inside a multiline comment only its closing quote matters
+        if quote is not None:
+            end = line.find(quote)
+            if end != -1:
                 stack.pop()  # End of multiline comment
-            else:
-                stack.push('multiline comment')  # Start of multiline comment
-            return f'{stack.get_top()} (sl {stack.get_level()})', stack
-
-        # Check for opening and closing brackets
-        open_symbols = ['{', '[']
-        close_symbols = ['}', ']']
-        for symbol in line:
-            if symbol in open_symbols:
-                stack.push(symbol)
-            elif symbol in close_symbols:
-                stack.pop()
+                state['string_quote'] = None
+                self.scan_code(line, end + 3, stack)
+            return self.get_label(stack), stack
+
+        # Check for opening and closing brackets outside strings and comments
+        code = self.scan_code(line, 0, stack)
+        if state.get('string_quote') is not None:
+            return self.get_label(stack), stack
 
         # Check for other Python constructs
-        if re.search(r'^\s*def ', line):
-            stack.push('function')
-        elif re.search(r'^\s*if ', line):
-            stack.push('if')
-        elif re.search(r'^\s*elif ', line):
-            stack.pop()
-            stack.push('elif')
-        elif re.search(r'^\s*else:', line):
-            stack.pop()
-            stack.push('else')
-        elif re.search(r'^\s*for ', line):
-            stack.push('for')
-        elif re.search(r'^\s*while ', line):
-            stack.push('while')
-        elif re.search(r'^\s*class ', line):
-            stack.push('class')
-        elif re.search(r'^\s*from ', line):
-            stack.push('from-import')
-        elif '=' in line:
+        match = self.keyword_pattern.match(line) if line[:1] in self.keyword_initials else None
+        if match is not None:
+            keyword = match.group(1)
+            if keyword == 'elif' or keyword == 'else':
+                stack.pop()
+            stack.push(self.keyword_types[keyword])
+        elif '=' in code:
             stack.push('assignment')
-        elif line.strip() == '':
+        elif line == '':
             stack.push('empty')
-        else:
-            # Do not push to the stack for other lines
-            return f'{stack.get_top()} (sl {stack.get_level()})', stack
-
-        return f'{stack.get_top()} (sl {stack.get_level()})', stack
-
-
-
+        # Other lines do not push to the stack
+
+        return self.get_label(stack), stack
+
+    # Comments (group 1), triple-quoted strings (group 2) and other strings (group 3) as scan_code finds
+    # them, so a triple-quoted string ends at the first closing quote, escaped or not. Comments and
+    # one-line strings without a bracket or '=' are passed over like code: nothing in them is counted,
+    # and most literals are like that, so the loop over the matches sees far fewer of them.
+    scan_pattern = re.compile(r'''{code}*(?:(?:#{plain}*(?![^\n])|(?!\'\'\')'{plain_single}*(?:\\{plain}{plain_single}*)*(?:'|(?=\\?(?![^\n])))|'''
+                              r'''(?!""")"{plain_double}*(?:\\{plain}{plain_double}*)*(?:"|(?=\\?(?![^\n])))){code}*)*'''
+                              r'''(?:(#[^\n]*)|('\'\'[^']*(?:'(?!'')[^']*)*(?:'\'\'|\Z)|"""[^"]*(?:"(?!"")[^"]*)*(?:"""|\Z))|'''
+                              r'''('{single}*(?:\\.{single}*)*'?|"{double}*(?:\\.{double}*)*"?)|\Z)'''.format(
+                                  code=all_but('#"\''), single=all_but('\'\\\n'), double=all_but('"\\\n'),
+                                  plain=all_but('\n[]{}()='), plain_single=all_but('\'\\\n[]{}()='),
+                                  plain_double=all_but('"\\\n[]{}()=')))
+    keywords = ['def', 'if', 'elif', 'else', 'for', 'while', 'class', 'from']
+    keyword_initial_table = make_table([ord(name[0]) for name in keywords])
+    # Each keyword as the little-endian number its letters make, and a mask of the bytes they fill
+    keyword_values = np.array([int.from_bytes(name.encode(), 'little') for name in keywords], dtype=np.uint64)
+    keyword_masks = np.array([(1 << 8 * len(name)) - 1 for name in keywords], dtype=np.uint64)
+    keyword_lengths = np.array([len(name) for name in keywords])
+    symbol_codes = [ord(char) for char in '[]{}()=']
+    symbol_table = make_table(symbol_codes)
+    # Kind of each ASCII character: 1 to 4 for '[{]}', 5 to 7 for '()=' and 0 for the rest
+    symbol_kinds = np.array(['[{]}()='.find(chr(code)) + 1 for code in range(128)])
+    paren_steps = np.array([0, 0, 0, 0, 0, 1, -1, 0])  # What each kind adds to the bracket count
+    # Kinds of stack entries: what lines push (nothing, an '=', a blank line or a keyword), then the
+    # block brackets and multiline strings, and the stack entry each symbol kind pushes, or -1
+    stack_kinds = [None, 'assignment', 'empty'] + list(map(keyword_types.get, keywords)) + ['[', '{', 'multiline comment']
+    bracket_pushes = np.array([-1, len(stack_kinds) - 3, len(stack_kinds) - 2, -1, -1])
+    pop_kinds = [keywords.index('elif') + 3, keywords.index('else') + 3]  # Pushes that pop first
+
+    def classify_analyzed(self, result, file_id, buffer, stack, first_line=1, cancel_event=None):
+        # Whole-file version of classify_line. Comments and strings are found with one regex pass and
+        # the brackets, '=', keywords and indentation of every line with a few array operations. The
+        # stack is worked out from those with array operations too, not replayed line by line. These
+        # run once per file, where the np functions that only wrap an array method cost more than the
+        # work itself on small files, so the methods are called instead. The rows and checkpoints are
+        # the same as classify_line gives.
+        analysis = LineAnalysis(buffer)
+        count = len(analysis)
+        if count == 0:
+            return
+        literals = []  # Flat (start, end) pairs
+        triples = []
+        for match in self.scan_pattern.finditer(buffer):
+            group = match.lastindex
+            if group is not None:
+                literals += match.span(group)
+                if group == 2:
+                    triples.append(match.span(2))
+        literals = Spans(literals)
+
+        # Triple-quoted strings that run past their line: the line they open on pushes, the lines
+        # inside are left alone and the line they close on pops
+        opens = np.zeros(count, dtype=bool)
+        closes = np.zeros(count, dtype=bool)
+        inside = np.zeros(count, dtype=bool)
+        open_starts = np.zeros(count, dtype=np.int64)  # Offset of the string each opening line opens
+        if triples:
+            triples = np.array(triples, dtype=np.int64)
+            open_lines = analysis.line_of(triples[:, 0])
+            close_lines = analysis.line_of(triples[:, 1] - 1)
+            # Strings cut off by the end of the buffer never close
+            closed = np.array([end - start >= 6 and buffer.startswith(buffer[start:start + 3], end - 3)
+                               for start, end in triples.tolist()], dtype=bool)
+            multiline = (close_lines > open_lines) | ~closed
+            open_lines, close_lines, closed = open_lines[multiline], close_lines[multiline], closed[multiline]
+            opens[open_lines] = True
+            open_starts[open_lines] = triples[multiline, 0]
+            closes[close_lines[closed]] = True
+            # Lines after the opening one up to the last, which is left out if it closes the string
+            marks = np.bincount(open_lines + 1, minlength=count + 1) - np.bincount(close_lines + ~closed, minlength=count + 1)
+            inside = marks[:count].cumsum() > 0
+
+        # Block brackets in order, '(' minus ')' and '=' on each line, outside literals
+        symbols = analysis.lookup(self.symbol_table, self.symbol_codes).nonzero()[0]
+        symbols = symbols[~literals.contains(symbols)]
+        symbol_kinds = self.symbol_kinds[analysis.data[symbols]]
+        symbol_lines = analysis.line_of(symbols)
+        is_bracket = symbol_kinds < 5
+        bracket_lines = symbol_lines[is_bracket]
+        bracket_kinds = symbol_kinds[is_bracket]
+        paren_deltas = np.bincount(symbol_lines, self.paren_steps[symbol_kinds], count).astype(np.int64)
+        has_equals = np.bincount(symbol_lines, symbol_kinds == 7, count) > 0
+
+        # What each line pushes when it is code, as an index in stack_kinds: its keyword, else
+        # 'assignment' for an '=' outside literals, else 'empty' for a blank line. Keywords are only
+        # looked for on the lines that start with one of their first letters, by reading the first 8
+        # characters of each as one number, and count when no word character follows, as
+        # keyword_pattern matches them.
+        stripped_starts = analysis.stripped_starts
+        push_codes = np.where(has_equals, 1, (stripped_starts == analysis.stripped_ends) * 2)
+        data = analysis.data
+        if data.dtype != np.uint8:
+            data = np.where(data > 255, ord('?'), data).astype(np.uint8)  # As to_array reads them past Latin-1
+        data = np.concatenate((data, np.zeros(7, dtype=np.uint8)))  # Room for the characters of the last line
+        candidates = (self.keyword_initial_table[data[stripped_starts]] & (stripped_starts < analysis.stripped_ends)).nonzero()[0]
+        chars = data[stripped_starts[candidates, None] + np.arange(8)]
+        found = ((chars.view(np.dtype('<u8')) & self.keyword_masks) == self.keyword_values) & \
+            ~WORD_TABLE[chars[:, self.keyword_lengths]]
+        hits, line_keywords = found.nonzero()
+        keyword_lines = candidates[hits]
+        if not buffer.isascii():
+            # A '?' read for a character past Latin-1 ends a word, where a letter would not
+            matched = [self.keyword_pattern.match(buffer, start) is not None for start in stripped_starts[keyword_lines].tolist()]
+            keyword_lines, line_keywords = keyword_lines[matched], line_keywords[matched]
+        push_codes[keyword_lines] = line_keywords + 3
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled(file_id)
+
+        # The bracket count only changes at brackets and parentheses and stops at 0, so it is a
+        # clamped running sum over them; with the strings open after each line it tells which lines
+        # may dedent, and from which indentation.
+        state = stack.state
+        entries = stack.stack
+        first_entries = len(entries)
+        first_quote = state['string_quote']
+        first_open = state['open_brackets']
+        first_indent = state['prev_indent_level']
+        lines = np.arange(count)
+        paren_lines = paren_deltas.nonzero()[0]
+        count_keys = np.concatenate((bracket_lines * 2, paren_lines * 2 + 1))
+        count_order = count_keys.argsort(kind='stable')
+        counts = clamped_cumsum(np.concatenate((np.where(bracket_kinds < 3, 1, -1), paren_deltas[paren_lines]))[count_order],
+                                first_open)
+        # Index -1, for lines before the first bracket, picks the count the stack started with
+        open_after = np.concatenate((counts, [first_open]))[(count_keys[count_order] // 2).searchsorted(lines, 'right') - 1]
+        quote_after = opens | inside
+        free = np.concatenate(([first_quote is None and first_open == 0], (open_after[:-1] == 0) & ~quote_after[:-1]))
+        last_free = np.maximum.accumulate(np.where(free, lines, -1))
+        indents = np.concatenate((analysis.indents, [first_indent]))  # Index -1 is the indentation the stack started with
+        dedents = np.maximum(indents[np.concatenate(([-1], last_free[:-1]))] - indents[:-1], 0) * free
+
+        # Everything a line does to the stack is a step, in order: the pops of its dedent, the pop of
+        # a multiline string it closes, its block brackets, then the multiline string it opens, or the
+        # pop of an elif or else and its own push. Pops at an empty stack do nothing, so the depth is a
+        # clamped running sum too, and the entry on top at any point is the last one pushed at the depth
+        # reached there. Levels are stack positions, counted from 1.
+        push_lines = ((push_codes > 0) & ~(inside | opens | closes)).nonzero()[0]
+        pushes = push_codes[push_lines]
+        parts = (dedents.nonzero()[0], closes.nonzero()[0], bracket_lines, opens.nonzero()[0],
+                 push_lines[(pushes == self.pop_kinds[0]) | (pushes == self.pop_kinds[1])], push_lines)
+        sizes = [len(part) for part in parts]
+        step_lines = np.concatenate(parts)
+        step_order = (step_lines * len(parts) + np.repeat(np.arange(len(parts)), sizes)).argsort(kind='stable')
+        # What each step pushes, or -1 for a pop
+        step_kinds = np.repeat([-1, -1, 0, len(self.stack_kinds) - 1, -1, 0], sizes)
+        bracket_end = sizes[0] + sizes[1] + sizes[2]
+        step_kinds[bracket_end - sizes[2]:bracket_end] = self.bracket_pushes[bracket_kinds]
+        step_kinds[len(step_kinds) - sizes[5]:] = pushes
+        steps = np.where(step_kinds >= 0, 1, -1)
+        steps[:sizes[0]] = -dedents[parts[0]]
+        step_lines, steps, step_kinds = step_lines[step_order], steps[step_order], step_kinds[step_order]
+        depths = clamped_cumsum(steps, first_entries)
+
+        # Pushes, after the entries the stack started with, sorted by depth and then by step. Steps
+        # are numbered after those entries, so a lookup at step -1 finds them.
+        kinds = self.stack_kinds + [entry[0] for entry in entries]
+        pushed = (step_kinds >= 0).nonzero()[0]
+        span = len(steps) + first_entries + 1
+        push_keys = np.concatenate((np.arange(1, first_entries + 1) * (span + 1) - 1, depths[pushed] * span + pushed + first_entries))
+        push_order = push_keys.argsort(kind='stable')
+        push_keys = push_keys[push_order]
+        push_kinds = np.concatenate((np.arange(len(self.stack_kinds), len(kinds)), step_kinds[pushed]))[push_order]
+
+        def top_pushes(depths_reached, last_steps):
+            # Index in push_keys of the entry on top at each depth, after each step
+            return push_keys.searchsorted(depths_reached * span + last_steps + first_entries, 'right') - 1
+
+        # One row per line, labelled as get_label does: by the entry on top after its last step.
+        # Labels are numbered by depth and kind; lines with an empty stack find no push, index -1,
+        # which picks the 0 appended for them, so they all get 0.
+        last_steps = step_lines.searchsorted(lines, 'right') - 1
+        line_depths = np.concatenate((depths, [first_entries]))[last_steps]
+        label_keys = line_depths * len(kinds) + np.concatenate((push_kinds, [0]))[top_pushes(line_depths, last_steps)]
+        used = np.bincount(label_keys) > 0
+        texts = [f'{kinds[key % len(kinds)]} (sl {key // len(kinds)})' if key else 'None (sl 0)'
+                 for key in used.nonzero()[0].tolist()]
+        result.extend_arrays(file_id, lines + first_line, texts, used.cumsum()[label_keys] - 1, analysis.starts, analysis.ends)
+
+        # The stack and flags before every checkpoint_interval-th line, and after the last one
+        row_index = len(result) - count
+        result.checkpoints[first_line] = (row_index, 0, stack.snapshot())
+        checkpoints = np.concatenate((lines[self.checkpoint_interval::self.checkpoint_interval], [count]))
+        before = checkpoints - 1
+        quote_starts = open_starts[np.maximum.accumulate(np.where(opens, lines, 0))[before]]
+        for line, depth, last_step, has_quote, quote_start, open_brackets, indent in zip(
+                checkpoints.tolist(), line_depths[before].tolist(), last_steps[before].tolist(), quote_after[before].tolist(),
+                quote_starts.tolist(), open_after[before].tolist(), indents[last_free[before]].tolist()):
+            indexes = top_pushes(np.arange(1, depth + 1), last_step)
+            entries[:] = [(kinds[kind], level) for level, kind in enumerate(push_kinds[indexes].tolist(), 1)]
+            state.update(string_quote=buffer[quote_start:quote_start + 3] if has_quote else None,
+                         open_brackets=open_brackets, prev_indent_level=indent)
+            if line < count:
+                result.checkpoints[first_line + line] = (row_index + line, int(analysis.starts[line]), stack.snapshot())
 
 
 class LuaFileParser(FileParser):
+    """Line classifier for Lua.
+
+    Lines are lexed with a single compiled pattern, so keywords only count as whole words and
+    nothing inside a string or comment changes the stack. A long string or comment left open
+    at the end of a line, and a for or while header still waiting for its 'do', are kept in
+    stack.state so they are part of the checkpoints that reparse resumes from.
+    """
+    extension = ".lua"
+    whole_file = True
+
+    # Code tokens and newlines, with each comment and string as one token. Groups 2 and 3 are the
+    # '=' of a long comment or long string, which its closing bracket repeats.
+    token_pattern = re.compile(r'''
+        ( [{}();\n]
+        | [=~<>]=
+        | =
+        | \b(?:function|if|elseif|else|end|for|while|do|repeat|until|local|require)\b
+        | -(?:-\[(=*)\[(?s:.*?)(?:\]\2\]|\Z)|-.*)
+        | \[(=*)\[(?s:.*?)(?:\]\3\]|\Z)
+        | "(?:\\.|[^"\\\n])*"?
+        | '(?:\\.|[^'\\\n])*'?)
+    ''', re.VERBOSE)
+    long_bracket_pattern = re.compile(r'(?:--)?\[=*\[')
+    # Comments (group 1) and strings (group 3) anywhere in a buffer, lexed as token_pattern lexes them, with
+    # groups 2 and 4 set for long ones. Text that cannot start either is skipped in one step.
+    literal_pattern = re.compile(r'''[^-"'\[]*(?:(--\[(=*)\[(?s:.*?)(?:\]\2\]|\Z)|--.*)|(\[(=*)\[(?s:.*?)(?:\]\4\]|\Z)|"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)|[-\[]|\Z)''')
+    keywords = ['function', 'if', 'elseif', 'else', 'end', 'for', 'while', 'do', 'repeat', 'until', 'local', 'require']
+    reserved_words = frozenset(['and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto', 'if', 'in',
+                                'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', 'while'])
+    # Types of statements by the token that names them, first match first. Keywords that open a
+    # block come first, so a block opened and closed on one line is named after its opener.
+    statement_labels = {'function': 'f', 'if': 'if', 'elseif': 'elseif', 'else': 'else', 'for': 'for', 'while': 'while',
+                        'repeat': 'repeat', 'do': 'do', 'end': 'end', 'until': 'until', '{': 'tb', '}': 'eof tb',
+                        'local': 'var', 'require': 'require'}
+    statement_ranks = {token: rank for rank, token in enumerate(statement_labels)}
+    code_tokens = set(statement_labels) | {'(', ')', '='}
+
     def __init__(self, file_path):
         super().__init__(file_path)
 
     def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        variables = []
-        for i, line in enumerate(lines, start=1):
-            if '=' in line:  # Simple condition for variable assignment
-                name = line.split('=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
-
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-    
-    def parse_file(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+        return super().get_variables(file_path)
 
-        data = []
+    def new_stack(self):
         stack = Stack()
-        for line_number, line in enumerate(lines, start=1):
-            # Split the line into statements
-            statements = line.split(';')
-
-            for statement in statements:
-                variable_type, stack = self.determine_variable_type(statement.strip(), stack)
-                if variable_type is not None:
-                    name = f"{os.path.basename(self.file_path)}:{line_number}"
-                    data.append([name, ".lua", variable_type, line])
-
-        return pd.DataFrame(data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-    
+        stack.state['long_close'] = None  # Closing bracket of a long string or comment left open, such as ']==]'
+        stack.state['loop_header'] = False  # Inside a for or while header, whose 'do' opens no block of its own
+        return stack
+
+    def get_long_close(self, token, level):
+        # Closing bracket of a long string or comment token that runs on past its text, or None
+        close = ']' + level + ']'
+        if token.endswith(close) and len(token) >= token.index('[') + 2 * len(close):
+            return None
+        return close
+
+    def classify_line(self, line, stack):
+        state = stack.state
+        position = 0
+        if state['long_close'] is not None:
+            position = line.find(state['long_close'])
+            if position == -1:
+                return
+            position += len(state['long_close'])
+            state['long_close'] = None
+
+        # One record for each statement that has a type, statements being split on ';'
+        code_tokens = self.code_tokens
+        statement = []
+        for token, comment_level, string_level in self.token_pattern.findall(line, position):
+            if token in code_tokens:
+                statement.append(token)
+            elif token == ';':
+                line_type = self.classify_statement(statement, stack)
+                if line_type is not None:
+                    yield line_type
+                statement = []
+            elif token[0] in '-[' and self.long_bracket_pattern.match(token):
+                state['long_close'] = self.get_long_close(token, comment_level or string_level)
+        line_type = self.classify_statement(statement, stack)
+        if line_type is not None:
+            yield line_type
+
+    def classify_statement(self, tokens, stack):
+        # Update the stack for the code tokens of one statement and return its type, or None
+        state = stack.state
+        ranks = self.statement_ranks
+        first = None
+        rank = len(ranks)
+        assigned = False
+        required = False
+        for token in tokens:
+            if token == '(':
+                stack.push('parenthesis')
+                continue
+            elif token == ')':
+                stack.pop()
+                continue
+            elif token == '=':
+                assigned = True
+                continue
+            elif token == 'function' or token == 'if' or token == 'repeat':
+                stack.push(token)
+            elif token == '{':
+                stack.push('table')
+            elif token == 'end' or token == 'until' or token == '}':
+                stack.pop()
+            elif token == 'elseif' or token == 'else':
+                stack.pop()
+                stack.push(token)
+            elif token == 'for' or token == 'while':
+                stack.push(token)
+                state['loop_header'] = True
+            elif token == 'do':
+                if state['loop_header']:
+                    state['loop_header'] = False
+                else:
+                    stack.push(token)
+            elif token == 'require':
+                required = True
+            if ranks[token] < rank:
+                first, rank = token, ranks[token]
+
+        if first == 'local' and not assigned:
+            first = 'require' if required else None
+        if first is None:
+            return None
+        level = stack.get_level()
+        if first == 'end':
+            return f'end {stack.get_top()} (sl {level})'
+        elif first == 'local':
+            return f'var (fsl {level})'
+        return f'{self.statement_labels[first]} (sl {level})'
+
+    def classify_analyzed(self, result, file_id, buffer, stack, first_line=1, cancel_event=None):
+        # Whole-file version of classify_line. Comments and strings are found with one regex pass and the
+        # code tokens with a few array operations, so only the code tokens are visited one by one. The
+        # rows and checkpoints are the same as classify_line gives.
+        analysis = LineAnalysis(buffer)
+        count = len(analysis)
+        if count == 0:
+            return
+        state = stack.state
+        literals = []
+        long_brackets = []
+        for match in self.literal_pattern.finditer(buffer):
+            group = match.lastindex
+            if group is not None:
+                literals.append(match.span(group))
+                if match.group(group + 1) is not None:
+                    long_brackets.append(match.span(group))
+        literals = Spans(literals)
+
+        # Code tokens in buffer order: punctuation, '=' outside comparisons and keywords, outside literals
+        punctuation = analysis.positions('{}();')
+        punctuation_codes = np.zeros(128, dtype=np.int64)
+        punctuation_codes[[ord(char) for char in '{}();']] = range(5)
+        assignments = analysis.assignments('~<>')
+        keywords, keyword_codes = analysis.words(buffer, self.keywords)
+        positions = np.concatenate((punctuation, assignments, keywords))
+        codes = np.concatenate((punctuation_codes[analysis.data[punctuation]], np.full(len(assignments), 5), keyword_codes + 6))
+        order = np.argsort(positions, kind='stable')
+        positions, codes = positions[order], codes[order]
+        keep = ~literals.contains(positions)
+        codes = codes[keep]
+        token_lines = analysis.line_of(positions[keep])
+
+        # Leave out the tokens that change neither the stack nor a type: '=' on lines without 'local',
+        # and '(' followed by ')' on the same line, which is a push and a pop
+        local_lines = token_lines[codes == 6 + self.keywords.index('local')]
+        keep = (codes != 5) | np.isin(token_lines, local_lines)
+        codes, token_lines = codes[keep], token_lines[keep]
+        while True:
+            pairs = np.flatnonzero((codes[:-1] == 2) & (codes[1:] == 3) & (token_lines[:-1] == token_lines[1:]))
+            if len(pairs) == 0:
+                break
+            keep = np.ones(len(codes), dtype=bool)
+            keep[pairs] = keep[pairs + 1] = False
+            codes, token_lines = codes[keep], token_lines[keep]
+        tokens = np.array(list('{}();=') + self.keywords, dtype=object)[codes].tolist()
+        token_lines = token_lines.tolist()
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled(file_id)
+
+        # The closing bracket of the long comment or string each checkpoint line starts in, if any
+        line_starts = analysis.starts.tolist()
+        checkpoint_starts = analysis.starts[::self.checkpoint_interval]
+        long_brackets = Spans(long_brackets)
+        inside = long_brackets.contains(checkpoint_starts, first=False)
+        openings = np.searchsorted(long_brackets.starts, checkpoint_starts) - 1
+        long_closes = [']' + self.long_bracket_pattern.match(buffer, start).group().strip('-[') + ']' if is_inside else None
+                       for start, is_inside in zip(np.append(long_brackets.starts, 0)[openings].tolist(), inside.tolist())]
+
+        interval = self.checkpoint_interval
+        classify_statement = self.classify_statement
+        row_lines = []
+        row_types = []
+
+        def add_checkpoint(index):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled(file_id)
+            state['long_close'] = long_closes[index // interval]
+            result.checkpoints[first_line + index] = (len(result) + len(row_lines), line_starts[index], stack.snapshot())
+            state['long_close'] = None
+
+        # Statements end at ';' and at the end of each line
+        statement = []
+        line = -1
+        next_checkpoint = 0
+        for token, token_line in zip(tokens, token_lines):
+            if token_line != line or token == ';':
+                if statement:
+                    line_type = classify_statement(statement, stack)
+                    if line_type is not None:
+                        row_lines.append(line)
+                        row_types.append(line_type)
+                    statement = []
+                while next_checkpoint <= token_line:
+                    add_checkpoint(next_checkpoint)
+                    next_checkpoint += interval
+                line = token_line
+                if token == ';':
+                    continue
+            statement.append(token)
+        if statement:
+            line_type = classify_statement(statement, stack)
+            if line_type is not None:
+                row_lines.append(line)
+                row_types.append(line_type)
+        while next_checkpoint < count:
+            add_checkpoint(next_checkpoint)
+            next_checkpoint += interval
+
+        row_lines = np.array(row_lines, dtype=np.int64)
+        result.extend_arrays(file_id, row_lines + first_line, row_types, np.arange(len(row_types)),
+                             analysis.starts[row_lines], analysis.ends[row_lines])
+
+
+class CFamilyParser(FileParser):
+    """Line classifier shared by the C and C++ parsers.
+
+    Each line is lexed once with a single compiled pattern whose named groups select the
+    action to take, so braces, semicolons and '=' inside comments, string and character
+    literals are never counted. Lexer state that spans lines (an open block comment, a
+    continued preprocessor directive and the stacks saved at each #if) is kept in
+    stack.state, so it is part of the checkpoints that reparse resumes from.
+    """
+    strip_literal = True
+    whole_file = True
+
+    token_pattern = re.compile(r'''
+        (?P<comment>/\*)
+      | (?P<line_comment>//)
+      | (?P<string>"(?:\\.|[^"\\])*"?)
+      | (?P<char>'(?:\\.|[^'\\])*'?)
+      | (?P<open>\{)
+      | (?P<close>\})
+      | (?P<end>;)
+      | (?P<compare>[=!<>]=)
+      | (?P<assign>=)
+    ''', re.VERBOSE)
+    brace_pattern = re.compile(r'[{}]')
+    comparison_pattern = re.compile(r'[=!<>]=')
+    directive_pattern = re.compile(r'\s*#\s*(\w*)')
+    identifier_pattern = re.compile(r'[A-Za-z_]\w*')
 
-    def determine_variable_type(self, line, stack):
-        if 'function' in line:
-            stack.push('function')
-            return f'f (sl {stack.get_level()})', stack
-        elif 'if' in line:
-            stack.push('if')
-            return f'if (sl {stack.get_level()})', stack
-        elif 'elseif' in line:
-            stack.pop()
-            stack.push('elseif')
-            return f'elseif (sl {stack.get_level()})', stack
-        elif 'else' in line:
-            stack.pop()
-            stack.push('else')
-            return f'else (sl {stack.get_level()})', stack
-        elif 'end' in line:
-            stack.pop()
-            return f'end {stack.get_top()} (sl {stack.get_level()})', stack
-        elif '{' in line and '}' in line:  # Table initialization in the same line
-            return f'tb (sl {stack.get_level()})', stack
-        elif '{' in line:
-            stack.push('table')
-            return f'tb (sl {stack.get_level()})', stack
-        elif '}' in line:
-            stack.pop()
-            return f'eof tb (sl {stack.get_level()})', stack
-        elif 'local' in line and '=' in line:
-            return f'var (fsl {stack.get_level()})', stack
-        elif 'require' in line:
-            return f'require (sl {stack.get_level()})', stack
-        elif 'for' in line:
-            stack.push('for')
-            return f'for (sl {stack.get_level()})', stack
-        elif '(' in line:
-            stack.push('parenthesis')
-        elif ')' in line:
-            stack.pop()
-            return None, stack
-
-        return None, stack
-
-        return None, stack
-    
-class CParser(FileParser):
     def __init__(self, file_path):
         super().__init__(file_path)
-        
-    def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
 
-        variables = []
+    def get_buffer_variables(self, file_path, buffer):
+        variables = ParseResult()
+        file_id = variables.add_file(file_path, None, buffer)
         in_multiline_assignment = False
-        variable_name = None
-        for i, line in enumerate(lines, start=1):
+        assignment_start = 0
+        for i, (start, end, line) in enumerate(iter_line_spans(buffer), start=1):
             if '=' in line and ';' in line:  # Simple condition for variable assignment
-                name = line.split('=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
+                variables.append(file_id, i, None, start, end)
             elif '=' in line:  # Start of a multiline variable assignment
                 in_multiline_assignment = True
-                variable_name = line.split('=')[0].strip()  # Get the variable name
+                assignment_start = start
             elif in_multiline_assignment and ';' in line:  # End of a multiline variable assignment
                 in_multiline_assignment = False
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, variable_name + line])
-
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+                # The literal spans the whole statement, from the line holding the variable name
+                variables.append(file_id, i, None, assignment_start, end)
 
-    def parse_file(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        data = []
-        stack = Stack()
+        return variables
 
+    def get_extension(self, file_path):
         # Get the actual file extension
         _, extension = os.path.splitext(file_path)
+        return extension
 
-        in_multiline_statement = False
-        for line_number, line in enumerate(lines, start=1):
-            line = line.strip()
-
-            # Determine the type of the line
-            if ';' in line and '=' not in line:
-                line_type = f"declaration({stack.get_level()})"
-            elif '{' in line:
-                stack.push('{')
-                line_type = f"block_start({stack.get_level()})"
-            elif '}' in line:
-                stack.pop()
-                line_type = f"block_end({stack.get_level()})"
-            elif '=' in line and ';' in line:  # Simple condition for variable assignment
-                line_type = f"assignment({stack.get_level()})"
-            elif '=' in line:  # Start of a multiline variable assignment
-                in_multiline_statement = True
-                line_type = f"multiline_assignment_start({stack.get_level()})"
-            elif in_multiline_statement and ';' in line:  # End of a multiline variable assignment
-                in_multiline_statement = False
-                line_type = f"multiline_assignment_end({stack.get_level()})"
-            elif in_multiline_statement:  # Middle of a multiline variable assignment
-                line_type = f"multiline_assignment({stack.get_level()})"
-            else:
-                line_type = f"unknown({stack.get_level()})"
-
-            # Append the filename, extension, type, and literal line to the data list
-            data.append([f"{os.path.basename(file_path)}:{line_number}", extension, line_type, line])
-
-        return pd.DataFrame(data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-
-
-
-    
-class CPlusPlusParser(FileParser):
-    def __init__(self, file_path):
-        super().__init__(file_path)
-        
-    def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        variables = []
-        in_multiline_assignment = False
-        variable_name = None
-        for i, line in enumerate(lines, start=1):
-            if '=' in line and ';' in line:  # Simple condition for variable assignment
-                name = line.split('=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
-            elif '=' in line:  # Start of a multiline variable assignment
-                in_multiline_assignment = True
-                variable_name = line.split('=')[0].strip()  # Get the variable name
-            elif in_multiline_assignment and ';' in line:  # End of a multiline variable assignment
-                in_multiline_assignment = False
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, variable_name + line])
-
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-
-
-    def parse_file(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        data = []
+    def new_stack(self):
         stack = Stack()
+        stack.state['in_multiline_statement'] = False
+        stack.state['in_comment'] = False  # Inside a /* */ comment
+        stack.state['in_directive'] = False  # The previous directive line ended with a backslash
+        stack.state['conditionals'] = ()  # Stack saved at each open #if, restored at #elif and #else
+        return stack
+
+    def iter_code(self, line, stack):
+        # Yield (kind, start, end) for each token of the line, updating the comment state.
+        # A comment is one token from its opening to its closing marker or the end of the line.
+        state = stack.state
+        length = len(line)
+        position = 0
+        if state['in_comment']:
+            position = line.find('*/')
+            if position == -1:
+                yield 'comment', 0, length
+                return
+            state['in_comment'] = False
+            position += 2
+            yield 'comment', 0, position
+
+        match = self.token_pattern.search(line, position)
+        while match is not None:
+            kind = match.lastgroup
+            if kind == 'line_comment':
+                yield kind, match.start(), length
+                return
+            if kind == 'comment':
+                end = line.find('*/', match.end())
+                if end == -1:
+                    state['in_comment'] = True
+                    yield kind, match.start(), length
+                    return
+                yield kind, match.start(), end + 2
+                match = self.token_pattern.search(line, end + 2)
+                continue
+            yield kind, match.start(), match.end()
+            match = self.token_pattern.search(line, match.end())
+
+    def iter_identifiers(self, line, stack):
+        # Yield (column, name) for each identifier of the line outside comments and literals
+        position = 0
+        for kind, start, end in self.iter_code(line, stack):
+            for identifier in self.identifier_pattern.finditer(line, position, start):
+                yield identifier.start(), identifier.group()
+            position = end
+        for identifier in self.identifier_pattern.finditer(line, position):
+            yield identifier.start(), identifier.group()
+
+    def handle_directive(self, line, stack):
+        state = stack.state
+        if not state['in_directive']:
+            name = self.directive_pattern.match(line).group(1)
+            conditionals = state['conditionals']
+            if name in ('if', 'ifdef', 'ifndef'):
+                state['conditionals'] = conditionals + (tuple(stack.stack),)
+            elif name in ('elif', 'elifdef', 'elifndef', 'else'):
+                # Every branch starts from the braces open at the #if, so they are counted once
+                if conditionals:
+                    stack.stack = list(conditionals[-1])
+            elif name == 'endif':
+                state['conditionals'] = conditionals[:-1]
+        for token in self.iter_code(line, stack):
+            pass  # Only the comment state matters inside a directive
+        state['in_directive'] = line.rstrip().endswith('\\')
+
+    def classify_line(self, line, stack):
+        state = stack.state
+        if state['in_directive'] or ('#' in line and not state['in_comment'] and line.lstrip().startswith('#')):
+            self.handle_directive(line, stack)
+            yield f"preprocessor({stack.get_level()})"
+            return
+
+        had_comment = False
+        if state['in_comment'] or '/' in line and ('/*' in line or '//' in line):
+            # Keep the code tokens; the comments are gone, but whether there was code around them is not
+            kinds = []
+            has_code = False
+            position = 0
+            for kind, start, end in self.iter_code(line, stack):
+                if kind == 'comment' or kind == 'line_comment':
+                    had_comment = True
+                    has_code = has_code or (start > position and not line[position:start].isspace())
+                else:
+                    has_code = True
+                    kinds.append(kind)
+                position = end
+            has_code = has_code or (position < len(line) and not line[position:].isspace())
+        elif '"' in line or "'" in line:
+            kinds = [match.lastgroup for match in self.token_pattern.finditer(line)]
+            has_code = True
+        else:
+            # No literals or comments: the tokens can be read off the line directly
+            kinds = None
+            has_code = not line.isspace() and line != ''
+
+        last_brace = None
+        depth = len(stack.stack)
+        if kinds is None:
+            if '{' in line or '}' in line:
+                for symbol in self.brace_pattern.findall(line):
+                    if symbol == '{':
+                        stack.push('{')
+                    else:
+                        stack.pop()
+                last_brace = 'open' if line.rfind('{') > line.rfind('}') else 'close'
+            terminated = ';' in line
+            assigned = '=' in line and '=' in self.comparison_pattern.sub('', line)
+        else:
+            for kind in kinds:
+                if kind == 'open':
+                    stack.push('{')
+                    last_brace = kind
+                elif kind == 'close':
+                    stack.pop()
+                    last_brace = kind
+            terminated = 'end' in kinds
+            assigned = 'assign' in kinds
+
+        yield self.get_line_type(stack, depth, has_code, had_comment, last_brace == 'open', terminated, assigned)
+
+    def get_line_type(self, stack, depth, has_code, had_comment, last_open, terminated, assigned):
+        # depth is the number of open blocks before the line; the stack already reflects its braces
+        state = stack.state
+        in_multiline_statement = state['in_multiline_statement']
+
+        # Determine the type of the line
+        if not has_code:
+            line_type = f"comment({stack.get_level()})" if had_comment else f"unknown({stack.get_level()})"
+        elif in_multiline_statement and terminated:  # End of a multiline variable assignment
+            in_multiline_statement = False
+            line_type = f"multiline_assignment_end({stack.get_level()})"
+        elif last_open:
+            line_type = f"block_start({stack.get_level()})"
+        elif len(stack.stack) < depth:  # Lines that open and close a block are statements
+            line_type = f"block_end({stack.get_level()})"
+        elif terminated and assigned:  # Simple condition for variable assignment
+            line_type = f"assignment({stack.get_level()})"
+        elif terminated:
+            line_type = f"declaration({stack.get_level()})"
+        elif assigned:  # Start of a multiline variable assignment
+            in_multiline_statement = True
+            line_type = f"multiline_assignment_start({stack.get_level()})"
+        elif in_multiline_statement:  # Middle of a multiline variable assignment
+            line_type = f"multiline_assignment({stack.get_level()})"
+        else:
+            line_type = f"unknown({stack.get_level()})"
+
+        state['in_multiline_statement'] = in_multiline_statement
+        return line_type
+
+    # Comments (group 1) and string or character literals (group 2) anywhere in a buffer, lexed as
+    # iter_code lexes them line by line. Text that cannot start either is skipped in one step.
+    literal_pattern = re.compile(r'''[^/"']*(?:(/\*(?s:.*?)(?:\*/|\Z)|//[^\n]*)|("(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)|/|\Z)''')
+    line_type_names = ['unknown', 'comment', 'preprocessor', 'multiline_assignment_end', 'block_start', 'block_end',
+                       'assignment', 'declaration', 'multiline_assignment_start', 'multiline_assignment', 'unknown']
+
+    def classify_analyzed(self, result, file_id, buffer, stack, first_line=1, cancel_event=None):
+        # Whole-file version of classify_line for a fresh stack, which it leaves as it is. Comments
+        # and literals are found with one regex pass, every per-line column is a few array operations,
+        # and only directive lines are visited one by one. The rows and checkpoints are the same as
+        # classify_line gives.
+        analysis = LineAnalysis(buffer)
+        count = len(analysis)
+        if count == 0:
+            return
+        starts = analysis.starts
+        state = stack.state
+        comments = []
+        literals = []
+        for match in self.literal_pattern.finditer(buffer):
+            if match.lastindex == 1:
+                comments.append(match.span(1))
+            elif match.lastindex == 2:
+                literals.append(match.span(2))
+        comments = Spans(comments)
+        literals = Spans(literals)
+        # Lines that start inside a comment opened before them
+        line_in_comment = comments.contains(starts, first=False)
+
+        # Directive lines: a '#' first on a line outside comments, and the lines its backslashes continue
+        first = analysis.stripped_starts
+        candidates = np.flatnonzero((first < analysis.ends) & ~line_in_comment &
+                                    (analysis.data[np.minimum(first, len(analysis.data) - 1)] == ord('#'))).tolist()
+        line_starts = starts.tolist()
+        line_ends = analysis.ends.tolist()
+        directives = {}  # Line index -> directive name, or None for a continuation line
+        for index in candidates:
+            if index in directives:
+                continue
+            line = buffer[line_starts[index]:line_ends[index]]
+            directives[index] = self.directive_pattern.match(line).group(1)
+            while line.rstrip().endswith('\\') and index + 1 < count:
+                index += 1
+                line = buffer[line_starts[index]:line_ends[index]]
+                directives[index] = None
+        is_directive = np.zeros(count, dtype=bool)
+        is_directive[list(directives)] = True
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled(file_id)
+
+        # Per-line marks, counting only code outside comments, literals and directives
+        code = ~is_directive
+        def outside(positions):
+            return positions[~(comments.contains(positions) | literals.contains(positions))]
+
+        braces = outside(analysis.positions('{}'))
+        brace_lines = analysis.line_of(braces)
+        keep = code[brace_lines]
+        braces, brace_lines = braces[keep], brace_lines[keep]
+        steps = np.where(analysis.data[braces] == ord('{'), 1, -1)
+        opens = np.bincount(brace_lines, steps > 0, minlength=count)[:count].astype(np.int64)
+        closes = np.bincount(brace_lines, steps < 0, minlength=count)[:count].astype(np.int64)
+        last = np.searchsorted(brace_lines, np.arange(count), side='right') - 1
+        last_open = (last >= 0) & (np.append(brace_lines, -1)[last] == np.arange(count)) & (np.append(steps, 0)[last] > 0)
+        terminated = code & (analysis.count(outside(analysis.positions(';'))) > 0)
+        assigned = code & (analysis.count(outside(analysis.assignments())) > 0)
+        has_code = code & (analysis.code_counts(None) > analysis.code_counts(comments))
+        had_comment = analysis.line_ranges(comments)
+
+        # Depth after each line. Read as a function of the depth before it, a line of braces with '}'
+        # ignored at depth 0 is max(depth + net, floor), where floor is its result from depth 0.
+        net = opens - closes
+        totals = np.cumsum(steps)
+        group_starts = np.searchsorted(brace_lines, np.arange(count))
+        lowest = np.zeros(count, dtype=np.int64)
+        with_braces = np.flatnonzero(opens + closes)
+        if len(with_braces):
+            before_line = np.append(0, totals)[group_starts[with_braces]]
+            lowest[with_braces] = np.minimum.reduceat(totals, group_starts[with_braces]) - before_line
+        floors = net - np.minimum(0, lowest)
+        depths = self.scan_depths(net, floors, len(stack.stack))
+
+        # #elif and #else restore the stack saved at their #if, which changes the depths that follow
+        # only when the branch before them left it unbalanced
+        open_conditionals = []
+        conditional_lines = {}  # Line index -> indexes of the #if lines open before it
+        checkpoint_lines = range(0, count, self.checkpoint_interval)
+        depth = len(stack.stack)
+        for index in sorted(set(checkpoint_lines) | {index for index, name in directives.items() if name}):
+            conditional_lines[index] = tuple(open_conditionals)
+            name = directives.get(index)
+            if name in ('if', 'ifdef', 'ifndef'):
+                open_conditionals.append(index)
+            elif name in ('elif', 'elifdef', 'elifndef', 'else'):
+                if open_conditionals:
+                    saved = self.depth_before(depths, open_conditionals[-1], depth)
+                    if self.depth_before(depths, index, depth) != saved:
+                        depths[index:] = self.scan_depths(net[index:], floors[index:], saved)
+            elif name == 'endif':
+                open_conditionals = open_conditionals[:-1]
+        before = np.append(len(stack.stack), depths[:-1])
+
+        # Multiline statements: a terminated line ends one, an unterminated assignment starts one
+        closing = depths < before
+        starting = has_code & assigned & ~terminated & ~last_open & ~closing
+        events = np.where(has_code & terminated, 0, np.where(starting, 1, -1))
+        last_event = np.maximum.accumulate(np.where(events >= 0, np.arange(count), -1))
+        in_statement = np.where(last_event >= 0, events[last_event] == 1, state['in_multiline_statement'])
+        in_statement_before = np.append(state['in_multiline_statement'], in_statement[:-1])
+
+        kinds = np.select([is_directive, ~has_code & had_comment, ~has_code, in_statement_before & terminated,
+                           last_open, closing, terminated & assigned, terminated, assigned, in_statement_before],
+                          [2, 1, 0, 3, 4, 5, 6, 7, 8, 9], 10)
+        # Labels are made once for each (kind, level) pair in the file
+        keys, row_types = np.unique(depths * len(self.line_type_names) + kinds, return_inverse=True)
+        labels = [f"{self.line_type_names[key % len(self.line_type_names)]}({key // len(self.line_type_names)})"
+                  for key in keys.tolist()]
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled(file_id)
+
+        # The stack and state classify_line would have had before each checkpoint line
+        for index in checkpoint_lines:
+            checkpoint = self.new_stack()
+            checkpoint.stack = [('{', level) for level in range(1, self.depth_before(depths, index, depth) + 1)]
+            checkpoint.state['in_multiline_statement'] = bool(in_statement_before[index])
+            checkpoint.state['in_comment'] = bool(line_in_comment[index])
+            checkpoint.state['in_directive'] = index in directives and directives[index] is None
+            checkpoint.state['conditionals'] = tuple(
+                tuple(('{', level) for level in range(1, self.depth_before(depths, line, depth) + 1))
+                for line in conditional_lines[index])
+            result.checkpoints[first_line + index] = (len(result) + index, line_starts[index], checkpoint.snapshot())
+
+        if self.strip_literal:
+            row_starts, row_ends = analysis.stripped_starts, analysis.stripped_ends
+        else:
+            row_starts, row_ends = starts, analysis.ends
+        result.extend_arrays(file_id, np.arange(first_line, first_line + count), labels, row_types, row_starts, row_ends)
 
-        # Get the actual file extension
-        _, extension = os.path.splitext(file_path)
+    def scan_depths(self, net, floors, depth):
+        # Depth after each line from the depth before the first: the running composition of
+        # max(depth + net, floor), which is net so far plus the highest floor reached relative to it
+        totals = np.cumsum(net)
+        return totals + np.maximum(depth, np.maximum.accumulate(floors - totals))
 
-        in_multiline_statement = False
-        for line_number, line in enumerate(lines, start=1):
-            line = line.strip()
-
-            # Determine the type of the line
-            if ';' in line and '=' not in line:
-                line_type = f"declaration({stack.get_level()})"
-            elif '{' in line:
-                stack.push('{')
-                line_type = f"block_start({stack.get_level()})"
-            elif '}' in line:
-                stack.pop()
-                line_type = f"block_end({stack.get_level()})"
-            elif '=' in line and ';' in line:  # Simple condition for variable assignment
-                line_type = f"assignment({stack.get_level()})"
-            elif '=' in line:  # Start of a multiline variable assignment
-                in_multiline_statement = True
-                line_type = f"multiline_assignment_start({stack.get_level()})"
-            elif in_multiline_statement and ';' in line:  # End of a multiline variable assignment
-                in_multiline_statement = False
-                line_type = f"multiline_assignment_end({stack.get_level()})"
-            elif in_multiline_statement:  # Middle of a multiline variable assignment
-                line_type = f"multiline_assignment({stack.get_level()})"
-            else:
-                line_type = f"unknown({stack.get_level()})"
+    def depth_before(self, depths, index, depth):
+        return int(depths[index - 1]) if index else depth
 
-            # Append the filename, extension, type, and literal line to the data list
-            data.append([f"{os.path.basename(file_path)}:{line_number}", extension, line_type, line])
 
-        return pd.DataFrame(data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+class CParser(CFamilyParser):
+    reserved_words = frozenset(['auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum',
+                                'extern', 'float', 'for', 'goto', 'if', 'inline', 'int', 'long', 'register', 'restrict', 'return',
+                                'short', 'signed', 'sizeof', 'static', 'struct', 'switch', 'typedef', 'union', 'unsigned', 'void',
+                                'volatile', 'while', '_Bool', '_Complex', '_Imaginary'])
 
 
+class CPlusPlusParser(CFamilyParser):
+    reserved_words = CParser.reserved_words | frozenset([
+        'alignas', 'alignof', 'bool', 'catch', 'class', 'const_cast', 'constexpr', 'decltype', 'delete', 'dynamic_cast',
+        'explicit', 'false', 'friend', 'mutable', 'namespace', 'new', 'noexcept', 'nullptr', 'operator', 'private',
+        'protected', 'public', 'reinterpret_cast', 'static_assert', 'static_cast', 'template', 'this', 'throw', 'true',
+        'try', 'typeid', 'typename', 'using', 'virtual', 'wchar_t'])
 
 
 class PascalParser(FileParser):
+    """Line classifier for Pascal.
+
+    Lines are lexed with a single compiled pattern, so '{ }', '(* *)' and '//' comments and
+    quoted strings (with '' as an escaped quote) never change the stack, and keywords are
+    matched as whole words in any case. begin, record, case, try, asm and repeat open a
+    block, as does a class, object or interface type with a body; end or until closes it.
+    Every line gets a row, so lines inside a comment are labelled comment. A comment left
+    open at the end of a line is kept in stack.state, so checkpoints resume inside it.
+    """
+    strip_literal = True
+    whole_file = True
+
+    keywords = ['begin', 'end', 'record', 'case', 'try', 'asm', 'repeat', 'until',
+                'class', 'object', 'interface', 'dispinterface', 'var', 'of', 'for']
+    # Comments, strings, words, ':=' and the like, then any other character, each one token.
+    # A comment or string left open runs to the end of the text.
+    token_pattern = re.compile(r'''
+        \{[^}]*\}?
+      | \(\*(?s:.*?)(?:\*\)|\Z)
+      | //[^\n]*
+      | '(?:[^'\n]|'')*'?
+      | \w+
+      | [:<>]=
+      | \S
+      | \n
+    ''', re.VERBOSE)
+    # Kind of each token that matters, by its lowercase text; any other token is 'x'
+    token_kinds = {token: token for token in keywords + [';', ':', ':=', '=', '\n']}
+    literal_pattern = re.compile(r'''[^{(/']*(?:(\{[^}]*\}?|\(\*(?s:.*?)(?:\*\)|\Z)|//[^\n]*)|('(?:[^'\n]|'')*'?)|[(/]|\Z)''')
+    # Lowercase, as Pascal words match in any case
+    reserved_words = frozenset(['and', 'array', 'as', 'asm', 'begin', 'case', 'class', 'const', 'constructor', 'destructor', 'div',
+                                'do', 'downto', 'else', 'end', 'except', 'file', 'finalization', 'finally', 'for', 'function',
+                                'goto', 'if', 'implementation', 'in', 'inherited', 'initialization', 'inline', 'interface', 'is',
+                                'label', 'mod', 'nil', 'not', 'object', 'of', 'on', 'or', 'out', 'packed', 'procedure', 'program',
+                                'property', 'raise', 'record', 'repeat', 'set', 'shl', 'shr', 'string', 'then', 'to', 'try',
+                                'type', 'unit', 'until', 'uses', 'var', 'while', 'with', 'xor'])
+    block_openers = {'begin', 'record', 'try', 'asm', 'repeat'}
+    type_openers = {'class', 'object', 'interface', 'dispinterface'}  # Open a block after '=', unless forward declared
+
     def __init__(self, file_path):
         super().__init__(file_path)
         
-    def get_variables(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        variables = []
+    def get_buffer_variables(self, file_path, buffer):
+        variables = ParseResult()
+        file_id = variables.add_file(file_path, None, buffer)
         in_multiline_assignment = False
-        variable_name = None
-        for i, line in enumerate(lines, start=1):
+        assignment_start = 0
+        for i, (start, end, line) in enumerate(iter_line_spans(buffer), start=1):
             if ':=' in line and ';' in line:  # Simple condition for variable assignment
-                name = line.split(':=')[0].strip()  # Get the variable name
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, line])
+                variables.append(file_id, i, None, start, end)
             elif ':=' in line:  # Start of a multiline variable assignment
                 in_multiline_assignment = True
-                variable_name = line.split(':=')[0].strip()  # Get the variable name
+                assignment_start = start
             elif in_multiline_assignment and ';' in line:  # End of a multiline variable assignment
                 in_multiline_assignment = False
-                variables.append([f"{os.path.basename(self.file_path)}:{i}", None, None, variable_name + line])
+                # The literal spans the whole statement, from the line holding the variable name
+                variables.append(file_id, i, None, assignment_start, end)
 
-        return pd.DataFrame(variables, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
+        return variables
 
     
-    def parse_file(self, file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        data = []
-        stack = Stack()
-        in_comment = False
-        in_string = False
-        in_multiline_statement = False
-
+    def get_extension(self, file_path):
         # Get the actual file extension
         _, extension = os.path.splitext(file_path)
+        return extension
 
-        for line_number, line in enumerate(lines, start=1):
-            line = line.strip()
-
-            # Handle multiline comments
-            if '{' in line:
-                in_comment = True
-            if '}' in line:
-                in_comment = False
-                continue  # Skip multiline comments
+    def get_identifiers(self, buffer, result=None):
+        reserved = self.reserved_words
+        return [identifier for identifier in super().get_identifiers(buffer, result) if identifier[0].lower() not in reserved]
 
-            if in_comment:
-                continue
-
-            # Handle strings
-            if "'" in line:
-                in_string = not in_string
-            if in_string:
-                continue  # Skip strings
-
-            # Determine the type of the line
-            if 'var' in line or ':' in line:
-                line_type = f"declaration({stack.get_level()})"
-            elif 'begin' in line:
-                stack.push('begin')
-                line_type = f"block_start({stack.get_level()})"
-            elif 'end' in line:
-                stack.pop()
-                line_type = f"block_end({stack.get_level()})"
-            elif ':=' in line and ';' in line:  # Simple condition for variable assignment
-                line_type = f"assignment({stack.get_level()})"
-            elif ':=' in line:  # Start of a multiline variable assignment
-                in_multiline_statement = True
-                line_type = f"multiline_assignment_start({stack.get_level()})"
-            elif in_multiline_statement and ';' in line:  # End of a multiline variable assignment
-                in_multiline_statement = False
-                line_type = f"multiline_assignment_end({stack.get_level()})"
-            elif in_multiline_statement:  # Middle of a multiline variable assignment
-                line_type = f"multiline_assignment({stack.get_level()})"
+    def new_stack(self):
+        stack = Stack()
+        stack.state['comment_close'] = None  # '}' or '*)' of a comment left open
+        stack.state['in_multiline_statement'] = False
+        stack.state['type_header'] = False  # Right after '= class' and the like, before the body if there is one
+        return stack
+
+    def iter_line_tokens(self, text, state):
+        # Yield (kinds, comment_only, comment_close) for each line of text: the kinds of its tokens other
+        # than 'x', whether it holds comments and no code, and the close of a comment it starts inside,
+        # or None. The close of a comment still open at the end of the text is left in state['comment_close'].
+        token_kinds = self.token_kinds
+        known_kinds = dict(token_kinds)  # Also gets the kind of each word and character seen, so most tokens cost one lookup
+        close = line_close = state['comment_close']
+        commented = close is not None
+        coded = False
+        kinds = []
+        position = 0
+        if close is not None:
+            end = text.find(close)
+            position = len(text) if end == -1 else end + len(close)
+            for _ in range(text.count('\n', 0, position)):
+                yield kinds, True, line_close
+                kinds = []
+            if end != -1:
+                close = None
+
+        for token in self.token_pattern.findall(text, position):
+            kind = known_kinds.get(token)
+            if kind is None:
+                first = token[0]
+                if first == '{' or token[:2] == '(*' or token[:2] == '//':
+                    commented = True
+                    comment_close = '}' if first == '{' else '*)' if first == '(' else None
+                    if comment_close is not None:
+                        if not token.endswith(comment_close) or len(token) < len(comment_close) * 2:
+                            close = comment_close
+                        for _ in range(token.count('\n')):
+                            yield kinds, not coded and not kinds, line_close
+                            kinds = []
+                            coded = False
+                            line_close = comment_close
+                    continue
+                kind = token_kinds.get(token.lower(), 'x')
+                if first != "'":
+                    known_kinds[token] = kind
+            if kind == 'x':
+                coded = True
+            elif kind == '\n':
+                yield kinds, commented and not coded and not kinds, line_close
+                kinds = []
+                commented = coded = False
+                line_close = None
             else:
-                line_type = f"unknown({stack.get_level()})"
-
-            # Append the filename, extension, type, and literal line to the data list
-            data.append([f"{os.path.basename(file_path)}:{line_number}", extension, line_type, line])
-
-        return pd.DataFrame(data, columns=['FileName', 'Extension', 'Type', 'LiteralLine'])
-
-
+                kinds.append(kind)
+
+        if text and not text.endswith('\n'):
+            yield kinds, commented and not coded and not kinds, line_close
+        state['comment_close'] = close
+
+    def classify_tokens(self, kinds, comment_only, stack):
+        # Update the stack for the tokens of one line and return its type
+        state = stack.state
+        declared = opened = closed = assigned = terminated = looped = False
+        previous = None
+        for kind in kinds:
+            if state['type_header']:
+                if kind == ';' or kind == 'of':
+                    # A forward declaration, a class reference type or a type with no body
+                    stack.pop()
+                    opened = False
+                state['type_header'] = False
+
+            if kind in self.block_openers:
+                stack.push(kind)
+                opened = True
+            elif kind == 'case':
+                # The variant part of a record ends with the record
+                if stack.get_top() != 'record':
+                    stack.push(kind)
+                    opened = True
+            elif kind in self.type_openers and previous == '=':
+                stack.push(kind)
+                state['type_header'] = True
+                opened = True
+            elif kind == 'end' or kind == 'until':
+                stack.pop()
+                closed = True
+            elif kind == 'var' or kind == ':':
+                declared = True
+            elif kind == ':=':
+                assigned = not looped
+            elif kind == 'for':
+                looped = True  # Its ':=' sets the loop variable
+            elif kind == ';':
+                terminated = True
+            previous = kind
+
+        level = stack.get_level()
+        if declared:
+            return f"declaration({level})"
+        elif opened:
+            return f"block_start({level})"
+        elif closed:
+            return f"block_end({level})"
+        elif assigned and terminated:  # Simple condition for variable assignment
+            return f"assignment({level})"
+        elif assigned:  # Start of a multiline variable assignment
+            state['in_multiline_statement'] = True
+            return f"multiline_assignment_start({level})"
+        elif state['in_multiline_statement'] and terminated:  # End of a multiline variable assignment
+            state['in_multiline_statement'] = False
+            return f"multiline_assignment_end({level})"
+        elif state['in_multiline_statement']:  # Middle of a multiline variable assignment
+            return f"multiline_assignment({level})"
+        elif comment_only:
+            return f"comment({level})"
+        return f"unknown({level})"
+
+    def classify_line(self, line, stack):
+        for kinds, comment_only, _ in self.iter_line_tokens(line, stack.state):
+            yield self.classify_tokens(kinds, comment_only, stack)
+
+    def classify_analyzed(self, result, file_id, buffer, stack, first_line=1, cancel_event=None):
+        # The whole buffer is lexed in one pass. The rows and checkpoints are the same as
+        # classify_line gives line by line.
+        analysis = LineAnalysis(buffer)
+        line_starts = analysis.starts.tolist()
+        interval = self.checkpoint_interval
+        state = stack.state
+        classify_tokens = self.classify_tokens
+        labels = {}
+        row_types = []
+        for index, (kinds, comment_only, comment_close) in enumerate(self.iter_line_tokens(buffer, state)):
+            if index % interval == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ParseCancelled(file_id)
+                # The lexer is past the start of the line by now, so the comment open there is put back for the snapshot
+                open_close = state['comment_close']
+                state['comment_close'] = comment_close
+                result.checkpoints[first_line + index] = (len(result) + index, line_starts[index], stack.snapshot())
+                state['comment_close'] = open_close
+            line_type = classify_tokens(kinds, comment_only, stack)
+            row_types.append(labels.setdefault(line_type, len(labels)))
+
+        count = len(row_types)
+        result.extend_arrays(file_id, np.arange(first_line, first_line + count), list(labels), np.array(row_types, dtype=np.int64),
+                             analysis.stripped_starts, analysis.stripped_ends)
+
+    def index_blocks(self, buffer):
+        # (kind, start_line, end_line) of every block of the buffer in order of their start, matched in one
+        # pass over the tokens. end_line is None for a block left open.
+        stack = IndexingStack()
+        stack.state = self.new_stack().state
+        for line_number, (kinds, comment_only, _) in enumerate(self.iter_line_tokens(buffer, stack.state), start=1):
+            stack.line_number = line_number
+            self.classify_tokens(kinds, comment_only, stack)
+        return [tuple(block) for block in stack.blocks]
 
 
 class ParserManager:
-    def __init__(self):
+    parser_classes = {
+        '.lua': LuaFileParser,
+        '.c': CParser,
+        '.h': CParser,
+        '.cpp': CPlusPlusParser,
+        '.cc': CPlusPlusParser,
+        '.cxx': CPlusPlusParser,
+        '.hpp': CPlusPlusParser,
+        '.hh': CPlusPlusParser,
+        '.hxx': CPlusPlusParser,
+        '.pas': PascalParser,
+    }
+
+    def __init__(self, cache=None, python_engine='stack', symbol_index=None):
         self.parsers = {}
+        self.cache = cache  # Optional ParseCache consulted before parsing
+        self.python_engine = python_engine  # Engine used by PythonFileParser, 'stack' or 'ast'
+        self.symbol_index = symbol_index  # Optional SymbolIndex filled with the identifiers of parsed files
 
     def get_parser(self, file_extension, file_path):
         if file_extension in self.parsers:
             return self.parsers[file_extension]
         else:
-            if file_extension == '.lua':
-                self.parsers[file_extension] = LuaFileParser(file_path)
-            elif file_extension == '.py':
-                self.parsers[file_extension] = PythonFileParser(file_path)
-            elif file_extension == '.c':
-                self.parsers[file_extension] = CParser(file_path)
-            elif file_extension == '.cpp':
-                self.parsers[file_extension] = CPlusPlusParser(file_path)
-            elif file_extension == '.pas':
-                self.parsers[file_extension] = PascalParser(file_path)
+            if file_extension == '.py':
+                self.parsers[file_extension] = PythonFileParser(file_path, self.python_engine)
             else:
-                self.parsers[file_extension] = FileParser(file_path)
+                parser_class = self.parser_classes.get(file_extension, FileParser)
+                self.parsers[file_extension] = parser_class(file_path)
             return self.parsers[file_extension]
+
+    def parse(self, file_path, cancel_event=None):
+        file_extension = os.path.splitext(file_path)[1]
+        parser = self.get_parser(file_extension, file_path)
+        # Stat before reading, so a file saved during the parse is indexed again next time
+        stat = self.symbol_index.stale_stat(file_path) if self.symbol_index is not None else None
+        if self.cache is None:
+            result = parser.parse_file(file_path, cancel_event)
+        else:
+            key, result = self.cache.lookup(file_path, parser)
+            if result is None:
+                result = parser.parse_file(file_path, cancel_event)
+                self.cache.store(file_path, key, result)
+
+        symbols = get_symbols(parser, result, stat)
+        if symbols is not None:
+            self.symbol_index.update(file_path, *symbols)
+        return result
+
+    def invalidate(self, file_path):
+        self.invalidate_many([file_path])
+
+    def invalidate_many(self, file_paths):
+        # Forget the cached fingerprints and the indexed symbols of files removed from disk, in one
+        # transaction each. Files that changed need none of this: the cache is keyed by content and
+        # the index notices their new stat, so they are indexed again instead.
+        if self.cache is not None:
+            self.cache.invalidate_many(file_paths)
+        if self.symbol_index is not None:
+            self.symbol_index.remove_many(file_paths)
+
+    def parse_many(self, paths, workers=None, cancel_event=None, batch_bytes=1 << 20):
+        # Parse files in a process pool and yield (file_path, ParseResult) as each batch completes.
+        # Set cancel_event (a threading.Event) or close the generator to stop early.
+        # With a symbol_index, the workers also return the identifiers of the files they parse
+        cache_keys = {}
+        index_symbols = self.symbol_index is not None
+        if self.cache is not None:
+            misses = []
+            for file_path in paths:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                parser = self.get_parser(os.path.splitext(file_path)[1], file_path)
+                stat = self.symbol_index.stale_stat(file_path) if index_symbols else None
+                key, result = self.cache.lookup(file_path, parser)
+                if result is None:
+                    cache_keys[file_path] = key
+                    misses.append(file_path)
+                else:
+                    symbols = get_symbols(parser, result, stat)
+                    if symbols is not None:
+                        self.symbol_index.update(file_path, *symbols)
+                    yield file_path, result
+            paths = misses
+
+        paths = list(paths)
+        if (workers or os.cpu_count() or 1) == 1 or fits_one_batch(paths, batch_bytes):
+            # Not worth starting a pool, as for the few files of a save
+            for file_path in paths:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                parser = self.get_parser(os.path.splitext(file_path)[1], file_path)
+                symbols = None
+                try:
+                    stat = os.stat(file_path) if index_symbols else None
+                    result = parser.parse_file(file_path, cancel_event)
+                    symbols = get_symbols(parser, result, stat)
+                except ParseCancelled:
+                    return
+                except Exception as e:
+                    print(f"Error parsing {file_path}: {e}")
+                    result = ParseResult()
+                if symbols is not None:
+                    self.symbol_index.update(file_path, *symbols)
+                if file_path in cache_keys:
+                    self.cache.store(file_path, cache_keys[file_path], result)
+                yield file_path, result
+            return
+
+        batches = map_batches(parse_batch, paths, (self.python_engine, index_symbols), workers, cancel_event, batch_bytes)
+        try:
+            for batch, future in batches:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Error parsing files: {e}")
+                    results = [(file_path, ParseResult(), None) for file_path in batch]
+
+                if index_symbols:
+                    self.symbol_index.update_many([(file_path, *symbols) for file_path, _, symbols in results if symbols is not None])
+                for file_path, result, _ in results:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    if file_path in cache_keys:
+                        self.cache.store(file_path, cache_keys[file_path], result)
+                    yield file_path, result
+        finally:
+            batches.close()
+
+
+def fits_one_batch(paths, batch_bytes):
+    # Whether paths are a single file or less than batch_bytes of source, which a pool would parse as one task
+    if len(paths) <= 1:
+        return True
+    total = 0
+    for file_path in paths:
+        try:
+            total += os.path.getsize(file_path)
+        except OSError:
+            pass
+        if total >= batch_bytes:
+            return False
+    return True
+
+
+def make_parse_batches(paths, batch_bytes):
+    # Largest files first, so the long parses start early and the small ones fill the gaps.
+    # Files smaller than batch_bytes are grouped so each task carries about batch_bytes of source.
+    sizes = {}
+    for file_path in paths:
+        try:
+            sizes[file_path] = os.path.getsize(file_path)
+        except OSError:
+            sizes[file_path] = 0
+
+    batch = []
+    batch_size = 0
+    for file_path in sorted(sizes, key=sizes.get, reverse=True):
+        batch.append(file_path)
+        batch_size += sizes[file_path]
+        if batch_size >= batch_bytes:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def map_batches(function, paths, args=(), workers=None, cancel_event=None, batch_bytes=1 << 20):
+    # Run function(batch, *args) over make_parse_batches(paths) in a process pool and yield
+    # (batch, future) as each batch completes. Set cancel_event or close the generator to stop early.
+    workers = workers or os.cpu_count() or 1
+    batches = iter(make_parse_batches(paths, batch_bytes))
+    executor = ProcessPoolExecutor(max_workers=workers)
+    in_flight = {}
+    try:
+        # Keep a couple of batches queued per worker so no process sits idle between results
+        for batch in batches:
+            in_flight[executor.submit(function, batch, *args)] = batch
+            if len(in_flight) >= workers * 2:
+                break
+
+        while in_flight:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    in_flight[executor.submit(function, next_batch, *args)] = next_batch
+                yield batch, future
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+_worker_parser_managers = {}
+
+
+def get_symbols(parser, result, stat):
+    # (stat, identifiers) to store in a SymbolIndex, or None without a stat or a parsed buffer
+    if stat is None or len(result.files) != 1:
+        return None
+    return stat, parser.get_identifiers(result.files[0][2], result)
+
+
+def parse_batch(paths, python_engine='stack', index_symbols=False):
+    # Runs inside a pool process, which keeps its ParserManager for all of its batches.
+    # Returns (file_path, result, symbols), symbols as get_symbols gives them when index_symbols is set.
+    parser_manager = _worker_parser_managers.get(python_engine)
+    if parser_manager is None:
+        parser_manager = _worker_parser_managers[python_engine] = ParserManager(python_engine=python_engine)
+
+    results = []
+    for file_path in paths:
+        symbols = None
+        try:
+            stat = os.stat(file_path) if index_symbols else None
+            result = parser_manager.parse(file_path)
+            parser = parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+            symbols = get_symbols(parser, result, stat)
+        except Exception as e:
+            print(f"Error parsing {file_path}: {e}")
+            result = ParseResult()
+        results.append((file_path, result, symbols))
+    return results
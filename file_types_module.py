@@ -1,12 +1,19 @@
 # File: file_types_module.py
 
-from file_parser import LuaFileParser, FileParser
+from file_parser import LuaFileParser, FileParser, CParser, CPlusPlusParser
 
 file_types = {
     ".py": FileParser,
     ".js": FileParser,
     ".java": FileParser,
-    ".cpp": FileParser,
+    ".c": CParser,
+    ".h": CParser,
+    ".cpp": CPlusPlusParser,
+    ".cc": CPlusPlusParser,
+    ".cxx": CPlusPlusParser,
+    ".hpp": CPlusPlusParser,
+    ".hh": CPlusPlusParser,
+    ".hxx": CPlusPlusParser,
     ".cs": FileParser,
     ".rb": FileParser,
     ".php": FileParser,
@@ -0,0 +1,419 @@
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT_STRUCT = struct.Struct('iIII')  # wd, mask, cookie, len, followed by len bytes of name
+READ_BYTES = 1 << 16
+
+# Version control metadata churns on every commit and checkout and is never shown, so it is not watched
+IGNORED_DIRECTORIES = {'.git', '.hg', '.svn'}
+
+
+def merge_event(changes, path, kind):
+    # Fold one event into changes, {path: 'added', 'removed' or 'modified'}, so that a burst of
+    # events on a path leaves one net change
+    previous = changes.get(path)
+    if previous == 'added' and kind == 'removed':
+        del changes[path]  # Came and went within the burst
+    elif previous == 'added':
+        pass  # Still new, whatever was written to it
+    elif previous == 'removed' and kind == 'added':
+        changes[path] = 'modified'  # Replaced, as editors and git do by renaming over a file
+    else:
+        changes[path] = kind
+
+
+def walk_directories(root, before_listing=None):
+    # (directory, file paths) for root and each directory under it, without following directory links;
+    # before_listing(directory) is called on each directory before it is listed
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        if before_listing is not None:
+            before_listing(directory)
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            continue  # Gone already, or not readable
+        files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir() and not entry.is_symlink()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if entry.name not in IGNORED_DIRECTORIES:
+                    pending.append(entry.path)
+            else:
+                files.append(entry.path)
+        yield directory, files
+
+
+def take_snapshot(directory):
+    # {path: (size, mtime_ns)} for each file in directory, and {path: None} for each directory in it;
+    # one stat per file and no reads
+    snapshot = {}
+    try:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+    except OSError:
+        return snapshot  # Gone, which its parent reports if it is watched
+    for entry in entries:
+        try:
+            if entry.is_dir() and not entry.is_symlink():
+                if entry.name not in IGNORED_DIRECTORIES:
+                    snapshot[entry.path] = None
+                continue
+            stat = entry.stat()
+        except OSError:
+            try:
+                stat = entry.stat(follow_symlinks=False)  # Broken link
+            except OSError:
+                continue  # Removed since it was listed
+        snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class PollingWatcher:
+    # Finds changes by comparing stat snapshots of the watched directories, every interval seconds at most
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+        self.snapshots = {}  # Snapshot of each watched directory, by path
+        self.lock = threading.Lock()  # Directories are watched from the Tk thread while read() runs
+        self.closed = threading.Event()
+
+    def watch(self, directory):
+        snapshot = take_snapshot(directory)
+        with self.lock:
+            self.snapshots.setdefault(directory, snapshot)  # A watched one keeps the changes not read yet
+
+    def unwatch(self, directory):
+        with self.lock:
+            self.snapshots.pop(directory, None)
+
+    def read(self, timeout):
+        # [(path, kind)] since the last read, waiting at least interval between snapshots
+        if self.closed.wait(max(timeout, self.interval)):
+            return []
+        with self.lock:
+            directories = list(self.snapshots)
+        changes = []
+        for directory in directories:
+            snapshot = take_snapshot(directory)
+            with self.lock:
+                if directory not in self.snapshots:
+                    continue  # Unwatched meanwhile
+                previous, self.snapshots[directory] = self.snapshots[directory], snapshot
+            changes.extend((path, 'removed') for path in previous if path not in snapshot)
+            for path, fingerprint in snapshot.items():
+                if path not in previous:
+                    changes.append((path, 'added'))
+                elif previous[path] != fingerprint:
+                    changes.append((path, 'modified'))
+        return changes
+
+    def close(self):
+        self.closed.set()
+
+
+class InotifyWatcher:
+    # Linux inotify through ctypes, with a watch on each directory that was asked for
+    def __init__(self, root):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.root = root
+        self.directories = {}  # Watched directory paths by watch descriptor
+        self.lock = threading.Lock()  # Directories are watched from the Tk thread while read() runs
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def watch(self, directory):
+        # Raises OSError when the watch limit (fs.inotify.max_user_watches) is reached. Watching a
+        # directory again is harmless, as the kernel returns the descriptor it already has.
+        with self.lock:
+            if self.fd < 0:
+                return  # Closed
+            wd = self.add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), directory)
+            self.directories[wd] = directory
+
+    def unwatch(self, directory):
+        with self.lock:
+            for wd, watched in list(self.directories.items()):
+                if watched == directory:
+                    del self.directories[wd]
+                    self.rm_watch(self.fd, wd)
+
+    def unwatch_tree(self, root):
+        # Stop watching root and the directories under it, which moved away and would report under
+        # their old paths; they are watched again under the new ones as they are listed there
+        prefix = os.path.join(root, '')
+        with self.lock:
+            for wd, directory in list(self.directories.items()):
+                if directory == root or directory.startswith(prefix):
+                    del self.directories[wd]
+                    self.rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        # [(path, kind)] for the events available within timeout, or None if the kernel queue
+        # overflowed and events were lost
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READ_BYTES)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        offset = 0
+        while offset + EVENT_STRUCT.size <= len(data):
+            wd, mask, _, length = EVENT_STRUCT.unpack_from(data, offset)
+            name = data[offset + EVENT_STRUCT.size:offset + EVENT_STRUCT.size + length].rstrip(b'\0')
+            offset += EVENT_STRUCT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None  # The watches are kept; callers list again what they show
+            with self.lock:
+                directory = self.directories.get(wd)
+                if directory is not None and mask & IN_IGNORED:
+                    del self.directories[wd]
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory is gone; its parent reports that, except for the root
+                if directory == self.root:
+                    changes.append((directory, 'removed'))
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if os.path.basename(path) in IGNORED_DIRECTORIES:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.append((path, 'added'))  # Not watched until someone lists it
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    if mask & IN_MOVED_FROM:
+                        self.unwatch_tree(path)
+                    changes.append((path, 'removed'))  # Stands for everything under it
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                changes.append((path, 'added'))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.append((path, 'removed'))
+            else:
+                changes.append((path, 'modified'))
+        return changes
+
+    def close(self):
+        with self.lock:
+            if self.fd >= 0:
+                os.close(self.fd)
+                self.fd = -1
+
+
+def create_watcher(root, poll_interval=1.0):
+    # inotify on Linux, unless it is unavailable; stat polling everywhere else
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"Error watching {root} with inotify, polling instead: {e}")
+    return PollingWatcher(root, poll_interval)
+
+
+class FileWatcher:
+    """Reports files added, removed and modified in the directories it is asked to watch.
+
+    Only directories that a view has listed are watched, one level each, so a large tree
+    costs watches (or stats, when polling) for what is shown rather than for everything
+    under root. A directory created or moved into a watched one is reported as added,
+    and is watched once it is listed in turn.
+
+    A background thread reads the events of an InotifyWatcher, or a PollingWatcher where
+    inotify cannot be used, and folds them together until none has come for quiet seconds,
+    or for at most max_delay seconds while they keep coming. A burst such as a git checkout
+    or a build thus arrives as one batch with one net change per path. A removed directory
+    may be reported as the directory path alone, standing for every file under it, and a
+    file renamed over another, as editors save, may be reported as added. Each batch goes
+    to every WatchSubscription, which the Tk loop drains with poll() from an after()
+    callback. Paths are joined to root as it is given, as os.scandir joins them.
+    """
+
+    def __init__(self, root, quiet=0.2, max_delay=2.0, poll_interval=1.0):
+        self.root = root
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.watcher = None
+
+    def start(self):
+        # No directory is watched yet, so creating the watcher is cheap and done here, where the
+        # directories can be watched right after
+        self.watcher = create_watcher(self.root, self.poll_interval)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def subscribe(self):
+        subscription = WatchSubscription(self)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # Unwatch the directories no other subscription watches; returns whether any subscription is left
+        with self.lock:
+            if subscription not in self.subscriptions:
+                return True  # Stopped already
+            self.subscriptions.remove(subscription)
+            still_watched = set().union(*(other.directories for other in self.subscriptions))
+            left = bool(self.subscriptions)
+        for directory in subscription.directories - still_watched:
+            self.watcher.unwatch(directory)
+        return left
+
+    def watch(self, directory):
+        try:
+            self.watcher.watch(directory)
+        except FileNotFoundError:
+            pass  # Gone already; its parent reports that if it is watched
+        except OSError as e:
+            print(f"Error watching {directory}: {e}")
+
+    def publish(self, batch):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.batches.put(batch)
+
+    def run(self):
+        pending = {}
+        lost = False  # Whether events were dropped since the last batch
+        first_time = last_time = None
+        try:
+            while not self.stop_event.is_set():
+                timeout = self.quiet if pending or lost else min(self.poll_interval, 0.5)
+                changes = self.watcher.read(timeout)
+                now = time.monotonic()
+                if changes is None:
+                    lost = True
+                    changes = []
+                for path, kind in changes:
+                    merge_event(pending, path, kind)
+                if changes or (lost and first_time is None):
+                    last_time = now
+                    first_time = first_time or now
+                if first_time is not None and (now - last_time >= self.quiet or now - first_time >= self.max_delay):
+                    if lost:
+                        self.publish(None)
+                    elif pending:
+                        self.publish(pending)
+                    pending = {}
+                    lost = False
+                    first_time = last_time = None
+        finally:
+            self.watcher.close()
+
+    def stop(self):
+        self.stop_event.set()
+        if isinstance(self.watcher, PollingWatcher):
+            self.watcher.close()  # Wakes the thread from its wait between snapshots
+
+
+class WatchSubscription:
+    # One view's share of a FileWatcher: its own queue of batches, and the directories it watches
+    def __init__(self, file_watcher):
+        self.file_watcher = file_watcher
+        self.root = file_watcher.root
+        self.batches = queue.Queue()
+        self.directories = set()
+
+    def watch(self, directory):
+        # Watch directory before listing it, so that nothing changed after the listing goes unreported.
+        # A directory removed and made again needs a new watch, so this is not skipped when known.
+        with self.file_watcher.lock:
+            self.directories.add(directory)
+        self.file_watcher.watch(directory)
+
+    def watch_tree(self, root):
+        # Watch root and the directories under it, returning the files found there
+        found = []
+        for _, files in walk_directories(root, self.watch):
+            found.extend(files)
+        return found
+
+    def poll(self):
+        # The changes of the batches ready so far, merged, without blocking; None if events were lost,
+        # in which case anything under the root may have changed
+        changes = {}
+        while True:
+            try:
+                batch = self.batches.get_nowait()
+            except queue.Empty:
+                return changes
+            if batch is None:
+                changes = None
+            elif changes is not None:
+                for path, kind in batch.items():
+                    merge_event(changes, path, kind)
+
+    def stop(self):
+        release_file_watcher(self)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def watch_root(root):
+    # Subscription to the shared FileWatcher of root, which is started by its first subscription and
+    # stopped with its last one, so views of the same tree share one set of watches
+    root = os.path.abspath(root)
+    with _watchers_lock:
+        file_watcher = _watchers.get(root)
+        if file_watcher is None:
+            file_watcher = _watchers[root] = FileWatcher(root)
+            file_watcher.start()
+        return file_watcher.subscribe()
+
+
+def release_file_watcher(subscription):
+    file_watcher = subscription.file_watcher
+    with _watchers_lock:
+        if file_watcher.unsubscribe(subscription):
+            return
+        if _watchers.get(file_watcher.root) is file_watcher:
+            del _watchers[file_watcher.root]
+    file_watcher.stop()
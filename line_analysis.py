@@ -0,0 +1,189 @@
+import string
+import numpy as np
+
+# Code points that str.strip() removes
+WHITESPACE = [code for code in range(0x3000 + 1) if chr(code).isspace()]
+HIGH_WHITESPACE = [chr(code) for code in WHITESPACE if code > 255]
+
+
+def to_array(buffer):
+    # One array element per character, so array indexes are buffer offsets
+    if buffer.isascii():
+        return np.frombuffer(buffer.encode('ascii'), dtype=np.uint8)
+    if not any(char in buffer for char in HIGH_WHITESPACE):
+        # Past Latin-1 only whitespace matters, so other characters can all become '?'
+        return np.frombuffer(buffer.encode('latin-1', 'replace'), dtype=np.uint8)
+    return np.frombuffer(buffer.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+
+def make_table(codes):
+    # Lookup table over the first 256 code points, with a last entry for everything above
+    table = np.zeros(257, dtype=bool)
+    table[[code for code in codes if code < 256]] = True
+    return table
+
+
+def clamped_cumsum(steps, start=0):
+    # Running total of start and steps that never goes below 0, as a counter whose decrements stop
+    # at 0 keeps it: the total less the lowest it would have gone
+    totals = steps.cumsum() + start
+    return totals - np.minimum(np.minimum.accumulate(totals), 0)
+
+
+WHITESPACE_TABLE = make_table(WHITESPACE)
+PUNCTUATION = [ord(char) for char in string.punctuation]
+PUNCTUATION_TABLE = make_table(PUNCTUATION)
+# Characters that \w matches, up to Latin-1
+WORD_TABLE = make_table([code for code in range(256) if chr(code).isalnum() or chr(code) == '_'])
+
+
+class LineAnalysis:
+    """Per-line columns for a whole buffer, computed with NumPy.
+
+    Lines are the ones iter_line_spans yields: starts and ends are the offsets of each
+    line including its newline, and stripped_starts/stripped_ends are the offsets of
+    line.strip(). indents is the length of the leading whitespace, as in
+    len(line) - len(line.lstrip()). Other columns are built on demand from the offsets
+    of the characters of interest, so counting something on every line of a file costs
+    a few array operations over those characters only.
+    """
+
+    def __init__(self, buffer):
+        self.data = data = to_array(buffer)
+        self.punctuation = None  # Offsets and codes of the ASCII punctuation, built on first use
+        length = len(data)
+        newlines = (data == 10).nonzero()[0]
+        self.ends = np.concatenate((newlines + 1, [length]))
+        self.starts = np.concatenate(([0], newlines + 1))
+        if len(newlines) and newlines[-1] == length - 1 or length == 0:
+            # No line after a final newline, and none in an empty buffer
+            self.starts = self.starts[:-1]
+            self.ends = self.ends[:-1]
+
+        # Offsets of the characters that are not whitespace, ending with length as a sentinel
+        self.code = code = np.concatenate(((~self.lookup(WHITESPACE_TABLE, WHITESPACE)).nonzero()[0], [length]))
+        first = code.searchsorted(self.starts)
+        # Each line ends where the next one starts, and the last one at the sentinel
+        last = np.concatenate((first, [len(code) - 1]))[1:] - 1
+        self.stripped_starts = np.minimum(code[first], self.ends)
+        self.indents = self.stripped_starts - self.starts
+        last_offsets = np.where(last >= 0, code[np.maximum(last, 0)] + 1, 0)
+        self.stripped_ends = np.maximum(last_offsets, self.stripped_starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, table, codes):
+        # Mask of the characters in codes, given make_table(codes)
+        data = self.data
+        if data.dtype == np.uint8:
+            return np.take(table, data)  # Faster than table[data] over a whole buffer
+        mask = np.take(table, np.minimum(data, 256))
+        high = np.flatnonzero(data > 255)
+        mask[high] = np.isin(data[high], [code for code in codes if code > 255])
+        return mask
+
+    def positions(self, chars):
+        # Offsets of the given ASCII punctuation characters
+        if self.punctuation is None:
+            offsets = np.flatnonzero(self.lookup(PUNCTUATION_TABLE, PUNCTUATION))
+            self.punctuation = offsets, self.data[offsets]
+        offsets, codes = self.punctuation
+        return offsets[np.isin(codes, [ord(char) for char in chars])]
+
+    def line_of(self, positions):
+        return self.ends.searchsorted(positions, 'right')
+
+    def count(self, positions):
+        # Number of the given offsets on each line
+        return np.bincount(self.line_of(positions), minlength=len(self))[:len(self)]
+
+    def count_chars(self, chars):
+        return self.count(self.positions(chars))
+
+    def words(self, buffer, names):
+        # Offsets of the whole words, as \b...\b finds them, that are one of names, with the index of each in names
+        data = self.data
+        is_word = WORD_TABLE[data if data.dtype == np.uint8 else np.minimum(data, 256)]
+        if not buffer.isascii():
+            # Characters past Latin-1 can be letters too, so those are looked up one code point at a time
+            codes = np.frombuffer(buffer.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+            high = np.flatnonzero(codes > 255)
+            unique, inverse = np.unique(codes[high], return_inverse=True)
+            is_word[high] = np.array([chr(code).isalnum() for code in unique.tolist()], dtype=bool)[inverse]
+        starts = np.flatnonzero(is_word & ~np.append(False, is_word[:-1]))
+        lengths = np.flatnonzero(is_word & ~np.append(is_word[1:], False)) + 1 - starts
+
+        positions = [np.zeros(0, dtype=np.int64)]
+        indexes = [np.zeros(0, dtype=np.int64)]
+        for index, name in enumerate(names):
+            candidates = starts[lengths == len(name)]
+            candidates = candidates[data[candidates] == ord(name[0])]
+            found = np.all(data[candidates[:, None] + np.arange(len(name))] == [ord(char) for char in name], axis=1)
+            positions.append(candidates[found])
+            indexes.append(np.full(np.count_nonzero(found), index))
+        positions = np.concatenate(positions)
+        order = np.argsort(positions, kind='stable')
+        return positions[order], np.concatenate(indexes)[order]
+
+    def assignments(self, comparisons='!<>'):
+        # Offsets of each '=' that is not part of '==', '!=', '<=' or '>='. As in a left to right
+        # scan, a run of '=' is read in pairs, after one '=' taken by a comparison character before it.
+        data = self.data
+        equals = self.positions('=')
+        if len(equals) == 0:
+            return equals
+        first_in_run = np.append(True, np.diff(equals) != 1)
+        run_starts = np.flatnonzero(first_in_run)
+        run_lengths = np.diff(np.append(run_starts, len(equals)))
+        run_of = np.cumsum(first_in_run) - 1
+        position = np.arange(len(equals)) - run_starts[run_of]
+        length = run_lengths[run_of]
+        first = equals[run_starts][run_of]
+        after_comparison = (first > 0) & np.isin(data[np.maximum(first - 1, 0)], [ord(char) for char in comparisons])
+        paired = np.where(after_comparison,
+                          (position == 0) | (position - 1 < (length - 1) // 2 * 2),
+                          position < length // 2 * 2)
+        return equals[~paired]
+
+    def line_ranges(self, spans):
+        # Mask of the lines holding at least one character of the (start, end) spans
+        count = len(self)
+        first = self.line_of(spans.starts)
+        last = self.line_of(spans.ends - 1)
+        marks = np.bincount(first, minlength=count + 1) - np.bincount(last + 1, minlength=count + 1)
+        return np.cumsum(marks[:count]) > 0
+
+    def code_counts(self, spans):
+        # Number of characters other than whitespace on each line, inside the spans if given
+        code = self.code
+        if spans is None:
+            return np.searchsorted(code, self.ends) - np.searchsorted(code, self.starts)
+        return spans.code_before(code, self.ends) - spans.code_before(code, self.starts)
+
+
+class Spans:
+    """Sorted (start, end) offsets that do not overlap, such as the comments of a buffer."""
+
+    def __init__(self, spans):
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+        self.starts = spans[:, 0]
+        self.ends = spans[:, 1]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, positions, first=True):
+        # Which offsets fall inside a span; with first=False the first character of each span is left out
+        index = self.starts.searchsorted(positions, 'right' if first else 'left') - 1
+        return (index >= 0) & (positions < np.concatenate((self.ends, [0]))[index])
+
+    def code_before(self, code, offsets):
+        # Number of the sorted offsets in code that fall inside a span and before each offset
+        inside = np.searchsorted(code, self.ends) - np.searchsorted(code, self.starts)
+        totals = np.append(0, np.cumsum(inside))
+        index = np.searchsorted(self.starts, offsets, side='right') - 1
+        start = np.append(self.starts, 0)[index]
+        end = np.minimum(offsets, np.append(self.ends, 0)[index])
+        partial = np.searchsorted(code, np.maximum(end, start)) - np.searchsorted(code, start)
+        return np.where(index >= 0, totals[np.maximum(index, 0)] + partial, 0)
@@ -0,0 +1,317 @@
+import os
+import queue
+import re
+import threading
+from collections import namedtuple
+
+from lupa import LuaRuntime
+
+from file_parser import map_batches
+
+# What the Lua-side analyzer found in one source. error is None or (line_number, message), line 0
+# when there is no line to point at. functions and tables are lists of (name, first_line, last_line),
+# name being None for anonymous ones.
+LuaReport = namedtuple('LuaReport', ['error', 'functions', 'tables'])
+
+# Compiles a chunk with load, which never runs it, and lexes it for function definitions and table
+# constructors. Both lists come back as one string each, with a 'name\tfirst\tlast' line per entry,
+# so a whole file crosses into Python in a single call.
+ANALYZER = r'''
+local byte, find, match, sub, concat = string.byte, string.find, string.match, string.sub, table.concat
+local load = loadstring or load
+
+local keywords = {}
+for word in ('and break do else elseif end false for function goto if in local nil not or repeat return then true until while'):gmatch('%a+') do
+    keywords[word] = true
+end
+
+local function count_lines(source, first, last)
+    local lines = 0
+    local newline = find(source, '\n', first, true)
+    while newline and newline <= last do
+        lines = lines + 1
+        newline = find(source, '\n', newline + 1, true)
+    end
+    return lines
+end
+
+local function format(entries)
+    local lines = {}
+    for index, entry in ipairs(entries) do
+        lines[index] = (entry[1] or '') .. '\t' .. entry[2] .. '\t' .. entry[3]
+    end
+    return concat(lines, '\n')
+end
+
+return function(source, locations)
+    -- As luaL_loadfile does, skip a BOM and comment out a first line starting with '#'
+    if sub(source, 1, 3) == '\239\187\191' then
+        source = sub(source, 4)
+    end
+    if byte(source, 1) == 35 then
+        source = '--' .. source
+    end
+    local _, message = load(source, '=lua')
+    if not locations then
+        return message or false, '', ''
+    end
+
+    local functions, tables = {}, {}
+    local blocks, braces = {}, {}  -- Open blocks and braces, each an entry of functions or tables, or false
+    local chain, separator = nil, nil  -- Dotted name being read, such as a.b:c, and a '.' or ':' waiting for its next part
+    local target = nil  -- Name assigned by the last token, an '='
+    local naming = nil  -- Function waiting for its name, between 'function' and '('
+    local line, position, length = 1, 1, #source
+
+    local function add_token(token, is_name)
+        local assigned = target
+        target = nil
+        if is_name and not keywords[token] then
+            chain = (chain and separator) and chain .. separator .. token or token
+            separator = nil
+            return
+        end
+        if (token == '.' or token == ':') and chain and not separator then
+            separator = token
+            return
+        end
+
+        if token == '(' and naming then
+            if chain then
+                naming[1] = chain
+            end
+        elseif token == '=' and not separator then
+            target = chain
+        elseif token == 'function' then
+            local entry = {assigned or false, line, false}
+            functions[#functions + 1] = entry
+            blocks[#blocks + 1] = entry
+            naming = entry
+        elseif token == 'if' or token == 'do' or token == 'repeat' then
+            blocks[#blocks + 1] = false
+        elseif token == 'end' or token == 'until' then
+            local entry = table.remove(blocks)
+            if entry then
+                entry[3] = line
+            end
+        elseif token == '{' then
+            local entry = {assigned or false, line, false}
+            tables[#tables + 1] = entry
+            braces[#braces + 1] = entry
+        elseif token == '}' then
+            local entry = table.remove(braces)
+            if entry then
+                entry[3] = line
+            end
+        end
+        if token ~= 'function' then
+            naming = nil
+        end
+        chain, separator = nil, nil
+    end
+
+    while position <= length do
+        local char = byte(source, position)
+        local _, last = find(source, '^[ \t\r\f\v]+', position)
+        if last then
+            position = last + 1
+        elseif char == 10 then
+            line = line + 1
+            position = position + 1
+        elseif char == 95 or (char >= 65 and char <= 90) or (char >= 97 and char <= 122) then
+            _, last = find(source, '^[%w_]*', position + 1)
+            add_token(sub(source, position, last), true)
+            position = last + 1
+        elseif (char >= 48 and char <= 57) or (char == 46 and find(source, '^%d', position + 1)) then
+            _, last = find(source, '^[%w_.]*', position + 1)
+            add_token('0')
+            position = last + 1
+        elseif char == 45 and byte(source, position + 1) == 45 then
+            -- Comments change nothing, so no token is added for them
+            local equals = match(source, '^%[(=*)%[', position + 2)
+            if equals then
+                _, last = find(source, ']' .. equals .. ']', position, true)
+                last = last or length
+                line = line + count_lines(source, position, last)
+                position = last + 1
+            else
+                position = find(source, '\n', position, true) or length + 1
+            end
+        elseif char == 91 and match(source, '^%[=*%[', position) then
+            local equals = match(source, '^%[(=*)%[', position)
+            _, last = find(source, ']' .. equals .. ']', position, true)
+            last = last or length
+            line = line + count_lines(source, position, last)
+            position = last + 1
+            add_token('""')
+        elseif char == 34 or char == 39 then
+            local stops = char == 34 and '["\\\n]' or "['\\\n]"
+            position = position + 1
+            while true do
+                local stop = find(source, stops, position)
+                if not stop then
+                    position = length + 1
+                    break
+                end
+                local stopped = byte(source, stop)
+                if stopped == 92 then
+                    -- An escaped newline, or \z and the whitespace after it, stays in the string
+                    local escaped = byte(source, stop + 1)
+                    _, last = find(source, escaped == 122 and '^z%s*' or escaped == 13 and '^\r\n?' or '^.', stop + 1)
+                    last = last or stop
+                    line = line + count_lines(source, stop + 1, last)
+                    position = last + 1
+                elseif stopped == 10 then
+                    -- Unterminated, so the string ends with its line
+                    position = stop
+                    break
+                else
+                    position = stop + 1
+                    break
+                end
+            end
+            add_token('""')
+        elseif char == 61 or char == 126 or char == 60 or char == 62 then
+            -- '=' on its own, or one of '==', '~=', '<=', '>=', '<<' and '>>'
+            _, last = find(source, '^[=<>]', position + 1)
+            last = last or position
+            add_token(sub(source, position, last))
+            position = last + 1
+        elseif char == 46 or char == 58 then
+            -- '.' and ':', or '..', '...' and '::' as one token
+            _, last = find(source, char == 46 and '^%.+' or '^:+', position)
+            add_token(sub(source, position, last))
+            position = last + 1
+        else
+            add_token(sub(source, position, position))
+            position = position + 1
+        end
+    end
+
+    -- Blocks left open by a syntax error end on the last line
+    for _, entry in ipairs(functions) do
+        entry[3] = entry[3] or line
+    end
+    for _, entry in ipairs(tables) do
+        entry[3] = entry[3] or line
+    end
+    return message or false, format(functions), format(tables)
+end
+'''
+
+
+def parse_error(message):
+    if not message:
+        return None
+    match = re.match(r'lua:(\d+): ', message)
+    if match is None:
+        return 0, message
+    return int(match.group(1)), message[match.end():]
+
+
+def parse_locations(text):
+    locations = []
+    for line in text.split('\n') if text else ():
+        name, first_line, last_line = line.split('\t')
+        locations.append((name or None, int(first_line), int(last_line)))
+    return locations
+
+
+class LuaRuntimePool:
+    """Warm LuaRuntime instances for checking and analyzing Lua sources.
+
+    Starting a runtime and compiling ANALYZER into it costs more than checking a typical
+    mod script, so runtimes are created on first demand, up to size, and go back to the
+    pool after each call instead of being dropped. Each runtime serves one thread at a
+    time; lupa releases the GIL while Lua runs, so threads sharing a pool run in parallel.
+    Sources are only compiled, never run.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or os.cpu_count() or 1
+        self.idle = queue.LifoQueue()  # Most recently used first, so a few runtimes stay hot
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def new_analyzer(self):
+        runtime = LuaRuntime(register_eval=False, register_builtins=False)
+        return runtime.execute(ANALYZER)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if not create:
+            return self.idle.get()
+        try:
+            return self.new_analyzer()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def release(self, analyzer):
+        self.idle.put(analyzer)
+
+    def analyze(self, source, locations=True):
+        # source is str or bytes; with locations=False only the syntax is checked
+        analyzer = self.acquire()
+        try:
+            message, functions, tables = analyzer(source, locations)
+        finally:
+            self.release(analyzer)
+        return LuaReport(parse_error(message), parse_locations(functions), parse_locations(tables))
+
+    def check(self, source):
+        # None, or (line_number, message) for the first syntax error
+        return self.analyze(source, locations=False).error
+
+    def analyze_file(self, file_path, locations=True):
+        with open(file_path, 'rb') as file:
+            return self.analyze(file.read(), locations)
+
+
+def analyze_many(paths, workers=None, cancel_event=None, batch_bytes=1 << 20, locations=True):
+    # Analyze Lua files in a process pool and yield (file_path, LuaReport) as each batch completes.
+    # Set cancel_event (a threading.Event) or close the generator to stop early.
+    batches = map_batches(analyze_batch, paths, (locations,), workers, cancel_event, batch_bytes)
+    try:
+        for batch, future in batches:
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Error analyzing Lua files: {e}")
+                results = [(file_path, LuaReport((0, str(e)), [], [])) for file_path in batch]
+
+            for file_path, report in results:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                yield file_path, report
+    finally:
+        batches.close()
+
+
+_worker_pool = None
+
+
+def analyze_batch(paths, locations=True):
+    # Runs inside a pool process, which keeps its runtime warm for all of its batches
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = LuaRuntimePool(size=1)
+    pool = _worker_pool
+
+    results = []
+    for file_path in paths:
+        try:
+            report = pool.analyze_file(file_path, locations)
+        except Exception as e:
+            print(f"Error analyzing {file_path}: {e}")
+            report = LuaReport((0, str(e)), [], [])
+        results.append((file_path, report))
+    return results
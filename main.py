@@ -7,6 +7,7 @@ from core_editor import CoreEditor
 from file_parser import ParserManager, LuaFileParser, FileParser, CParser,CPlusPlusParser, PythonFileParser,FileParser
 import os
 from file_types_module import file_types
+from directory_scanner import get_directory_index
 import atexit
 
 class FileTypeExplorer(tk.Toplevel):
@@ -29,12 +30,7 @@ class FileTypeExplorer(tk.Toplevel):
         self.pack(fill='both', expand=True)  # Share layout horizontally
 
     def get_file_types(self, directory):
-        file_types = set()
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                file_extension = os.path.splitext(file)[1]
-                file_types.add(file_extension)
-        return list(file_types)
+        return get_directory_index(directory).extensions()
 
     def confirm(self):
         selected_file_types = [checkbox.cget('text') for checkbox in self.checkboxes if checkbox.var.get()]
@@ -59,13 +55,7 @@ class MainApplication(tk.Tk):
         atexit.register(self.core_editor.release_all_locks)
         
     def get_files_from_directory(self, directory, file_types):
-        selected_files = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                file_extension = os.path.splitext(file)[1]
-                if file_extension in file_types:
-                    selected_files.append(os.path.join(root, file))
-        return selected_files
+        return [entry.path for entry in get_directory_index(directory).files_with_extensions(file_types)]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from source_encoding import decode_source, detect_encoding, get_bom, get_newline, get_write_encoding, is_ascii_compatible
+
+SCAN_BYTES = 1 << 24  # Bytes searched for newlines at a time
+CACHE_FILES = 64  # Files kept by get_mapped_lines
+
+
+def get_fingerprint(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def find_newlines(data):
+    # Offsets of the b'\n' bytes of data, searched a chunk at a time so the temporary arrays stay small
+    length = len(data)
+    chunks = [np.zeros(0, dtype=np.int64)]
+    for start in range(0, length, SCAN_BYTES):
+        count = min(SCAN_BYTES, length - start)
+        chunks.append(np.flatnonzero(np.frombuffer(data, dtype=np.uint8, count=count, offset=start) == 10) + start)
+    return np.concatenate(chunks)
+
+
+class MappedLines:
+    """Read-only sequence of the lines of a file, over one copy of its bytes.
+
+    The bytes are read once and never mapped: another program truncating a mapped file
+    makes the next read of the lost pages raise SIGBUS, which no check beforehand can rule
+    out. Only the offsets of the line starts are computed up front, as one int64 per line;
+    a line is decoded when it is read, so reading lines 500000 to 500100 of a large file
+    decodes those lines and nothing else. Lines are decoded in the encoding that
+    detect_encoding finds, without the BOM and with '\r\n' endings turned into '\n';
+    encoding and newline are what write them back to the same bytes, after bom, the text
+    to write first for BOMs the encoding does not write itself. UTF-16 and UTF-32 files,
+    whose newlines are not single bytes, are decoded whole instead, as are the rare files
+    with '\r' line endings only. fingerprint is the size and mtime of the file when it was
+    read.
+    """
+
+    def __init__(self, file_path):
+        self.closed = False
+        with open(file_path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.fingerprint = get_fingerprint(stat)
+            self.data = file.read()
+
+        self.encoding = detect_encoding(self.data)
+        self.bom = ''
+        self.decoded = None  # All the lines, for files that are not read line by line
+        newlines = find_newlines(self.data)
+        # Besides UTF-16 and UTF-32, files with old Mac '\r' line endings only are decoded whole
+        if not is_ascii_compatible(self.encoding) or len(newlines) == 0 and b'\r' in self.data[:SCAN_BYTES]:
+            text, encoding = decode_source(self.data, translate=False)
+            self.encoding, self.bom = get_write_encoding(self.data, encoding)
+            self.newline = get_newline(text)
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            # Split at '\n' only, as the other lines are, so form feeds and the like stay in their line
+            lines = text.split('\n')
+            self.decoded = [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+            return
+
+        bom, _ = get_bom(self.data)
+        self.line_encoding = 'utf-8' if self.encoding == 'utf-8-sig' else self.encoding  # The BOM is skipped instead
+        length = len(self.data)
+        self.starts = np.insert(newlines + 1, 0, len(bom))
+        if len(newlines) and newlines[-1] == length - 1 or length == len(bom):
+            self.starts = self.starts[:-1]
+        self.starts = np.append(self.starts, length)  # The end of the last line as a sentinel
+        # Line ending of the file, after its first line
+        self.newline = '\r\n' if len(newlines) and newlines[0] > 0 and self.data[newlines[0] - 1] == 13 else '\n'
+
+    def __len__(self):
+        if self.decoded is not None:
+            return len(self.decoded)
+        return len(self.starts) - 1
+
+    def __getitem__(self, index):
+        if self.decoded is not None:
+            return self.decoded[index]
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            # Decode the whole run at once and split it again
+            parts = self.decode(int(self.starts[start]), int(self.starts[stop])).split('\n')
+            lines = [part + '\n' for part in parts[:-1]]
+            if parts[-1]:
+                lines.append(parts[-1])
+            return lines
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('line index out of range')
+        return self.decode(int(self.starts[index]), int(self.starts[index + 1]))
+
+    def view(self, first, last):
+        # The raw bytes of lines first to last - 1 as a memoryview, without copying
+        if self.decoded is not None:
+            raise ValueError(f"{self.encoding} lines are not views of the file")
+        return memoryview(self.data)[int(self.starts[first]):int(self.starts[last])]
+
+    def decode(self, start, end):
+        return self.data[start:end].decode(self.line_encoding, 'replace').replace('\r\n', '\n')
+
+    def is_current(self, file_path):
+        # Whether the lines are not closed and the file still has the size and mtime it had when read
+        if self.closed:
+            return False
+        try:
+            return get_fingerprint(os.stat(file_path)) == self.fingerprint
+        except OSError:
+            return False
+
+    def close(self):
+        # Marks the lines as out of date, so get_mapped_lines and FileChange.refresh read the file again.
+        # Whoever still holds them can go on reading them.
+        self.closed = True
+
+
+_cache = OrderedDict()  # MappedLines by absolute path, least recently used first
+_cache_lock = threading.Lock()
+
+
+def get_mapped_lines(file_path):
+    # The MappedLines of file_path, shared by all callers while the file keeps its size and mtime
+    key = os.path.abspath(file_path)
+    with _cache_lock:
+        mapped = _cache.get(key)
+        if mapped is not None and mapped.is_current(file_path):
+            _cache.move_to_end(key)
+            return mapped
+
+    mapped = MappedLines(file_path)
+    with _cache_lock:
+        _cache[key] = mapped
+        _cache.move_to_end(key)
+        # Evicted lines are freed once nothing uses them any more
+        while len(_cache) > CACHE_FILES:
+            _cache.popitem(last=False)
+    return mapped
+
+
+def forget_mapped_lines(file_path):
+    # Drop the shared lines of a file that changed or was removed, so its old content is not kept
+    with _cache_lock:
+        _cache.pop(os.path.abspath(file_path), None)
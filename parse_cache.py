@@ -0,0 +1,161 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+def default_cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'code_view')
+
+
+def hash_file(file_path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """On-disk cache of ParseResult objects.
+
+    Entries are content addressed: the key is the hash of the file content plus the
+    parser class, its version and the extension it reports. A small index remembers the
+    size, mtime and hash last seen for each path, so an unchanged file costs one stat.
+    Entries are evicted least recently used first once max_bytes is exceeded.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.max_bytes = max_bytes
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, nbytes INTEGER, last_used REAL)')
+        self.connection.commit()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key + '.pickle')
+
+    def get_digest(self, file_path, stat):
+        row = self.connection.execute('SELECT size, mtime_ns, digest FROM files WHERE path = ?', (file_path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = hash_file(file_path)
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                (file_path, stat.st_size, stat.st_mtime_ns, digest))
+        self.connection.commit()
+        return digest
+
+    def make_key(self, digest, parser, file_path):
+        return hashlib.blake2b(f"{digest}:{parser.cache_id(file_path)}".encode(), digest_size=20).hexdigest()
+
+    def lookup(self, file_path, parser):
+        # Return (key, result). result is None on a miss; pass the key to store() once parsed.
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None, None
+
+        with self.lock:
+            key = self.make_key(self.get_digest(file_path, stat), parser, file_path)
+            row = self.connection.execute('SELECT nbytes FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return key, None
+
+            try:
+                with open(self.get_entry_path(key), 'rb') as file:
+                    result = pickle.load(file)
+            except Exception as e:
+                print(f"Error reading cache entry for {file_path}: {e}")
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.connection.commit()
+                return key, None
+
+            self.connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+
+        # The same content may have been cached under another path
+        result.files = [(file_path, extension, buffer) for _, extension, buffer in result.files]
+        return key, result
+
+    def store(self, file_path, key, result):
+        if key is None:
+            return
+        with self.lock:
+            # Skip the store if the file changed while it was being parsed
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return
+            row = self.connection.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (file_path,)).fetchone()
+            if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+                return
+
+            entry_path = self.get_entry_path(key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            temp_path = f"{entry_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, entry_path)
+
+            self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                    (key, os.path.getsize(entry_path), time.time()))
+            self.connection.commit()
+            self.evict()
+
+    def evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, nbytes in self.connection.execute('SELECT key, nbytes FROM entries ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= nbytes
+
+        for key in evicted:
+            try:
+                os.remove(self.get_entry_path(key))
+            except OSError:
+                pass
+        self.connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in evicted])
+        self.connection.commit()
+
+    def invalidate(self, file_path):
+        self.invalidate_many([file_path])
+
+    def invalidate_many(self, file_paths):
+        # Forget the fingerprints of paths in one transaction; their content-addressed entries are left to the LRU
+        with self.lock:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [(file_path,) for file_path in file_paths])
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            for key, in self.connection.execute('SELECT key FROM entries').fetchall():
+                try:
+                    os.remove(self.get_entry_path(key))
+                except OSError:
+                    pass
+            self.connection.execute('DELETE FROM entries')
+            self.connection.execute('DELETE FROM files')
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,112 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from file_parser import ParseCancelled
+
+
+class ParseWorker:
+    """Parses files off the Tk thread.
+
+    Each submit() starts a new generation of jobs and cancels the one before it, so
+    only the latest selection is parsed. Results are put on a queue that the Tk loop
+    drains with poll() from an after() callback.
+    """
+
+    def __init__(self, parser_manager, workers=1):
+        self.parser_manager = parser_manager
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.generation = 0
+        self.cancel_event = None
+        self.future = None
+
+    def submit(self, jobs):
+        # jobs is a list of (file_path, mode) pairs, mode being 'parse' or 'variables'
+        self.cancel()
+        self.generation += 1
+        self.cancel_event = threading.Event()
+        self.future = self.executor.submit(self.run, self.generation, self.cancel_event, jobs)
+
+    def cancel(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def run(self, generation, cancel_event, jobs):
+        for file_path, mode in jobs:
+            if cancel_event.is_set():
+                return
+            try:
+                if mode == 'variables':
+                    parser = self.parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+                    result = parser.get_variables(file_path)
+                else:
+                    result = self.parser_manager.parse(file_path, cancel_event)
+            except ParseCancelled:
+                return
+            except Exception as e:
+                print(f"Error parsing {file_path}: {e}")
+                continue
+            self.results.put((generation, file_path, mode, result))
+
+    def is_busy(self):
+        return (self.future is not None and not self.future.done()) or not self.results.empty()
+
+    def poll(self):
+        # Results of the current generation that are ready, without blocking
+        ready = []
+        while True:
+            try:
+                generation, file_path, mode, result = self.results.get_nowait()
+            except queue.Empty:
+                return ready
+            if generation == self.generation:
+                ready.append((file_path, mode, result))
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TreeIndexer:
+    """Fills the symbol index with the files of a tree off the Tk thread.
+
+    Each index() or update() call is queued on one thread and parsed with ParserManager.parse_many,
+    which reads the files in a process pool. Files indexed since their last save are skipped, so
+    a tree that was indexed before only costs a stat per file. Until a file is done, the index
+    does not know it; SymbolIndex.is_current tells which files those are.
+    """
+
+    def __init__(self, parser_manager, workers=None):
+        self.parser_manager = parser_manager
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=1)  # Calls are handled one at a time, in order
+        self.cancel_event = threading.Event()
+
+    def index(self, file_paths):
+        self.update(file_paths, [])
+
+    def update(self, file_paths, removed):
+        # Index file_paths again and forget the removed files, whose removals share one transaction
+        self.executor.submit(self.run, list(file_paths), list(removed))
+
+    def run(self, file_paths, removed):
+        try:
+            if removed:
+                self.parser_manager.invalidate_many(removed)
+            symbol_index = self.parser_manager.symbol_index
+            if symbol_index is None:
+                return
+            stale = [file_path for file_path in file_paths
+                     if os.path.isfile(file_path) and not symbol_index.is_current(file_path)]
+            for _ in self.parser_manager.parse_many(stale, self.workers, self.cancel_event):
+                pass
+        except Exception as e:
+            print(f"Error indexing files: {e}")
+
+    def shutdown(self):
+        self.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+import random
+
+
+class Piece:
+    # A run of count consecutive lines of buffer from start, as a node of the piece tree. lines is
+    # the number of lines in the subtree, and priority keeps the tree balanced, as in a treap.
+    __slots__ = ('buffer', 'start', 'count', 'lines', 'priority', 'left', 'right')
+
+    def __init__(self, buffer, start, count, priority=None):
+        self.buffer = buffer
+        self.start = start
+        self.count = count
+        self.lines = count
+        self.priority = random.random() if priority is None else priority
+        self.left = None
+        self.right = None
+
+    def update(self):
+        self.lines = self.count + (self.left.lines if self.left else 0) + (self.right.lines if self.right else 0)
+
+
+def split(piece, count):
+    # Split the tree into the first count lines and the rest, cutting a piece in two if needed
+    if piece is None:
+        return None, None
+    left_lines = piece.left.lines if piece.left else 0
+    if count <= left_lines:
+        first, rest = split(piece.left, count)
+        piece.left = rest
+        piece.update()
+        return first, piece
+    if count >= left_lines + piece.count:
+        first, rest = split(piece.right, count - left_lines - piece.count)
+        piece.right = first
+        piece.update()
+        return piece, rest
+
+    # The cut falls inside this piece; its tail keeps its priority, which is above any in its right subtree
+    offset = count - left_lines
+    tail = Piece(piece.buffer, piece.start + offset, piece.count - offset, piece.priority)
+    tail.right = piece.right
+    tail.update()
+    piece.count = offset
+    piece.right = None
+    piece.update()
+    return piece, tail
+
+
+def merge(first, rest):
+    # Join two trees, all lines of first coming before those of rest
+    if first is None:
+        return rest
+    if rest is None:
+        return first
+    if first.priority > rest.priority:
+        first.right = merge(first.right, rest)
+        first.update()
+        return first
+    rest.left = merge(first, rest.left)
+    rest.update()
+    return rest
+
+
+class PieceTable:
+    """Line-based piece table holding a file's content with its pending edits.
+
+    The original lines are never modified and new lines are only appended to an add buffer;
+    the document is the sequence of pieces, runs of lines from either buffer, kept in a
+    balanced tree by line count. Inserting, deleting, replacing and looking up a line are
+    O(log n) in the number of pieces, however many edits were made, and the document is
+    read back in order in time linear in its length.
+    """
+
+    def __init__(self, lines):
+        # lines is any sequence of lines that supports slicing, such as a list or MappedLines; it is not copied
+        self.original = lines
+        self.added = []
+        self.root = Piece(self.original, 0, len(self.original)) if self.original else None
+
+    def __len__(self):
+        return self.root.lines if self.root else 0
+
+    def __iter__(self):
+        # Lines in order, walking the tree without recursion
+        stack = []
+        piece = self.root
+        while stack or piece is not None:
+            if piece is not None:
+                stack.append(piece)
+                piece = piece.left
+                continue
+            piece = stack.pop()
+            # A slice at a time, so a long run of lines is never copied out whole
+            end = piece.start + piece.count
+            for start in range(piece.start, end, 4096):
+                yield from piece.buffer[start:min(start + 4096, end)]
+            piece = piece.right
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('line index out of range')
+        piece = self.root
+        while True:
+            left_lines = piece.left.lines if piece.left else 0
+            if index < left_lines:
+                piece = piece.left
+            elif index < left_lines + piece.count:
+                return piece.buffer[piece.start + index - left_lines]
+            else:
+                index -= left_lines + piece.count
+                piece = piece.right
+
+    def get(self, index, default=None):
+        # As dict.get, so a PieceTable can stand in for a line index to line mapping
+        if 0 <= index < len(self):
+            return self[index]
+        return default
+
+    def insert(self, index, lines):
+        # Insert lines before line index; index len(self) appends
+        lines = list(lines)
+        if not lines:
+            return
+        piece = Piece(self.added, len(self.added), len(lines))
+        self.added.extend(lines)
+        first, rest = split(self.root, index)
+        self.root = merge(merge(first, piece), rest)
+
+    def delete(self, index, count=1):
+        first, rest = split(self.root, index)
+        _, rest = split(rest, count)
+        self.root = merge(first, rest)
+
+    def replace(self, index, line):
+        self.delete(index)
+        self.insert(index, [line])
+
+    def lines(self):
+        return list(self)
+
+    def text(self):
+        return ''.join(self)
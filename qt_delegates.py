@@ -7,11 +7,25 @@ import tempfile
 from PIL import Image, ImageTk
 import ctypes
 import json
+import queue
+import threading
+from directory_scanner import get_directory_index
+from fs_watcher import watch_root
 class FileTree(ttk.Treeview):
-    def __init__(self, parent=None, directory=None, file_types=None):
+    watch_interval = 250  # Milliseconds between checks for files changed on disk
+    prefetch_limit = 256  # Directories waiting to be prefetched at most; the rest are listed when opened
+
+    def __init__(self, parent=None, directory=None, file_types=None, prefetch=True):
         super().__init__(parent)
-        self.directory = directory
+        self.directory = os.path.abspath(directory)  # As the shared watcher of the root reports its paths
         self.file_types = file_types
+        self.prefetch = prefetch
+        self.listings = {}  # Directory listings prefetched in the background, by path; Tk thread only
+        self.versions = {}  # Times each directory changed on disk, to drop listings made before a change
+        self.prefetch_queue = None  # (directory, version) for the prefetch worker, then None to stop it
+        self.prefetched = None  # (directory, version, listing) back from the prefetch worker
+        self.watcher = None  # Subscription to the FileWatcher of the root, watching the listed directories
+        self.watch_after_id = None
         self['show'] = 'tree'
         self.tag_configure('enabled', font=('Arial', 10, 'bold italic'))
         self.bind('<Double-1>', self.on_double_click)
@@ -27,9 +41,11 @@ class FileTree(ttk.Treeview):
 
         self.populate_tree(self.directory)
 
-    def populate_tree(self, node, parent=''):
+    def populate_tree(self, node, parent='', is_dir=None):
         node_id = hashlib.md5(node.encode()).hexdigest()  # Use the hash of the node as the item ID
-        if os.path.isdir(node):
+        if is_dir is None:
+            is_dir = os.path.isdir(node)
+        if is_dir:
             text = f"(F) {os.path.basename(node)}"
         elif node.endswith('.py'):
             text = f"(Python) {os.path.basename(node)}"
@@ -42,15 +58,156 @@ class FileTree(ttk.Treeview):
         if not self.exists(node_id):
 
             self.insert(parent, 'end', node_id, text=text, open=False, values=[node, False])
-            if os.path.isdir(node):
-                for entry in sorted(os.scandir(node), key=lambda e: (not e.is_dir(), e.name)):
-                    self.populate_tree(entry.path, node_id)
+            if is_dir:
+                # Directories are listed when they are first opened
+                self.insert(node_id, 'end', node_id + ':placeholder', text='...')
         else:
             self.item(node_id, text=text)
 
         if parent == '':
+            self.watch(node)  # Before the root is listed, which watches each directory it lists
+            self.expand_node(node_id)
             self.item(node_id, open=True)
 
+    def set_root(self, directory):
+        # Show directory instead of the current root, rather than next to it
+        self.stop_prefetch()
+        self.delete(*self.get_children())
+        self.listings.clear()
+        self.versions.clear()
+        self.directory = os.path.abspath(directory)
+        if self.watcher is not None:
+            self.watcher.stop()  # Its directories are watched again as they are listed
+            self.watcher = None
+        self.populate_tree(self.directory)
+
+    def watch(self, directory):
+        if self.watcher is not None and self.watcher.root == directory:
+            return
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = watch_root(directory)  # Shared with any other view of the same tree
+        if self.watch_after_id is None:
+            self.watch_after_id = self.after(self.watch_interval, self.poll_file_system)
+
+    def poll_file_system(self):
+        self.watch_after_id = None
+        self.take_prefetched()
+        changes = self.watcher.poll()
+        if changes is None:
+            # Events were dropped; list the root again, and the rest as it is opened
+            self.set_root(self.directory)
+        elif changes:
+            self.apply_changes(changes)
+        self.watch_after_id = self.after(self.watch_interval, self.poll_file_system)
+
+    def apply_changes(self, changes):
+        # Patch the listed directories for the paths added or removed on disk. Directories not listed
+        # yet are listed as they are when opened, so only their prefetched listings are dropped.
+        root_prefix = os.path.join(self.watcher.root, '')
+        for path, kind in changes.items():
+            node = path
+            if kind == 'removed':
+                # Up to the topmost directory that is gone too, as polling reports files only
+                while os.path.dirname(node).startswith(root_prefix) and not os.path.exists(os.path.dirname(node)):
+                    node = os.path.dirname(node)
+                self.forget_listing(os.path.dirname(node))
+                node_id = hashlib.md5(node.encode()).hexdigest()
+                if self.exists(node_id):
+                    self.delete(node_id)
+            elif kind == 'added':
+                # A file in a new directory shows as the topmost directory that is not in the tree yet
+                while os.path.dirname(node).startswith(root_prefix) and \
+                        not self.exists(hashlib.md5(os.path.dirname(node).encode()).hexdigest()):
+                    node = os.path.dirname(node)
+                parent = os.path.dirname(node)
+                self.forget_listing(parent)
+                parent_id = hashlib.md5(parent.encode()).hexdigest()
+                if self.exists(parent_id) and not self.exists(parent_id + ':placeholder') and os.path.lexists(node):
+                    self.populate_tree(node, parent_id)
+
+    def forget_listing(self, directory):
+        # Drop the prefetched listing of a directory that changed, and any still being made
+        self.listings.pop(directory, None)
+        self.versions[directory] = self.versions.get(directory, 0) + 1
+
+    def destroy(self):
+        self.stop_prefetch()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.watch_after_id is not None:
+            self.after_cancel(self.watch_after_id)
+        super().destroy()
+
+    def expand_node(self, node_id):
+        placeholder_id = node_id + ':placeholder'
+        if not self.exists(placeholder_id):
+            return  # Already listed
+        self.delete(placeholder_id)
+
+        node = self.item(node_id, 'values')[0]
+        self.take_prefetched()
+        listing = self.listings.pop(node, None)
+        if listing is None:
+            if self.watcher is not None:
+                self.watcher.watch(node)  # Before listing it, so later changes are reported
+            listing = list_directory(node)
+        for path, is_dir in listing:
+            self.populate_tree(path, node_id, is_dir)
+
+        if self.prefetch:
+            for path, is_dir in listing:
+                if is_dir:
+                    self.queue_prefetch(path)
+
+    def queue_prefetch(self, directory):
+        if directory in self.listings:
+            return
+        if self.prefetch_queue is None:
+            self.prefetch_queue = queue.Queue(self.prefetch_limit)
+            self.prefetched = queue.Queue()
+            threading.Thread(target=self.prefetch_worker, args=(self.prefetch_queue, self.prefetched),
+                             daemon=True).start()
+        if self.prefetch_queue.full():
+            return  # Listed when opened instead
+        if self.watcher is not None:
+            self.watcher.watch(directory)  # Before the worker lists it, so later changes are reported
+        self.prefetch_queue.put((directory, self.versions.get(directory, 0)))
+
+    def prefetch_worker(self, requests, results):
+        # Lists the next level in the background and hands the listings back through results; never
+        # touches Tk or self.listings, and ends at the None that stop_prefetch() queues
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            directory, version = request
+            results.put((directory, version, list_directory(directory)))
+
+    def take_prefetched(self):
+        # Keep the listings the worker has made, unless their directory changed since they were queued
+        if self.prefetched is None:
+            return
+        while True:
+            try:
+                directory, version, listing = self.prefetched.get_nowait()
+            except queue.Empty:
+                return
+            if self.versions.get(directory, 0) == version:
+                self.listings[directory] = listing
+
+    def stop_prefetch(self):
+        # Drop the directories still waiting and end the worker after the one it is listing, if any
+        if self.prefetch_queue is None:
+            return
+        while True:
+            try:
+                self.prefetch_queue.get_nowait()
+            except queue.Empty:
+                break
+        self.prefetch_queue.put(None)
+        self.prefetch_queue = self.prefetched = None
+
     def show_context_menu(self, event):
         self.context_menu.post(event.x_root, event.y_root)
 
@@ -70,8 +227,8 @@ class FileTree(ttk.Treeview):
 
         
     def on_open(self, event):
-        item = self.selection()[0]
-        self.populate_tree(self.item(item)['values'][0], item)
+        item = self.focus()  # The item being opened, which is not necessarily selected
+        self.expand_node(item)
 
     def on_close(self, event):
         pass  # Do nothing when a node is closed
@@ -91,20 +248,148 @@ class FileTree(ttk.Treeview):
 
 
     def get_total_size(self, directory):
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
+        total_size = get_directory_index(directory).total_size(include_symlinks=False)
         total_size /= 1024 * 1024  # Convert to MB
         if total_size < 1024:
             return f"{total_size:.2f} MB"
         else:
             return f"{total_size / 1024:.2f} GB"
+
+
+def list_directory(directory):
+    # (path, is_dir) for each entry, directories first, as shown in the tree
+    try:
+        with os.scandir(directory) as entries:
+            listing = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                listing.append((entry.path, is_dir, entry.name))
+    except OSError as e:
+        print(f"Error listing {directory}: {e}")
+        return []
+    listing.sort(key=lambda item: (not item[1], item[2]))
+    return [(path, is_dir) for path, is_dir, _ in listing]
         
 
 
+class VirtualTable(ttk.Treeview):
+    """Treeview that shows a ParseResult without creating an item per row.
+
+    Only the rows that fit in the viewport, plus a margin, exist as Tk items. Scrolling
+    moves the window over the model and rewrites the values of those same items.
+    """
+
+    def __init__(self, parent=None, columns=(), margin=10, **kwargs):
+        super().__init__(parent, columns=columns, **kwargs)
+        self.model = None
+        self.overrides = None  # Literal lines that replace the model's, by 0-based line index
+        self.first_row = 0
+        self.margin = margin
+        self.row_items = []  # Item ids, reused for whichever rows are in view
+
+        self.scrollbar = ttk.Scrollbar(parent, orient='vertical', command=self.on_scrollbar)
+        self.bind('<Configure>', lambda event: self.refresh())
+        # Each handler returns 'break', so the Treeview class bindings do not also scroll the items
+        self.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.bind('<Button-4>', lambda event: self.on_scroll_event(-3))
+        self.bind('<Button-5>', lambda event: self.on_scroll_event(3))
+        self.bind('<Prior>', lambda event: self.on_scroll_event(-self.get_visible_rows()))
+        self.bind('<Next>', lambda event: self.on_scroll_event(self.get_visible_rows()))
+        self.bind('<Up>', lambda event: self.move_focus(-1))
+        self.bind('<Down>', lambda event: self.move_focus(1))
+
+    def set_model(self, model, overrides=None):
+        self.model = model
+        self.overrides = overrides
+        self.first_row = 0
+        self.refresh()
+
+    def clear(self):
+        self.set_model(None)
+
+    def get_row_count(self):
+        return len(self.model) if self.model is not None else 0
+
+    def get_visible_rows(self):
+        row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        heading_height = row_height if 'headings' in str(self['show']) else 0
+        return max(1, (self.winfo_height() - heading_height) // row_height)
+
+    def get_values(self, index):
+        file_name, extension, line_type, literal_line = self.model.row(index)
+        if self.overrides is not None:
+            literal_line = self.overrides.get(self.model.line_numbers[index] - 1, literal_line)
+        return (file_name, extension, line_type, literal_line)
+
+    def get_row_index(self, item):
+        # Model row currently shown by a table item
+        return self.first_row + self.row_items.index(item)
+
+    def refresh(self):
+        visible_rows = self.get_visible_rows()
+        row_count = self.get_row_count()
+        self.first_row = max(0, min(self.first_row, row_count - visible_rows))
+        item_count = min(visible_rows + self.margin, row_count - self.first_row)
+
+        while len(self.row_items) < item_count:
+            self.row_items.append(self.insert('', 'end'))
+        if len(self.row_items) > item_count:
+            self.delete(*self.row_items[item_count:])
+            del self.row_items[item_count:]
+
+        for offset, item in enumerate(self.row_items):
+            self.item(item, values=self.get_values(self.first_row + offset))
+
+        if row_count:
+            self.scrollbar.set(self.first_row / row_count, min(1.0, (self.first_row + visible_rows) / row_count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_rows(self, count):
+        first_row = self.first_row
+        self.first_row = max(0, self.first_row + count)
+        self.refresh()
+        if self.first_row != first_row:
+            # Items now show other rows, so the selection would point at the wrong ones
+            self.selection_remove(self.selection())
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_rows(int(float(amount) * self.get_row_count()) - self.first_row)
+        elif unit == 'pages':
+            self.scroll_rows(int(amount) * self.get_visible_rows())
+        else:
+            self.scroll_rows(int(amount))
+
+    def on_scroll_event(self, count):
+        self.scroll_rows(count)
+        return 'break'
+
+    def on_mouse_wheel(self, event):
+        return self.on_scroll_event(-3 * int(event.delta / 120))
+
+    def move_focus(self, step):
+        # Keyboard navigation over the whole model, scrolling the window when it reaches an edge
+        row_count = self.get_row_count()
+        if not row_count:
+            return 'break'
+        focus = self.focus()
+        row = self.get_row_index(focus) + step if focus in self.row_items else self.first_row
+        row = max(0, min(row, row_count - 1))
+        visible_rows = self.get_visible_rows()
+        if row < self.first_row:
+            self.scroll_rows(row - self.first_row)
+        elif row >= self.first_row + visible_rows:
+            self.scroll_rows(row - self.first_row - visible_rows + 1)
+        item = self.row_items[row - self.first_row]
+        self.selection_set(item)
+        self.focus(item)
+        return 'break'
+
+
 class ListExplorer(ttk.Treeview):
     def __init__(self, parent=None, directory=None, file_types=None, on_folder_selected=None):
         super().__init__(parent)
@@ -192,7 +477,7 @@ class ListExplorer(ttk.Treeview):
         directory = filedialog.askdirectory()
         if directory:
             self.directory = directory
-            self.tree.populate_tree(directory)
+            self.tree.set_root(directory)
 
     def toggle_selection(self, file_path):
         # Calculate the hash of the file path
@@ -0,0 +1,129 @@
+import os
+
+from file_parser import ParserManager, map_batches
+
+
+def find_renames(parser, buffer, old_name, new_name):
+    # (line_index, old_line, new_line) for each line of buffer where old_name appears as a whole
+    # identifier, outside comments and strings. Line indexes are 0-based, as Change line numbers are.
+    if old_name not in buffer:
+        return []
+    columns = {}
+    for name, line_number, column, _ in parser.get_identifiers(buffer):
+        if name == old_name:
+            columns.setdefault(line_number - 1, []).append(column)
+
+    lines = buffer.split('\n')
+    renames = []
+    for line_index in sorted(columns):
+        old_line = lines[line_index] + '\n' if line_index < len(lines) - 1 else lines[line_index]
+        new_line = old_line
+        # Right to left, so the columns still to replace keep their place
+        for column in reversed(columns[line_index]):
+            new_line = new_line[:column] + new_name + new_line[column + len(old_name):]
+        renames.append((line_index, old_line, new_line))
+    return renames
+
+
+class RenameEngine:
+    """Finds the lines to change to rename an identifier across files.
+
+    Names are matched with each language parser's identifier tokens, so longer identifiers
+    that contain the name, and the name inside comments and strings, are left alone. Files
+    the symbol index knows to be free of the name are skipped, the rest are read and matched
+    in a process pool, and the renames of each file are yielded as soon as its batch is done.
+    """
+
+    def __init__(self, parser_manager, workers=None, batch_bytes=1 << 20):
+        self.parser_manager = parser_manager
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_bytes = batch_bytes
+
+    def candidates(self, old_name, file_paths):
+        # The files that may use old_name, leaving out those indexed since their last save that do not
+        symbol_index = self.parser_manager.symbol_index
+        if symbol_index is None:
+            return list(file_paths)
+        indexed = symbol_index.files_with(old_name)
+        return [file_path for file_path in file_paths
+                if file_path in indexed or not symbol_index.is_current(file_path)]
+
+    def iter_renames(self, old_name, new_name, file_paths, cancel_event=None, progress=None, buffers=None):
+        # Yield (file_path, renames) for each candidate file, renames as find_renames gives them, or
+        # None if the file could not be read. progress(done, total) is called after each file.
+        # buffers maps files whose content is not the one on disk, such as files with pending changes,
+        # to that content, which is matched in this thread.
+        # Set cancel_event (a threading.Event) or close the generator to stop early.
+        buffers = buffers or {}
+        in_memory = [file_path for file_path in file_paths if file_path in buffers]
+        paths = self.candidates(old_name, [file_path for file_path in file_paths if file_path not in buffers])
+        total = len(in_memory) + len(paths)
+        done = 0
+        for file_path in in_memory:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            parser = self.parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+            yield file_path, find_renames(parser, buffers[file_path], old_name, new_name)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+        if self.workers == 1 or len(paths) <= 1:
+            # Not worth starting a pool
+            for file_path in paths:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                yield rename_file(self.parser_manager, file_path, old_name, new_name)
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+            return
+
+        args = (old_name, new_name)
+        batches = map_batches(rename_batch, paths, args, self.workers, cancel_event, self.batch_bytes)
+        try:
+            for batch, future in batches:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Error renaming {old_name}: {e}")
+                    results = [(file_path, None) for file_path in batch]
+
+                for file_path, renames in results:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    yield file_path, renames
+                    done += 1
+                    if progress is not None:
+                        progress(done, total)
+        finally:
+            batches.close()
+
+
+def rename_file(parser_manager, file_path, old_name, new_name):
+    parser = parser_manager.get_parser(os.path.splitext(file_path)[1], file_path)
+    try:
+        buffer = parser.read_buffer(file_path)
+    except Exception as e:
+        print(f"Error reading file: {e}")
+        return file_path, None
+    return file_path, find_renames(parser, buffer, old_name, new_name)
+
+
+_worker_parser_manager = None
+
+
+def rename_batch(paths, old_name, new_name):
+    # Runs inside a pool process, which keeps its ParserManager for all of its batches
+    global _worker_parser_manager
+    if _worker_parser_manager is None:
+        _worker_parser_manager = ParserManager()
+
+    results = []
+    for file_path in paths:
+        try:
+            results.append(rename_file(_worker_parser_manager, file_path, old_name, new_name))
+        except Exception as e:
+            print(f"Error renaming in {file_path}: {e}")
+            results.append((file_path, None))
+    return results
@@ -0,0 +1,136 @@
+import codecs
+import re
+
+# UTF-32 first, as its little-endian BOM starts with the UTF-16 one
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# Codecs that keep the byte order of a UTF-16 or UTF-32 BOM, where 'utf-16' and 'utf-32' would write the
+# machine's own; they write no BOM, so it is put back as a leading U+FEFF
+BYTE_ORDER_ENCODINGS = {
+    codecs.BOM_UTF32_LE: 'utf-32-le',
+    codecs.BOM_UTF32_BE: 'utf-32-be',
+    codecs.BOM_UTF16_LE: 'utf-16-le',
+    codecs.BOM_UTF16_BE: 'utf-16-be',
+}
+NEWLINE_PATTERN = re.compile(r'\r\n?|\n')
+# PEP 263 style cookie, which also matches Emacs '-*- coding: x -*-' and vim 'fileencoding=x' in any comment syntax
+COOKIE_PATTERN = re.compile(rb'coding[:=][ \t]*([-\w.]+)')
+FALLBACK_ENCODING = 'latin-1'  # Decodes any bytes, and encodes them back unchanged
+VALIDATE_BYTES = 1 << 24  # Bytes checked as UTF-8 at a time
+
+
+def is_ascii_compatible(encoding):
+    # Whether ASCII text, newlines included, is the same bytes in encoding, after any BOM it starts with
+    try:
+        encoder = codecs.getincrementalencoder(encoding)()
+        encoder.encode('a')
+        return encoder.encode('a\n') == b'a\n'
+    except (LookupError, UnicodeError):
+        return False
+
+
+def get_bom(data):
+    # (bom, encoding) for data starting with a byte order mark, else (b'', None)
+    head = bytes(data[:4])
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return bom, encoding
+    return b'', None
+
+
+def get_declared_encoding(data):
+    # The encoding a BOM or a coding cookie in the first two lines declares, or None
+    _, encoding = get_bom(data)
+    if encoding is not None:
+        return encoding
+    head = bytes(data[:1024])
+    first_lines = b'\n'.join(head.split(b'\n', 2)[:2])
+    match = COOKIE_PATTERN.search(first_lines)
+    if match is None:
+        return None
+    try:
+        encoding = codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
+    # The cookie was read as ASCII, so only an encoding that keeps ASCII as is can be trusted
+    return encoding if is_ascii_compatible(encoding) else None
+
+
+def is_utf8(data):
+    # Whether data, bytes or a map, is valid UTF-8, checked a chunk at a time without copying it whole
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    length = len(data)
+    try:
+        for start in range(0, length, VALIDATE_BYTES):
+            chunk = data[start:start + VALIDATE_BYTES]
+            if not chunk.isascii():
+                decoder.decode(chunk)
+            elif decoder.getstate()[0]:
+                decoder.decode(chunk)  # Completes or rejects a sequence cut by the last chunk
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_encoding(data):
+    # The encoding to read data with: the declared one, else UTF-8 if it decodes, else FALLBACK_ENCODING.
+    # Mixed-encoding files thus read as FALLBACK_ENCODING, which never fails and saves them unchanged.
+    declared = get_declared_encoding(data)
+    if declared is None or declared == 'utf-8':
+        return 'utf-8' if is_utf8(data) else FALLBACK_ENCODING
+    return declared
+
+
+def get_write_encoding(data, encoding):
+    # (encoding, bom) that write text decoded from data in encoding back to the same bytes, bom being
+    # the text to write first, '\ufeff' or ''
+    bom, _ = get_bom(data)
+    if bom in BYTE_ORDER_ENCODINGS:
+        return BYTE_ORDER_ENCODINGS[bom], '\ufeff'
+    return encoding, ''
+
+
+def get_newline(text):
+    # The line ending of the first line of text that has one, '\n' if none does
+    match = NEWLINE_PATTERN.search(text)
+    return match.group() if match else '\n'
+
+
+def decode_source(data, translate=True):
+    # (text, encoding) for the bytes of a source file, newlines translated as open(path, 'r') does
+    # unless translate is False. text never holds the BOM.
+    declared = get_declared_encoding(data)
+    if declared is None and data.isascii():
+        # Most source files take this path, which is a plain copy
+        text, encoding = data.decode('ascii'), 'utf-8'
+    else:
+        encoding = declared or 'utf-8'
+        try:
+            text = data.decode(encoding)
+        except UnicodeDecodeError:
+            encoding = FALLBACK_ENCODING if is_ascii_compatible(encoding) else encoding
+            text = data.decode(encoding, 'replace')
+    if translate and '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, encoding
+
+
+def read_source(file_path):
+    with open(file_path, 'rb') as file:
+        return decode_source(file.read())
+
+
+def open_source(file_path):
+    # A text file object for streaming file_path, in the encoding its start declares, else UTF-8.
+    # Bytes that do not decode come through as lone surrogates instead of stopping the read.
+    with open(file_path, 'rb') as file:
+        head = file.read(1024)
+    encoding = get_declared_encoding(head) or 'utf-8'
+    errors = 'surrogateescape' if is_ascii_compatible(encoding) else 'replace'
+    return open(file_path, 'r', encoding=encoding, errors=errors)
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+
+from parse_cache import default_cache_dir
+
+
+class SymbolIndex:
+    """On-disk inverted index from identifier to the places it appears.
+
+    Each occurrence is stored as (name, file, line, column, kind), kind being the type the
+    parser gave the line, and is looked up through an index on name. Files are stored with
+    the size and mtime they had when indexed, so a file is only re-indexed once those
+    change, and all of its rows are replaced in one transaction.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(self.cache_dir, 'symbols.db'), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS kinds (id INTEGER PRIMARY KEY, label TEXT UNIQUE)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS occurrences (name TEXT, file_id INTEGER, line INTEGER, column INTEGER, kind_id INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS occurrences_by_name ON occurrences (name)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS occurrences_by_file ON occurrences (file_id)')
+        self.connection.commit()
+        self.kind_ids = dict(self.connection.execute('SELECT label, id FROM kinds'))
+
+    def stale_stat(self, file_path):
+        # The stat of the file if it was never indexed or changed since, else None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.connection.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (file_path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return None
+        return stat
+
+    def is_current(self, file_path):
+        return os.path.exists(file_path) and self.stale_stat(file_path) is None
+
+    def get_kind_id(self, label):
+        kind_id = self.kind_ids.get(label)
+        if kind_id is None:
+            kind_id = self.connection.execute('INSERT INTO kinds (label) VALUES (?)', (label,)).lastrowid
+            self.kind_ids[label] = kind_id
+        return kind_id
+
+    def update(self, file_path, stat, identifiers):
+        self.update_many([(file_path, stat, identifiers)])
+
+    def update_many(self, entries):
+        # entries are (file_path, stat, identifiers): the stat taken before the file was read and the
+        # (name, line, column, kind) tuples from FileParser.get_identifiers
+        with self.lock:
+            for file_path, stat, identifiers in entries:
+                # Skip the update if the file changed while it was being parsed
+                try:
+                    current = os.stat(file_path)
+                except OSError:
+                    continue
+                if current.st_size != stat.st_size or current.st_mtime_ns != stat.st_mtime_ns:
+                    continue
+
+                row = self.connection.execute('SELECT id FROM files WHERE path = ?', (file_path,)).fetchone()
+                if row is None:
+                    file_id = self.connection.execute('INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)',
+                                                      (file_path, stat.st_size, stat.st_mtime_ns)).lastrowid
+                else:
+                    file_id = row[0]
+                    self.connection.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?', (stat.st_size, stat.st_mtime_ns, file_id))
+                    self.connection.execute('DELETE FROM occurrences WHERE file_id = ?', (file_id,))
+                self.connection.executemany('INSERT INTO occurrences VALUES (?, ?, ?, ?, ?)',
+                                            [(name, file_id, line, column, self.get_kind_id(kind))
+                                             for name, line, column, kind in identifiers])
+            self.connection.commit()
+
+    def remove(self, file_path):
+        self.remove_many([file_path])
+
+    def remove_many(self, file_paths):
+        # Drop the rows of files in one transaction
+        with self.lock:
+            for file_path in file_paths:
+                row = self.connection.execute('SELECT id FROM files WHERE path = ?', (file_path,)).fetchone()
+                if row is not None:
+                    self.connection.execute('DELETE FROM occurrences WHERE file_id = ?', (row[0],))
+                    self.connection.execute('DELETE FROM files WHERE id = ?', (row[0],))
+            self.connection.commit()
+
+    def find(self, name):
+        # (file_path, line, column, kind) of every occurrence of name, by file and position
+        with self.lock:
+            return self.connection.execute(
+                'SELECT files.path, occurrences.line, occurrences.column, kinds.label FROM occurrences '
+                'JOIN files ON files.id = occurrences.file_id LEFT JOIN kinds ON kinds.id = occurrences.kind_id '
+                'WHERE occurrences.name = ? ORDER BY files.path, occurrences.line, occurrences.column', (name,)).fetchall()
+
+    def files_with(self, name):
+        # Paths of the indexed files where name appears
+        with self.lock:
+            return {path for path, in self.connection.execute(
+                'SELECT DISTINCT files.path FROM occurrences JOIN files ON files.id = occurrences.file_id '
+                'WHERE occurrences.name = ?', (name,))}
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM occurrences')
+            self.connection.execute('DELETE FROM files')
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()